@@ -0,0 +1,102 @@
+# benchmark_relatorio.py
+# Mede o tempo de gerar_relatorio_saidas com um histórico de saídas sintético.
+# Os dados e o relatório são criados em uma pasta temporária; os dados reais
+# do estoque não são tocados.
+#
+# Uso: python benchmark_relatorio.py [quantidade de saídas] [continuo|lote]
+# Com "continuo" o relatório é gerado no modo contínuo (blocos e constant_memory).
+# Com "lote" compara os doze relatórios mensais gerados um a um com os mesmos
+# relatórios gerados de uma vez por relatorios.gerar_lote.
+
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from estoque import banco, datas, relatorios
+
+PREFIXOS = ['PR-AB', 'PR-CD', 'PR-EF', 'PR-GH', 'PP-XY', '-']
+CLASSIFICACOES = ['AERO', 'AUTO', 'EPI', 'CONS']
+
+
+def gerar_saidas(caminho, quantidade):
+    """Grava um histórico de saídas espalhado pelo ano de 2024."""
+    aleatorio = random.Random(42)
+    with open(caminho, 'w', encoding='utf-8') as file:
+        for i in range(quantidade):
+            data = f'{aleatorio.randint(1, 28):02d}/{aleatorio.randint(1, 12):02d}/2024'
+            saida = {
+                'produto_id': aleatorio.randint(1, 5000),
+                'data': data,
+                'nome': f'Produto {aleatorio.randint(1, 2000)}',
+                'modelo': f'Modelo {aleatorio.randint(1, 300)}',
+                'classificacao': aleatorio.choice(CLASSIFICACOES),
+                'condicao': aleatorio.choice(['NOVO', 'USADO']),
+                'quantidade': aleatorio.randint(1, 10),
+                'valor': round(aleatorio.uniform(1, 5000), 2),
+                'frete_proporcional': round(aleatorio.uniform(0, 50), 2),
+                'valor_frete_total': 0,
+                'origem': f'Fornecedor {aleatorio.randint(1, 40)}',
+                'partNumber': f'PN-{aleatorio.randint(1, 3000)}',
+                'serialNumber': f'SN-{i}',
+                'frete_original': 0,
+                'prefixo_aviao': aleatorio.choice(PREFIXOS),
+                'observacoes': 'N/A',
+            }
+            saida[datas.CAMPO] = datas.ordenavel(data)
+            file.write(json.dumps(saida, ensure_ascii=False) + '\n')
+
+
+def medir_lote(pasta):
+    meses = datas.meses(2024)
+    inicio = time.perf_counter()
+    for data_inicial, data_final in meses:
+        relatorios.gerar_relatorio_saidas(data_inicial, data_final)
+    um_a_um = time.perf_counter() - inicio
+
+    # Sem os arquivos anteriores o cache não reaproveita nada
+    for nome in os.listdir(pasta):
+        if nome.endswith('.xlsx'):
+            os.remove(os.path.join(pasta, nome))
+    inicio = time.perf_counter()
+    relatorios.gerar_lote(pasta, meses)
+    de_uma_vez = time.perf_counter() - inicio
+    print(f"12 relatórios mensais: um a um {um_a_um:.2f} s, em lote {de_uma_vez:.2f} s "
+          f"({os.cpu_count()} processadores)")
+
+
+def main():
+    quantidade = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    continuo = True if sys.argv[2:] == ['continuo'] else None
+    lote = sys.argv[2:] == ['lote']
+
+    with tempfile.TemporaryDirectory() as pasta:
+        os.chdir(pasta)
+        os.makedirs(banco.PASTA)
+        gerar_saidas(os.path.join(banco.PASTA, 'estoque_saidas.jsonl'), quantidade)
+        with open(banco.ARQUIVO_VERSAO, 'w') as file:
+            json.dump({'versao': banco.VERSAO_DADOS}, file)
+        # Relatório e log vão para a pasta temporária
+        relatorios.criar_pasta_relatorios = lambda: pasta
+        relatorios.configurar_log = lambda: None
+
+        banco.carregar_dados()
+        if lote:
+            medir_lote(pasta)
+            return
+
+        inicio = time.perf_counter()
+        caminho = relatorios.gerar_relatorio_saidas('01/01/2024', '31/12/2024', continuo)
+        fim = time.perf_counter()
+
+        if caminho:
+            print(f"{quantidade} saídas: {fim - inicio:.2f} s "
+                  f"({os.path.getsize(caminho) / 1024 / 1024:.1f} MB)")
+
+
+if __name__ == '__main__':
+    main()
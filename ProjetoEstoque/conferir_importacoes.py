@@ -0,0 +1,37 @@
+# conferir_importacoes.py
+# Confere que a inicialização não importa módulos pesados (pandas,
+# xlsxwriter, keyboard; ver main.MODULOS_PESADOS). Importa o main e carrega
+# os dados em um interpretador novo, com uma pasta de dados temporária, e
+# termina com código 1 se algum deles foi importado.
+#
+# Uso: python conferir_importacoes.py
+
+import os
+import subprocess
+import sys
+import tempfile
+
+RAIZ = os.path.dirname(os.path.abspath(__file__))
+
+INICIALIZACAO = f"""
+import sys
+sys.path.insert(0, {RAIZ!r})
+import main
+from estoque import banco
+banco.carregar_dados()
+sys.exit(0 if main.conferir_importacoes() else 1)
+"""
+
+
+def main():
+    with tempfile.TemporaryDirectory() as pasta:
+        resultado = subprocess.run([sys.executable, '-c', INICIALIZACAO], cwd=pasta)
+    if resultado.returncode:
+        print("Falhou: a inicialização importa módulos pesados (ou não terminou).")
+        return 1
+    print("Ok: nenhum módulo pesado importado na inicialização.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
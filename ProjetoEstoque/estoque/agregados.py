@@ -0,0 +1,172 @@
+# agregados.py
+# Totais diários das saídas (expedições): para cada dia, a quantidade somada
+# de cada item por classificação e prefixo. O relatório tira daqui a aba
+# Saídas e os totais das abas, sem reler as saídas uma a uma; um ano inteiro
+# são alguns milhares de linhas de agregado.
+#
+# Como o índice de saídas, os agregados ficam em backup/cache junto com até
+# onde o histórico já foi somado; o que foi acrescentado depois é somado na
+# próxima consulta, e cada saída registrada enquanto o programa roda entra na
+# hora (ver banco.observar_historico).
+
+import marshal
+import os
+
+from estoque import banco, datas
+
+TIPO = 'estoque_saidas'
+VERSAO = 1
+ARQUIVO = os.path.join(banco.PASTA_CACHE, 'agregados_saidas.marshal')
+
+# Campos de texto e numéricos que identificam o item, na ordem da chave
+CAMPOS_TEXTO = ('classificacao', 'prefixo_aviao', 'nome', 'modelo', 'partNumber', 'origem')
+CAMPOS_NUMERO = ('valor', 'frete_proporcional')
+
+_carregado = False
+_alterado = False
+# Histórico somado (ver banco.estado_historico) e até que posição
+_identidade = None
+_coberto = 0
+# dia (AAAAMMDD) -> {(classificacao, prefixo, nome, modelo, partNumber,
+#                    origem, valor, frete): quantidade}
+_por_dia = {}
+
+
+def _texto(registro, campo):
+    # O mesmo valor que a coluna terá no relatório (fillna('-').astype(str))
+    valor = registro.get(campo)
+    return '-' if valor is None else str(valor)
+
+
+def _numero(valor):
+    # Como pd.to_numeric(errors='coerce').fillna(0)
+    try:
+        numero = float(valor)
+    except (TypeError, ValueError):
+        return 0.0
+    return 0.0 if numero != numero else numero
+
+
+def _adicionar(registro):
+    dia = datas.carimbar(registro) // 1000000
+    chave = tuple(_texto(registro, campo) for campo in CAMPOS_TEXTO) + \
+        tuple(_numero(registro.get(campo)) for campo in CAMPOS_NUMERO)
+    itens = _por_dia.setdefault(dia, {})
+    itens[chave] = itens.get(chave, 0.0) + _numero(registro.get('quantidade'))
+
+
+def _limpar():
+    global _coberto, _alterado
+
+    _coberto = 0
+    _alterado = True
+    _por_dia.clear()
+
+
+def _ler_salvo(identidade):
+    global _coberto
+
+    try:
+        with open(ARQUIVO, 'rb') as file:
+            versao, identidade_salva, coberto, por_dia = marshal.loads(file.read())
+    except (OSError, EOFError, ValueError, TypeError):
+        return
+    if versao != VERSAO or identidade_salva != identidade:
+        return
+    _coberto = coberto
+    _por_dia.update(por_dia)
+
+
+def _salvar():
+    global _alterado
+
+    try:
+        os.makedirs(banco.PASTA_CACHE, exist_ok=True)
+        with open(ARQUIVO + '.tmp', 'wb') as file:
+            file.write(marshal.dumps((VERSAO, _identidade, _coberto, _por_dia)))
+        os.replace(ARQUIVO + '.tmp', ARQUIVO)
+        _alterado = False
+    except (OSError, ValueError):
+        # Os agregados podem sempre ser refeitos a partir do histórico
+        pass
+
+
+def _atualizar():
+    """Carrega os agregados salvos e soma o que foi acrescentado ao histórico depois deles."""
+    global _carregado, _identidade, _coberto, _alterado
+
+    if not _carregado:
+        banco.observar_historico(TIPO, anexados)
+    estado = banco.estado_historico(TIPO)
+    if estado is None:
+        # Nenhuma saída registrada ainda
+        _identidade = None
+        _limpar()
+        _alterado = False
+        _carregado = True
+        return
+
+    identidade, fim = estado
+    if not _carregado or identidade != _identidade:
+        _limpar()
+        _identidade = identidade
+        _ler_salvo(identidade)
+        _carregado = True
+    if _coberto > fim:
+        # O histórico foi trocado ou truncado: soma tudo de novo
+        _limpar()
+    if _coberto == fim:
+        return
+
+    for _posicao, seguinte, registro in banco.historico_desde(TIPO, _coberto):
+        _adicionar(registro)
+        _coberto = seguinte
+    _alterado = True
+
+
+def anexados(posicoes, fim, registros):
+    """
+    Chamado pelo banco logo após acrescentar saídas ao histórico, com a
+    posição de cada uma e onde o histórico termina agora.
+    """
+    global _coberto, _alterado
+
+    if not posicoes or posicoes[0] != _coberto:
+        # Há algo antes delas ainda não somado: a próxima consulta lê tudo
+        return
+    for registro in registros:
+        _adicionar(registro)
+    _coberto = fim
+    _alterado = True
+
+
+def no_periodo(inicio, fim):
+    """
+    Quantidade de cada item nas saídas com data_ts entre inicio e fim
+    (inclusive), somada nos dias do período: {chave: quantidade}, com a chave
+    na ordem de CAMPOS_TEXTO e CAMPOS_NUMERO. Os dias são inteiros, então o
+    horário de inicio e fim é ignorado.
+    """
+    _atualizar()
+    if _alterado:
+        _salvar()
+
+    primeiro, ultimo = inicio // 1000000, fim // 1000000
+    totais = {}
+    for dia, itens in _por_dia.items():
+        if primeiro <= dia <= ultimo:
+            for chave, quantidade in itens.items():
+                totais[chave] = totais.get(chave, 0.0) + quantidade
+    return totais
+
+
+def instantaneo(inicio, fim):
+    """
+    Os totais do período (como no_periodo) e a versão do histórico que eles
+    cobrem, [identificação, posição], ou None se não há histórico. Um
+    relatório que leia só as saídas antes dessa posição fica de acordo com os
+    totais, mesmo que outras saídas sejam registradas enquanto ele é gerado.
+    """
+    totais = no_periodo(inicio, fim)
+    versao = None if _identidade is None else [list(_identidade), _coberto]
+    return versao, totais
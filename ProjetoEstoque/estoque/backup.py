@@ -1,22 +1,351 @@
 # backup.py
-import shutil
-import os
+# Cópias de segurança dos dados, feitas a cada encerramento. Cada cópia (uma
+# geração) é um manifesto pequeno em backup/geracoes com a lista dos pedaços
+# de cada coleção e de cada histórico. Os pedaços ficam comprimidos em
+# backup/objetos, com o nome tirado do próprio conteúdo (sha256): um pedaço
+# que já existe não é gravado de novo, então cada geração só ocupa o espaço do
+# que mudou desde a anterior.
+#
+# Os pedaços são feitos de registros inteiros (uma linha JSON cada) e o corte
+# depende do conteúdo das linhas (ver _pedacos): alterar, incluir ou remover
+# um produto muda só o pedaço onde ele está. Os históricos só recebem
+# registros no final, então a geração nova aproveita os pedaços da anterior e
+# só lê o histórico a partir do início do último pedaço.
+#
+# O catálogo (backup/catalogo.json) resume cada geração: data, quantidade de
+# registros de cada coleção e histórico e o sha256 do manifesto. O inventário
+# (backup/inventario_objetos.json) guarda o tamanho de cada pedaço. Listar as
+# gerações e somar o espaço ocupado só leem esses dois arquivos, sem percorrer
+# as pastas (ver restauracao.py e retencao.py). Só os nomes em backup/geracoes
+# são listados, para conferir se o catálogo tem todas as gerações: ele pode
+# ter ficado para trás se o processo parou entre o manifesto e o catálogo.
+
+import hashlib
 import json
-from estoque import banco
+import lzma
+import os
+import zlib
+from datetime import datetime
+
+from estoque import banco, travas
 
 BACKUP_DIR = 'backup/'
+PASTA_OBJETOS = os.path.join(BACKUP_DIR, 'objetos')
+PASTA_GERACOES = os.path.join(BACKUP_DIR, 'geracoes')
+CATALOGO = os.path.join(BACKUP_DIR, 'catalogo.json')
+INVENTARIO = os.path.join(BACKUP_DIR, 'inventario_objetos.json')
+ARQUIVO_TRAVA = os.path.join(BACKUP_DIR, 'backups.lock')
+VERSAO = 1
+
+# 'zlib' (mais rápido) ou 'lzma' (menor); gerações podem misturar os dois
+COMPRESSAO = os.environ.get('ESTOQUE_BACKUP_COMPRESSAO', 'zlib')
+# Tamanho médio e máximo de um pedaço, em registros
+MEDIA_REGISTROS = 256
+MAXIMO_REGISTROS = 4 * MEDIA_REGISTROS
+
+# Nome -> (marca no início do objeto, comprimir, descomprimir)
+_COMPRESSORES = {
+    'zlib': (b'z', zlib.compress, zlib.decompress),
+    'lzma': (b'x', lzma.compress, lzma.decompress),
+}
+
+
+def trava():
+    """
+    Uma geração sendo gravada e a compactação (retencao.py, em segundo plano)
+    não podem rodar juntas, nem em processos diferentes: a compactação
+    apagaria pedaços ainda sem manifesto, e de dois backups ao mesmo tempo um
+    perderia a sua entrada no catálogo.
+    """
+    return travas.travar(ARQUIVO_TRAVA)
+
+
+def caminho_objeto(chave):
+    return os.path.join(PASTA_OBJETOS, chave[:2], chave[2:])
+
+
+def _gravar_objeto(dados):
+    """Grava o pedaço comprimido, se ainda não existe. Devolve a chave e os bytes gravados."""
+    chave = hashlib.sha256(dados).hexdigest()
+    caminho = caminho_objeto(chave)
+    if os.path.exists(caminho):
+        return chave, 0
+
+    marca, comprimir, _descomprimir = _COMPRESSORES[COMPRESSAO]
+    conteudo = marca + comprimir(dados)
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    with open(caminho + '.tmp', 'wb') as file:
+        file.write(conteudo)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(caminho + '.tmp', caminho)
+    return chave, len(conteudo)
+
+
+def ler_objeto(chave):
+    """Conteúdo de um pedaço, conferido com a chave (ValueError se estiver corrompido)."""
+    with open(caminho_objeto(chave), 'rb') as file:
+        conteudo = file.read()
+    for marca, _comprimir, descomprimir in _COMPRESSORES.values():
+        if conteudo[:1] == marca:
+            try:
+                dados = descomprimir(conteudo[1:])
+            except (zlib.error, lzma.LZMAError) as e:
+                raise ValueError(f"Objeto de backup corrompido: {chave}") from e
+            if hashlib.sha256(dados).hexdigest() != chave:
+                raise ValueError(f"Objeto de backup corrompido: {chave}")
+            return dados
+    raise ValueError(f"Objeto de backup em formato desconhecido: {chave}")
+
+
+def _linha(registro):
+    return (json.dumps(registro, ensure_ascii=False) + '\n').encode('utf-8')
+
+
+def _pedacos(itens):
+    """
+    Agrupa os itens (posição, linha) em pedaços: um pedaço termina depois de
+    uma linha cujo crc32 é múltiplo de MEDIA_REGISTROS, ou ao chegar a
+    MAXIMO_REGISTROS linhas. Devolve (posição da primeira linha, quantidade
+    de linhas, conteúdo) de cada pedaço.
+    """
+    linhas = []
+    inicio = None
+    for posicao, linha in itens:
+        if not linhas:
+            inicio = posicao
+        linhas.append(linha)
+        if zlib.crc32(linha) % MEDIA_REGISTROS == 0 or len(linhas) >= MAXIMO_REGISTROS:
+            yield inicio, len(linhas), b''.join(linhas)
+            linhas = []
+    if linhas:
+        yield inicio, len(linhas), b''.join(linhas)
+
+
+def listar_geracoes():
+    """Nomes das gerações salvas, da mais antiga para a mais recente."""
+    try:
+        nomes = os.listdir(PASTA_GERACOES)
+    except FileNotFoundError:
+        return []
+    return sorted(nome[:-5] for nome in nomes if nome.endswith('.json'))
+
+
+def ler_manifesto(nome):
+    with open(os.path.join(PASTA_GERACOES, nome + '.json'), 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+def _entrada_catalogo(nome, manifesto, conteudo):
+    contagens = {colecao: sum(pedaco[1] for pedaco in pedacos)
+                 for colecao, pedacos in manifesto['colecoes'].items()}
+    contagens.update({tipo: sum(pedaco[2] for pedaco in historico['pedacos'])
+                      for tipo, historico in manifesto['historicos'].items()})
+    return {
+        'nome': nome,
+        'data': manifesto['data'],
+        'registros': contagens,
+        'sha256': hashlib.sha256(conteudo).hexdigest(),
+    }
+
+
+def _gravar_json(caminho, dados):
+    try:
+        with open(caminho + '.tmp', 'w', encoding='utf-8') as file:
+            json.dump(dados, file, ensure_ascii=False, indent=2)
+        os.replace(caminho + '.tmp', caminho)
+    except OSError:
+        # O catálogo e o inventário são refeitos percorrendo as pastas quando faltarem
+        pass
+
+
+def gravar_catalogo(entradas):
+    _gravar_json(CATALOGO, entradas)
+
+
+def catalogo(gravar=True):
+    """
+    Resumo das gerações, da mais antiga para a mais recente: nome, data,
+    registros (quantidade por coleção e histórico) e sha256 do manifesto. Se
+    o catálogo faltar ou não tiver as mesmas gerações de backup/geracoes, ele
+    é refeito a partir dos manifestos (e gravado, se gravar for verdadeiro).
+    """
+    try:
+        with open(CATALOGO, 'r', encoding='utf-8') as file:
+            gravadas = json.load(file)
+    except (OSError, ValueError):
+        gravadas = []
+
+    nomes = listar_geracoes()
+    if gravadas and [entrada['nome'] for entrada in gravadas] == nomes:
+        return gravadas
+
+    # Só os manifestos que faltam no catálogo são lidos
+    conhecidas = {entrada['nome']: entrada for entrada in gravadas}
+    entradas = []
+    for nome in nomes:
+        if nome in conhecidas:
+            entradas.append(conhecidas[nome])
+            continue
+        try:
+            with open(os.path.join(PASTA_GERACOES, nome + '.json'), 'rb') as file:
+                conteudo = file.read()
+            entradas.append(_entrada_catalogo(nome, json.loads(conteudo), conteudo))
+        except (OSError, ValueError, KeyError):
+            continue
+    if entradas != gravadas and gravar:
+        gravar_catalogo(entradas)
+    return entradas
+
+
+def gravar_inventario(objetos):
+    _gravar_json(INVENTARIO, objetos)
+
+
+def inventario(gravar=True):
+    """
+    Pedaços guardados e o tamanho de cada um em disco: {chave: bytes}. Só se
+    o inventário faltar ele é refeito percorrendo backup/objetos (e gravado,
+    se gravar for verdadeiro).
+    """
+    try:
+        with open(INVENTARIO, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        pass
+
+    objetos = {}
+    for pasta, _subpastas, arquivos in os.walk(PASTA_OBJETOS):
+        for arquivo in arquivos:
+            if not arquivo.endswith('.tmp'):
+                chave = os.path.basename(pasta) + arquivo
+                objetos[chave] = os.path.getsize(os.path.join(pasta, arquivo))
+    if objetos and gravar:
+        gravar_inventario(objetos)
+    return objetos
+
+
+def chaves(manifesto):
+    """Chaves de todos os pedaços usados pela geração."""
+    usadas = {pedaco[0] for pedacos in manifesto['colecoes'].values() for pedaco in pedacos}
+    usadas.update(pedaco[0] for historico in manifesto['historicos'].values()
+                  for pedaco in historico['pedacos'])
+    return usadas
+
+
+def _ultimo_manifesto():
+    for entrada in reversed(catalogo()):
+        try:
+            manifesto = ler_manifesto(entrada['nome'])
+        except (OSError, ValueError):
+            continue
+        if manifesto.get('versao') == VERSAO:
+            return manifesto
+    return None
+
+
+def registros(manifesto, nome):
+    """Percorre os registros de uma coleção ou histórico da geração."""
+    if nome in manifesto['colecoes']:
+        pedacos = manifesto['colecoes'][nome]
+    else:
+        pedacos = manifesto['historicos'][nome]['pedacos']
+    for pedaco in pedacos:
+        for linha in ler_objeto(pedaco[0]).splitlines():
+            yield json.loads(linha)
+
+
+def _copiar_colecao(colecao, gravados):
+    itens = ((i, _linha(registro)) for i, registro in enumerate(getattr(banco, colecao)))
+    pedacos = []
+    for _inicio, quantidade, dados in _pedacos(itens):
+        chave, tamanho = _gravar_objeto(dados)
+        gravados.append((chave, tamanho))
+        pedacos.append([chave, quantidade])
+    return pedacos
+
+
+def _copiar_historico(tipo, anterior, gravados, objetos):
+    """
+    Pedaços do histórico. Se ele é o mesmo da geração anterior (só cresceu) e
+    os pedaços dela continuam no inventário, eles são mantidos e só o último
+    é refeito junto com o que foi acrescentado depois.
+    """
+    estado = banco.estado_historico(tipo)
+    if estado is None:
+        return None
+    identidade, fim = estado
+
+    pedacos = []
+    inicio = 0
+    if (anterior and anterior['identidade'] == list(identidade) and anterior['fim'] <= fim
+            and all(pedaco[0] in objetos for pedaco in anterior['pedacos'])):
+        pedacos = anterior['pedacos'][:-1]
+        if anterior['pedacos']:
+            inicio = anterior['pedacos'][-1][1]
+
+    itens = ((posicao, _linha(registro))
+             for posicao, _seguinte, registro in banco.historico_desde(tipo, inicio)
+             if posicao < fim)
+    for posicao, quantidade, dados in _pedacos(itens):
+        chave, tamanho = _gravar_objeto(dados)
+        gravados.append((chave, tamanho))
+        pedacos.append([chave, posicao, quantidade])
+    return {'identidade': list(identidade), 'fim': fim, 'pedacos': pedacos}
+
+
+def _nome_geracao():
+    nome = datetime.now().strftime('%Y%m%d_%H%M%S')
+    numero = 1
+    candidato = nome
+    while os.path.exists(os.path.join(PASTA_GERACOES, candidato + '.json')):
+        numero += 1
+        candidato = f'{nome}_{numero}'
+    return candidato
 
 
 def salvar_backup():
-    if not os.path.exists(BACKUP_DIR):
-        os.makedirs(BACKUP_DIR)
-
-    arquivo_backup = os.path.join(BACKUP_DIR, 'estoque_backup.json')
-    with open(arquivo_backup, 'w') as file:
-        json.dump({
-            'estoque': banco.estoque,
-            'entradas': banco.entradas,
-            'saidas': banco.saidas,
-            'descarte': banco.descarte
-        }, file, indent=4)
-    print("Backup realizado com sucesso!")
+    """Grava uma nova geração com o estado atual de todas as coleções e históricos."""
+    with trava():
+        nome, gravados = _salvar_geracao()
+    novos = [tamanho for _chave, tamanho in gravados if tamanho]
+    print(f"Backup realizado com sucesso! ({len(novos)} de {len(gravados)} pedaços novos, "
+          f"{sum(novos) / 1024:.1f} KB)")
+    return nome
+
+
+def _salvar_geracao():
+    os.makedirs(PASTA_GERACOES, exist_ok=True)
+
+    entradas = catalogo()
+    objetos = inventario()
+    anterior = _ultimo_manifesto()
+    historicos_anteriores = anterior['historicos'] if anterior else {}
+    gravados = []
+    manifesto = {
+        'versao': VERSAO,
+        'data': datetime.now().strftime('%d/%m/%Y %H:%M:%S'),
+        'backend': banco.BACKEND,
+        'colecoes': {colecao: _copiar_colecao(colecao, gravados)
+                     for colecao in banco.COLECOES},
+        'historicos': {},
+    }
+    for tipo in banco.HISTORICOS:
+        historico = _copiar_historico(tipo, historicos_anteriores.get(tipo), gravados, objetos)
+        if historico is not None:
+            manifesto['historicos'][tipo] = historico
+
+    objetos.update((chave, tamanho) for chave, tamanho in gravados if tamanho)
+    gravar_inventario(objetos)
+
+    # O manifesto por último: uma geração só existe com todos os seus pedaços gravados
+    nome = _nome_geracao()
+    caminho = os.path.join(PASTA_GERACOES, nome + '.json')
+    conteudo = json.dumps(manifesto, ensure_ascii=False).encode('utf-8')
+    with open(caminho + '.tmp', 'wb') as file:
+        file.write(conteudo)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(caminho + '.tmp', caminho)
+    gravar_catalogo(entradas + [_entrada_catalogo(nome, manifesto, conteudo)])
+    return nome, gravados
@@ -1,46 +1,1236 @@
 # banco.py
+import hashlib
 import json
+import marshal
 import os
+import shutil
+import sys
+import time
+from contextlib import contextmanager
+
+from estoque import banco_sqlite, datas, indice_busca, travas
+
+# Onde os dados ficam: 'json' (arquivos JSON + diário) ou 'sqlite'
+BACKEND = os.environ.get('ESTOQUE_BACKEND', 'json')
+
+PASTA = 'backup'
+ARQUIVO_DIARIO = os.path.join(PASTA, 'diario.jsonl')
+ARQUIVO_CHECKPOINT = os.path.join(PASTA, 'diario_checkpoint.json')
+# Cópia binária (marshal) das coleções já interpretadas, para a próxima
+# inicialização não precisar interpretar o JSON de novo
+PASTA_CACHE = os.path.join(PASTA, 'cache')
+# Versão do formato dos dados em disco (ver _migrar_dados)
+ARQUIVO_VERSAO = os.path.join(PASTA, 'versao.json')
+VERSAO_DADOS = 1
+# Arquivos de uma restauração de backup preparados para substituir os atuais
+# (ver concluir_restauracao)
+PASTA_RESTAURACAO = os.path.join(PASTA, 'restauracao')
+# Trava das gravações, para mais de um processo usar a mesma pasta (ver
+# sincronizar)
+ARQUIVO_TRAVA = os.path.join(PASTA, 'estoque.lock')
+
+# Quantidade de gravações acumuladas no diário antes de consolidar tudo
+# nos arquivos JSON (checkpoint)
+LIMITE_DIARIO = 500
+
+COLECOES = ('estoque', 'entradas', 'saidas', 'descarte')
+# Coleções de histórico, lidas do disco só no primeiro acesso
+SOB_DEMANDA = ('entradas', 'saidas', 'descarte')
+# Registros históricos gravados pelas operações (só recebem novos registros)
+HISTORICOS = ('estoque_entradas', 'estoque_saidas', 'estoque_exclusoes')
+# Campos que as operações somam ou subtraem: quando outro processo gravou
+# antes, vale a diferença feita aqui e não o valor (ver _reaplicar)
+CAMPOS_SOMADOS = ('quantidade',)
+
+# Produtos do estoque pelo id, na ordem do estoque. banco.estoque é uma tupla
+# montada a partir daqui (ver __getattr__), só para leitura: os produtos são
+# alterados por inserir, atualizar e remover
+produtos = {}
+_proximo_id = 1
+# entradas, saidas e descarte são criadas no primeiro acesso (ver __getattr__)
+
+# Alterações feitas em memória e ainda não gravadas:
+# (operação, coleção, registro, posição, campos alterados)
+_pendentes = []
+# Número da última gravação lida ou feita (no diário ou no SQLite): a versão
+# dos dados em memória, comparada com a do disco antes de gravar
+_sequencia = 0
+_gravacoes_no_diario = 0
+# Sequência refletida pelo arquivo JSON de cada coleção hoje em disco
+_no_disco = {}
+# Checkpoint lido na carga e alterações do diário guardadas para as coleções
+# ainda não carregadas: coleção -> [(sequência, alteração)]
+_checkpoint = {}
+_diario_adiado = {}
+# Coleções alteradas desde o último checkpoint (só elas são regravadas)
+_sujas = set()
+# id() dos registros inseridos entre as alterações pendentes
+_inseridos = set()
+# id() do registro -> valor de cada campo antes das alterações pendentes
+_originais = {}
+
+# Registros de histórico aguardando a gravação: (tipo, registro)
+_historico_pendente = []
+# Transação em andamento, onde ela começa em _pendentes e como desfazer
+# cada alteração feita nela. O primeiro item do desfazer guarda as coleções
+# sujas e o próximo id do início; se os dados forem relidos no meio, o
+# desfazer é esvaziado e não há o que restaurar
+_em_transacao = False
+_inicio_transacao = 0
+_desfazer = []
+# Marca campos que não existiam antes de uma alteração
+_AUSENTE = object()
+
+
+def _arquivo(colecao):
+    return os.path.join(PASTA, f'{colecao}.json')
+
+
+def _carregada(colecao):
+    return colecao == 'estoque' or colecao in globals()
+
+
+def _lista(colecao):
+    if colecao == 'estoque':
+        # Uma tupla: um append ou remove nela falha, em vez de não gravar nada
+        return tuple(produtos.values())
+    if colecao not in globals():
+        _carregar_colecao(colecao)
+    return globals()[colecao]
+
+
+def __getattr__(nome):
+    # banco.estoque e acesso a banco.entradas, banco.saidas ou banco.descarte
+    # ainda não lidas
+    if nome == 'estoque' or nome in SOB_DEMANDA:
+        return _lista(nome)
+    raise AttributeError(f"module {__name__!r} has no attribute {nome!r}")
+
+
+def _definir_produtos(registros, proximo_id=1):
+    """
+    Monta o dicionário de produtos, dando um id aos que ainda não têm. O
+    contador gravado (proximo_id) não deixa reaproveitar o id de um produto
+    já removido.
+    """
+    global _proximo_id
+
+    produtos.clear()
+    _proximo_id = max([p['id'] + 1 for p in registros if 'id' in p] + [proximo_id])
+    sem_id = False
+    for registro in registros:
+        if 'id' not in registro:
+            registro['id'] = _proximo_id
+            _proximo_id += 1
+            sem_id = True
+        produtos[registro['id']] = registro
+    if sem_id:
+        # Grava os ids novos no próximo checkpoint
+        _sujas.add('estoque')
+
+
+def _guardar_produto(registro):
+    global _proximo_id
+
+    if 'id' not in registro:
+        registro['id'] = _proximo_id
+    _proximo_id = max(_proximo_id, registro['id'] + 1)
+    produtos[registro['id']] = registro
+
+
+def _ordenar_produtos():
+    # Os ids crescem com as inserções: a ordem do estoque é a ordem dos ids
+    itens = sorted(produtos.items())
+    produtos.clear()
+    produtos.update(itens)
+
+
+def _posicao(lista, registro):
+    for i, item in enumerate(lista):
+        if item is registro:
+            return i
+    raise ValueError("Registro não encontrado na coleção")
+
+
+def _escrever_atomico(caminho, conteudo):
+    """Grava em um arquivo temporário e troca pelo definitivo só no final."""
+    temporario = caminho + '.tmp'
+    with open(temporario, 'wb') as file:
+        file.write(conteudo)
+        file.flush()
+        os.fsync(file.fileno())
+    _repetir(os.replace, temporario, caminho)
+
+
+def _repetir(funcao, *args):
+    """
+    No Windows um arquivo aberto por outro processo (lendo, sem a trava) não
+    pode ser trocado nem apagado: tenta de novo por alguns segundos.
+    """
+    for tentativa in range(100):
+        try:
+            return funcao(*args)
+        except PermissionError:
+            if tentativa == 99:
+                raise
+            time.sleep(0.05)
+
+
+# Transações
+
+@contextmanager
+def transacao():
+    """
+    Agrupa as alterações de uma operação do usuário: ao final do bloco tudo é
+    gravado de uma só vez e, se ocorrer um erro no meio, as alterações são
+    desfeitas na memória e nada é gravado.
+    """
+    global _em_transacao, _inicio_transacao
+
+    if _em_transacao:
+        yield
+        return
+
+    _em_transacao = True
+    _inicio_transacao = len(_pendentes)
+    _desfazer.append(('inicio', None, set(_sujas), _proximo_id))
+    try:
+        yield
+        _em_transacao = False
+        salvar_dados()
+    except BaseException:
+        _reverter(_inicio_transacao)
+        raise
+    finally:
+        _em_transacao = False
+        _inicio_transacao = 0
+        _desfazer.clear()
+
+
+def _reverter(inicio):
+    global _proximo_id
+
+    for op, colecao, registro, anterior in reversed(_desfazer):
+        if op == 'inicio':
+            _sujas.clear()
+            _sujas.update(registro)
+            _proximo_id = anterior
+        elif op == 'atualizar':
+            for campo, valor in anterior.items():
+                if valor is _AUSENTE:
+                    registro.pop(campo, None)
+                else:
+                    registro[campo] = valor
+        elif colecao == 'estoque':
+            if op == 'inserir':
+                del produtos[registro['id']]
+            else:
+                produtos[registro['id']] = registro
+        else:
+            lista = _lista(colecao)
+            if op == 'inserir':
+                del lista[_posicao(lista, registro)]
+            else:
+                lista.insert(anterior, registro)
+
+    if any(colecao == 'estoque' for _op, colecao, _r, _a in _desfazer):
+        _ordenar_produtos()
+        indice_busca.reconstruir(produtos.values())
+
+    del _pendentes[inicio:]
+    _historico_pendente.clear()
+    _inseridos.clear()
+    _inseridos.update(id(registro) for op, _c, registro, _p, _a in _pendentes
+                      if op == 'inserir')
+    restantes = {id(registro) for _op, _c, registro, _p, _a in _pendentes}
+    for chave in set(_originais) - restantes:
+        del _originais[chave]
+
+
+# Alterações nas coleções
+
+def inserir(colecao, registro):
+    """Adiciona um registro à coleção e o marca para gravação."""
+    if colecao == 'estoque':
+        _guardar_produto(registro)
+    else:
+        if colecao == 'descarte':
+            datas.carimbar(registro)
+        _lista(colecao).append(registro)
+    _pendentes.append(('inserir', colecao, registro, None, None))
+    _inseridos.add(id(registro))
+    _sujas.add(colecao)
+    if colecao == 'estoque':
+        indice_busca.adicionar(registro)
+    if _em_transacao:
+        _desfazer.append(('inserir', colecao, registro, None))
+
+
+def atualizar(colecao, registro, campos):
+    """Altera somente os campos informados de um registro da coleção."""
+    # Produtos são encontrados pelo id; as outras coleções, pela posição
+    posicao = None if colecao == 'estoque' else _posicao(_lista(colecao), registro)
+    if _em_transacao:
+        anterior = {campo: registro.get(campo, _AUSENTE) for campo in campos}
+        _desfazer.append(('atualizar', colecao, registro, anterior))
+    if id(registro) not in _inseridos:
+        originais = _originais.setdefault(id(registro), {})
+        for campo in campos:
+            originais.setdefault(campo, registro.get(campo, _AUSENTE))
+    registro.update(campos)
+    _sujas.add(colecao)
+    if colecao == 'estoque':
+        indice_busca.atualizar(registro)
+
+    # Um registro inserido ainda não gravado já vai com os valores novos, e
+    # alterações seguidas no mesmo registro viram uma só
+    if id(registro) in _inseridos:
+        return
+    ultima = _pendentes[-1] if len(_pendentes) > _inicio_transacao else None
+    if ultima and ultima[0] == 'atualizar' and ultima[2] is registro:
+        ultima[4].update(campos)
+    else:
+        _pendentes.append(('atualizar', colecao, registro, posicao, dict(campos)))
+
+
+def remover(colecao, registro):
+    """Remove o registro da coleção e o marca para gravação."""
+    if colecao == 'estoque':
+        posicao = None
+        del produtos[registro['id']]
+    else:
+        lista = _lista(colecao)
+        posicao = _posicao(lista, registro)
+        del lista[posicao]
+    _pendentes.append(('remover', colecao, registro, posicao, None))
+    _sujas.add(colecao)
+    if colecao == 'estoque':
+        indice_busca.remover(registro)
+    if _em_transacao:
+        _desfazer.append(('remover', colecao, registro, posicao))
+
+
+def _aplicar(alteracao):
+    if alteracao['c'] == 'estoque':
+        _aplicar_produto(alteracao)
+        return
+
+    lista = _lista(alteracao['c'])
+    if alteracao['op'] == 'inserir':
+        lista.append(alteracao['r'])
+    elif alteracao['op'] == 'atualizar':
+        lista[alteracao['i']].update(alteracao['r'])
+    elif alteracao['op'] == 'remover':
+        del lista[alteracao['i']]
+
+
+def _aplicar_produto(alteracao):
+    if alteracao['op'] == 'inserir':
+        _guardar_produto(alteracao['r'])
+        return
+
+    # Diários gravados antes dos ids guardam a posição no estoque ('i')
+    if 'id' in alteracao:
+        chave = alteracao['id']
+    else:
+        chave = list(produtos)[alteracao['i']]
+    if alteracao['op'] == 'atualizar':
+        produtos[chave].update(alteracao['r'])
+    elif alteracao['op'] == 'remover':
+        del produtos[chave]
+
+
+# Carregamento
+
+def _ler_checkpoint():
+    if os.path.exists(ARQUIVO_CHECKPOINT):
+        with open(ARQUIVO_CHECKPOINT, 'r') as file:
+            return json.load(file)
+    return {}
+
+
+def _arquivo_cache(colecao):
+    return os.path.join(PASTA_CACHE, f'{colecao}.marshal')
+
+
+def _chave_cache(caminho):
+    """O cache só vale para o mesmo arquivo JSON (data e tamanho) e a mesma versão do Python."""
+    info = os.stat(caminho)
+    return (info.st_mtime_ns, info.st_size, marshal.version, sys.version_info[:2])
+
+
+def _ler_cache(colecao, caminho):
+    try:
+        with open(_arquivo_cache(colecao), 'rb') as file:
+            chave, sha1, registros = marshal.loads(file.read())
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    if chave != _chave_cache(caminho):
+        return None
+    return registros, sha1
+
+
+def _gravar_cache(colecao, caminho, registros, sha1):
+    # O JSON continua sendo a fonte dos dados: falhar aqui não é um erro
+    try:
+        os.makedirs(PASTA_CACHE, exist_ok=True)
+        _escrever_atomico(_arquivo_cache(colecao),
+                          marshal.dumps((_chave_cache(caminho), sha1, registros)))
+    except (OSError, ValueError):
+        pass
+
+
+def _ler_colecao(colecao, info):
+    """
+    Lê o arquivo JSON da coleção e devolve (registros, sequência já contida nele).
+    O hash confere se o arquivo é mesmo o gravado no último checkpoint; se não
+    for (queda no meio do checkpoint), vale a sequência anterior.
+    """
+    caminho = _arquivo(colecao)
+    if not os.path.exists(caminho):
+        registros, sha1 = [], None
+    else:
+        em_cache = _ler_cache(colecao, caminho)
+        if em_cache:
+            registros, sha1 = em_cache
+        else:
+            with open(caminho, 'rb') as file:
+                conteudo = file.read()
+            registros, sha1 = json.loads(conteudo), hashlib.sha1(conteudo).hexdigest()
+            _gravar_cache(colecao, caminho, registros, sha1)
+
+    if info.get('sha1') == sha1:
+        return registros, info.get('sequencia', 0)
+    return registros, info.get('anterior', 0)
+
+
+def _ler_diario():
+    """
+    Reaplica as gravações do diário posteriores ao último checkpoint. As que
+    são de coleções ainda não carregadas ficam guardadas para o primeiro acesso.
+    Devolve o número da última gravação lida. Uma última linha incompleta
+    (queda, ou outro processo gravando agora) é ignorada; quem a corta é a
+    próxima gravação, com a trava (ver _gravar_diario).
+    """
+    global _sequencia, _gravacoes_no_diario
+
+    lida = 0
+    try:
+        file = open(ARQUIVO_DIARIO, 'rb')
+    except FileNotFoundError:
+        return lida
+
+    with file:
+        for linha in file:
+            try:
+                if not linha.endswith(b'\n'):
+                    raise ValueError
+                gravacao = json.loads(linha)
+            except ValueError:
+                break
+            lida = gravacao['s']
+            _sequencia = max(_sequencia, gravacao['s'])
+            _gravacoes_no_diario += 1
+            for alteracao in gravacao['alteracoes']:
+                colecao = alteracao['c']
+                if not _carregada(colecao):
+                    _diario_adiado.setdefault(colecao, []).append(
+                        (gravacao['s'], alteracao))
+                    _sujas.add(colecao)
+                elif gravacao['s'] > _no_disco[colecao]:
+                    _aplicar(alteracao)
+                    _sujas.add(colecao)
+            _conferir_historicos(gravacao.get('historicos', []))
+    return lida
+
+
+def _carregar_colecao(colecao):
+    """Lê uma coleção sob demanda, com as alterações do diário guardadas."""
+    if BACKEND == 'sqlite' and banco_sqlite.existe():
+        registros = banco_sqlite.carregar([colecao])[colecao]
+        proximo_id = banco_sqlite.ler_controle('proximo_id', 1)
+    else:
+        # Uma coleção lida depois da carga usa o checkpoint de agora: outro
+        # processo pode ter regravado o arquivo dela desde então
+        info = (_checkpoint if colecao == 'estoque' else _ler_checkpoint()).get(colecao, {})
+        registros, _no_disco[colecao] = _ler_colecao(colecao, info)
+        proximo_id = info.get('proximo_id', 1)
+
+    if colecao == 'estoque':
+        _definir_produtos(registros, proximo_id)
+    else:
+        globals()[colecao] = registros
+    for sequencia, alteracao in _diario_adiado.pop(colecao, []):
+        if sequencia > _no_disco[colecao]:
+            _aplicar(alteracao)
+
+
+def _carregar_json(travado=False):
+    global _checkpoint, _sequencia, _gravacoes_no_diario
+
+    _checkpoint = _ler_checkpoint()
+    _no_disco.clear()
+    _diario_adiado.clear()
+    _sujas.clear()
+    for colecao in SOB_DEMANDA:
+        globals().pop(colecao, None)
+
+    _carregar_colecao('estoque')
+
+    _pendentes.clear()
+    _inseridos.clear()
+    _sequencia = max([info.get('sequencia', 0) for info in _checkpoint.values()] + [0])
+    _gravacoes_no_diario = 0
+    lida = _ler_diario()
+
+    # Checkpoint de outro processo no meio da leitura: o checkpoint mudou
+    # enquanto o diário era lido, ou já era o novo com o arquivo do estoque
+    # ainda o antigo e o diário que o completaria já apagado. Lê de novo com
+    # a trava, depois que o checkpoint terminar.
+    sequencia = _checkpoint.get('estoque', {}).get('sequencia', 0)
+    incompleto = _no_disco['estoque'] < sequencia and lida < sequencia
+    if not travado and (incompleto or _ler_checkpoint() != _checkpoint):
+        with trava():
+            _carregar_json(travado=True)
+        return
+
+    _migrar_dados()
+    indice_busca.reconstruir(produtos.values())
+
+
+def _migrar_dados():
+    """
+    Atualiza os dados gravados por versões anteriores. Versão 1: acrescenta
+    data_ts aos descartes e aos registros de histórico. Antes de regravar os
+    históricos é feito um checkpoint, para o diário não guardar tamanhos de
+    arquivo que deixarão de valer.
+    """
+    if _versao_dados() >= VERSAO_DADOS:
+        return
+
+    with trava():
+        # Outro processo pode ter gravado, ou até migrado, enquanto este
+        # esperava a trava; a releitura já faz a migração que faltar
+        if not sincronizar() and _versao_dados() < VERSAO_DADOS:
+            _migrar_versao_1()
+
+
+def _versao_dados():
+    if os.path.exists(ARQUIVO_VERSAO):
+        with open(ARQUIVO_VERSAO, 'r') as file:
+            return json.load(file).get('versao', 0)
+    return 0
+
+
+def _migrar_versao_1():
+    for registro in _lista('descarte'):
+        if datas.CAMPO not in registro:
+            datas.carimbar(registro)
+            _sujas.add('descarte')
+    consolidar_diario()
+
+    for tipo in HISTORICOS:
+        caminho = _arquivo_historico(tipo)
+        if os.path.exists(caminho):
+            registros = list(_iterar_historico_json(tipo))
+            for registro in registros:
+                datas.carimbar(registro)
+            _escrever_atomico(caminho, _linhas(registros))
+
+    _escrever_atomico(ARQUIVO_VERSAO,
+                      json.dumps({'versao': VERSAO_DADOS}).encode('utf-8'))
+
+
+def concluir_restauracao():
+    """
+    Troca os arquivos atuais pelos preparados em PASTA_RESTAURACAO (ver
+    restauracao.py). O plano da troca é o ponto de confirmação: com ele a
+    troca é feita (ou terminada, se foi interrompida) e os arquivos que não
+    valem para os dados restaurados (o diário, os caches) são apagados; sem
+    ele a pasta é descartada.
+    """
+    if not os.path.exists(PASTA_RESTAURACAO):
+        return
+    with trava():
+        # Com a trava: a restauração de outro processo pode estar preparando a pasta
+        if os.path.exists(PASTA_RESTAURACAO):
+            _trocar_arquivos_restaurados()
+
+
+def _trocar_arquivos_restaurados():
+    try:
+        with open(os.path.join(PASTA_RESTAURACAO, 'plano.json'), 'r', encoding='utf-8') as file:
+            plano = json.load(file)
+    except (OSError, ValueError):
+        plano = None
+
+    if plano is not None:
+        banco_sqlite.desconectar()
+        for nome in plano['substituir']:
+            origem = os.path.join(PASTA_RESTAURACAO, nome)
+            if not os.path.exists(origem):
+                # Já trocado antes da interrupção
+                continue
+            if nome == os.path.basename(banco_sqlite.ARQUIVO):
+                # O WAL do banco antigo não vale para o novo
+                for sufixo in ('-wal', '-shm'):
+                    if os.path.exists(banco_sqlite.ARQUIVO + sufixo):
+                        _repetir(os.remove, banco_sqlite.ARQUIVO + sufixo)
+            _repetir(os.replace, origem, os.path.join(PASTA, nome))
+        for nome in plano['remover']:
+            if os.path.exists(os.path.join(PASTA, nome)):
+                _repetir(os.remove, os.path.join(PASTA, nome))
+        shutil.rmtree(PASTA_CACHE, ignore_errors=True)
+    shutil.rmtree(PASTA_RESTAURACAO, ignore_errors=True)
 
-entradas = []
-saidas = []
-descarte = []
-estoque = []
 
 def carregar_dados():
-    global entradas, saidas, descarte, estoque
-
-    if os.path.exists('backup/estoque.json'):
-        with open('backup/estoque.json', 'r') as file:
-            estoque = json.load(file)
-    if os.path.exists('backup/entradas.json'):
-        with open('backup/entradas.json', 'r') as file:
-            entradas = json.load(file)
-    if os.path.exists('backup/saidas.json'):
-        with open('backup/saidas.json', 'r') as file:
-            saidas = json.load(file)
-    if os.path.exists('backup/descarte.json'):
-        with open('backup/descarte.json', 'r') as file:
-            descarte = json.load(file)
+    """
+    Carrega as coleções para a memória. No modo JSON lê o último checkpoint e
+    reaplica o diário por cima dele.
+    """
+    concluir_restauracao()
+    if BACKEND == 'sqlite' and not banco_sqlite.existe():
+        with trava():
+            if not banco_sqlite.existe():
+                # Primeira execução com SQLite: importa o que já existe em JSON
+                _carregar_json()
+                banco_sqlite.importar(
+                    {colecao: _lista(colecao) for colecao in COLECOES},
+                    {tipo: _iterar_historico_json(tipo) for tipo in HISTORICOS})
+    _recarregar()
+
+
+def _recarregar():
+    """Lê os dados do disco de novo, descartando o que estiver pendente."""
+    global _sequencia
+
+    _historico_pendente.clear()
+    _originais.clear()
+    _desfazer.clear()
+    if BACKEND != 'sqlite':
+        _carregar_json()
+        return
+
+    banco_sqlite.desconectar()
+    # A versão antes dos dados: se outro processo gravar entre as duas
+    # leituras, os dados ficam mais novos que a versão (e a próxima gravação
+    # relê tudo), nunca mais velhos
+    _sequencia = banco_sqlite.ler_controle('versao')
+    for colecao in SOB_DEMANDA:
+        globals().pop(colecao, None)
+    _carregar_colecao('estoque')
+    indice_busca.reconstruir(produtos.values())
+    _pendentes.clear()
+    _inseridos.clear()
+
+
+# Gravação
+
+def _gravar_diario():
+    """
+    Anexa ao diário, em uma única linha, tudo que está pendente. Essa linha é
+    o ponto de confirmação: os registros de histórico vão junto com o tamanho
+    que cada arquivo tinha antes, e só depois são acrescentados aos arquivos
+    (se a gravação for interrompida, _conferir_historicos completa na carga).
+    """
+    global _sequencia, _gravacoes_no_diario
+
+    if not _pendentes and not _historico_pendente:
+        return
+
+    # Corta o resto de uma gravação interrompida. Só aqui, com a trava: na
+    # carga uma linha incompleta pode ser outro processo gravando
+    if not _diario_terminado():
+        with open(ARQUIVO_DIARIO, 'r+b') as file:
+            file.truncate(_fim_diario()[0])
+
+    alteracoes = []
+    for op, colecao, registro, posicao, campos in _pendentes:
+        alteracao = {'op': op, 'c': colecao}
+        if op == 'inserir':
+            alteracao['r'] = registro
+        else:
+            if colecao == 'estoque':
+                alteracao['id'] = registro['id']
+            else:
+                alteracao['i'] = posicao
+            if op == 'atualizar':
+                alteracao['r'] = campos
+        alteracoes.append(alteracao)
+
+    por_tipo = {}
+    for tipo, registro in _historico_pendente:
+        por_tipo.setdefault(tipo, []).append(registro)
+    historicos = [{'t': tipo, 'tam': _tamanho(_arquivo_historico(tipo)), 'r': registros}
+                  for tipo, registros in por_tipo.items()]
+
+    _sequencia += 1
+    gravacao = {'s': _sequencia, 'alteracoes': alteracoes}
+    if historicos:
+        gravacao['historicos'] = historicos
+    linha = json.dumps(gravacao, ensure_ascii=False, separators=(',', ':'))
+    with open(ARQUIVO_DIARIO, 'ab') as file:
+        file.write(linha.encode('utf-8') + b'\n')
+        file.flush()
+        os.fsync(file.fileno())
+
+    for item in historicos:
+        posicoes, fim = _anexar_linhas(item['t'], item['r'])
+        _avisar(item['t'], posicoes, fim, item['r'])
+
+    _pendentes.clear()
+    _inseridos.clear()
+    _originais.clear()
+    _historico_pendente.clear()
+    _gravacoes_no_diario += 1
+
+
+def _gravar_sqlite():
+    global _sequencia
+
+    ids = banco_sqlite.gravar(_pendentes, _historico_pendente,
+                              {'versao': _sequencia + 1, 'proximo_id': _proximo_id})
+    _sequencia += 1
+    por_tipo = {}
+    for (tipo, registro), rowid in zip(_historico_pendente, ids):
+        por_tipo.setdefault(tipo, []).append((rowid, registro))
+    _pendentes.clear()
+    _inseridos.clear()
+    _originais.clear()
+    _historico_pendente.clear()
+    for tipo, itens in por_tipo.items():
+        _avisar(tipo, [rowid for rowid, _registro in itens], itens[-1][0] + 1,
+                [registro for _rowid, registro in itens])
+
 
 def salvar_dados():
-    if not os.path.exists('backup'):
-        os.makedirs('backup')
-        
-    with open('backup/estoque.json', 'w') as file:
-        json.dump(estoque, file, indent=4)
-
-    if entradas:
-        with open('backup/entradas.json', 'w') as file:
-            json.dump(entradas, file, indent=4)
-    elif os.path.exists('backup/entradas.json'):
-        os.remove('backup/entradas.json')
-
-    if saidas:
-        with open('backup/saidas.json', 'w') as file:
-            json.dump(saidas, file, indent=4)
-    elif os.path.exists('backup/saidas.json'):
-        os.remove('backup/saidas.json')
-
-    with open('backup/descarte.json', 'w') as file:
-        json.dump(descarte, file, indent=4)
\ No newline at end of file
+    """
+    Grava as alterações pendentes. Dentro de uma transação não faz nada: a
+    gravação acontece uma única vez, no final dela. Grava com a trava e
+    depois de sincronizar, para não passar por cima do que outro processo
+    gravou.
+    """
+    if _em_transacao or (not _pendentes and not _historico_pendente):
+        return
+
+    if not os.path.exists(PASTA):
+        os.makedirs(PASTA)
+
+    with trava():
+        reaplicadas = sincronizar()
+        try:
+            if BACKEND == 'sqlite':
+                _gravar_sqlite()
+            else:
+                _gravar_diario()
+        except BaseException:
+            if reaplicadas:
+                # As alterações refeitas não têm como ser desfeitas uma a uma
+                _recarregar()
+            raise
+        if BACKEND != 'sqlite' and _gravacoes_no_diario >= LIMITE_DIARIO:
+            consolidar_diario()
+
+
+def consolidar_diario():
+    """
+    Checkpoint: regrava o arquivo JSON de cada coleção alterada desde o
+    checkpoint anterior e esvazia o diário.
+    """
+    global _checkpoint, _gravacoes_no_diario
+
+    if BACKEND == 'sqlite':
+        salvar_dados()
+        return
+
+    if not os.path.exists(PASTA):
+        os.makedirs(PASTA)
+
+    with trava():
+        salvar_dados()
+        # Sem nada pendente salvar_dados não relê, mas os arquivos regravados
+        # precisam ter também o que os outros processos gravaram
+        sincronizar()
+        checkpoint = _ler_checkpoint()
+
+        for colecao in COLECOES:
+            if colecao not in _sujas:
+                continue
+            registros = _lista(colecao)
+            caminho = _arquivo(colecao)
+
+            # entradas e saidas vazias não ficam com arquivo em disco
+            if not registros and colecao in ('entradas', 'saidas'):
+                conteudo, sha1 = None, None
+            else:
+                conteudo = json.dumps(registros, indent=4).encode('utf-8')
+                sha1 = hashlib.sha1(conteudo).hexdigest()
+
+            # Registra o hash do novo arquivo antes de trocá-lo, para saber na
+            # próxima carga se a troca chegou a acontecer
+            checkpoint[colecao] = {
+                'sequencia': _sequencia,
+                'anterior': _no_disco.get(colecao, 0),
+                'sha1': sha1
+            }
+            if colecao == 'estoque':
+                checkpoint[colecao]['proximo_id'] = _proximo_id
+            _escrever_atomico(ARQUIVO_CHECKPOINT,
+                              json.dumps(checkpoint, indent=4).encode('utf-8'))
+
+            if conteudo is not None:
+                _escrever_atomico(caminho, conteudo)
+                _gravar_cache(colecao, caminho, registros, sha1)
+            elif os.path.exists(caminho):
+                _repetir(os.remove, caminho)
+            _no_disco[colecao] = _sequencia
+
+        _checkpoint = checkpoint
+        if os.path.exists(ARQUIVO_DIARIO):
+            _repetir(os.remove, ARQUIVO_DIARIO)
+        _sujas.clear()
+        _gravacoes_no_diario = 0
+
+
+# Mais de um processo (vários terminais com a mesma pasta backup/)
+#
+# Cada processo tem os dados em memória e grava só o que alterou. As
+# gravações passam uma de cada vez pela trava de ARQUIVO_TRAVA; as leituras
+# não usam a trava. A versão dos dados é o número da última gravação (no
+# JSON, o 's' da última linha do diário ou a maior sequência do checkpoint;
+# no SQLite, a tabela controle), gravado junto com a própria gravação. Com a
+# trava, antes de gravar, o processo compara a versão do disco com a dos seus
+# dados: se outro processo gravou nesse meio tempo, os dados são relidos e as
+# alterações pendentes refeitas por cima deles, em vez de passar por cima do
+# que o outro gravou.
+
+def trava():
+    """Trava das gravações, entre processos e entre threads (ver travas.py)."""
+    return travas.travar(ARQUIVO_TRAVA)
+
+
+def estado_gravacao():
+    """(versão dos dados em memória, próximo id de produto)."""
+    return _sequencia, _proximo_id
+
+
+def _fim_diario(ate=None):
+    """
+    (tamanho do diário sem uma linha incompleta no final, número da última
+    gravação). Lê de trás para frente só a última linha.
+    """
+    try:
+        file = open(ARQUIVO_DIARIO, 'rb')
+    except FileNotFoundError:
+        return 0, 0
+
+    with file:
+        inicio = file.seek(0, os.SEEK_END) if ate is None else ate
+        lido = b''
+        # Blocos dobrando de tamanho: uma linha grande (importação) não é
+        # lida aos pedacinhos
+        tamanho = 4096
+        while True:
+            fim_linha = lido.rfind(b'\n')
+            if fim_linha >= 0:
+                comeco = lido.rfind(b'\n', 0, fim_linha) + 1
+                if comeco or not inicio:
+                    break
+            elif not inicio:
+                return 0, 0
+            bloco = max(0, inicio - tamanho)
+            file.seek(bloco)
+            lido = file.read(inicio - bloco) + lido
+            inicio = bloco
+            tamanho *= 2
+
+    try:
+        return inicio + fim_linha + 1, json.loads(lido[comeco:fim_linha + 1])['s']
+    except (ValueError, KeyError):
+        # Linha estragada: como na carga, o diário vale até antes dela
+        return _fim_diario(inicio + comeco)
+
+
+def _diario_terminado():
+    """Se o diário não existe ou termina em uma linha completa."""
+    try:
+        with open(ARQUIVO_DIARIO, 'rb') as file:
+            if not file.seek(0, os.SEEK_END):
+                return True
+            file.seek(-1, os.SEEK_END)
+            return file.read(1) == b'\n'
+    except FileNotFoundError:
+        return True
+
+
+def _versao_em_disco():
+    if BACKEND == 'sqlite':
+        return banco_sqlite.ler_controle('versao')
+    sequencias = [info.get('sequencia', 0) for info in _ler_checkpoint().values()]
+    return max(sequencias + [_fim_diario()[1]])
+
+
+def sincronizar():
+    """
+    Relê os dados se outro processo gravou depois da última leitura ou
+    gravação deste, refazendo por cima deles as alterações pendentes (ver
+    _reaplicar). Se alguma não puder ser refeita, nenhuma fica e o ValueError
+    sobe. Devolve True se os dados foram relidos. Antes de gravar é chamada
+    com a trava; sem ela (no menu) só deixa os dados em dia.
+    """
+    if _versao_em_disco() == _sequencia:
+        return False
+
+    pendentes = list(_pendentes)
+    historicos = list(_historico_pendente)
+    originais = {chave: dict(campos) for chave, campos in _originais.items()}
+    _recarregar()
+    try:
+        _reaplicar(pendentes, historicos, originais)
+    except BaseException:
+        _recarregar()
+        raise
+    return True
+
+
+def _descricao(produto):
+    return f"id {produto['id']} ({produto.get('nome', '')})"
+
+
+def _reaplicar(pendentes, historicos, originais):
+    """
+    Refaz as alterações pendentes sobre os dados recém-lidos. Um produto
+    inserido aqui recebe o próximo id livre, e os registros pendentes que o
+    citam, o id novo. Nos campos de CAMPOS_SOMADOS vale a diferença feita
+    aqui somada ao valor gravado pelo outro processo; nos demais, o valor
+    daqui. Mexer na quantidade de um produto que não existe mais, ou deixá-la
+    negativa, é um conflito (ValueError).
+    """
+    ids_novos = {}
+    for op, colecao, registro, posicao, campos in pendentes:
+        if colecao != 'estoque':
+            # As outras coleções só recebem inserções; o resto vai pela posição, como no diário
+            lista = _lista(colecao)
+            if op == 'inserir':
+                _trocar_ids(registro, ids_novos)
+                inserir(colecao, registro)
+            elif op == 'atualizar' and posicao < len(lista):
+                atualizar(colecao, lista[posicao], campos)
+            elif op == 'remover' and posicao < len(lista):
+                remover(colecao, lista[posicao])
+            continue
+
+        if op == 'inserir':
+            anterior = registro.pop('id')
+            inserir('estoque', registro)
+            if registro['id'] != anterior:
+                ids_novos[anterior] = registro['id']
+            continue
+
+        atual = registro if id(registro) in _inseridos else produtos.get(registro['id'])
+        if atual is None:
+            if op == 'atualizar' and set(campos) & set(CAMPOS_SOMADOS):
+                raise ValueError(f"O produto {_descricao(registro)} foi removido em outro "
+                                 f"terminal. Os dados foram relidos; refaça a operação.")
+            continue
+
+        # Valores de antes desta alteração (as anteriores já refeitas)
+        antes = originais.setdefault(id(registro), {})
+        if op == 'atualizar':
+            novos = {}
+            for campo, valor in campos.items():
+                novos[campo] = _rebasear(campo, antes.get(campo, _AUSENTE), valor,
+                                         atual.get(campo, _AUSENTE))
+                antes[campo] = valor
+            for campo in CAMPOS_SOMADOS:
+                if isinstance(novos.get(campo), (int, float)) and novos[campo] < 0:
+                    raise ValueError(
+                        f"Outro terminal alterou o produto {_descricao(atual)} ao mesmo tempo "
+                        f"e a quantidade ficaria {novos[campo]}. Os dados foram relidos; "
+                        f"refaça a operação.")
+            atualizar('estoque', atual, novos)
+        elif antes.get('quantidade', atual.get('quantidade')) == atual.get('quantidade'):
+            remover('estoque', atual)
+        # Senão a remoção veio da quantidade zerada aqui, mas o outro processo
+        # também mexeu nela (uma entrada): o produto fica com o que sobrou
+
+    for tipo, registro in historicos:
+        _trocar_ids(registro, ids_novos)
+        _historico_pendente.append((tipo, registro))
+
+
+def _rebasear(campo, antes, nosso, atual):
+    """Valor do campo por cima do que o outro processo gravou (ver _reaplicar)."""
+    numeros = all(isinstance(valor, (int, float)) and not isinstance(valor, bool)
+                  for valor in (antes, nosso, atual))
+    if campo not in CAMPOS_SOMADOS or not numeros:
+        return nosso
+    valor = atual + (nosso - antes)
+    # Metros de mangueira: sem o resto das contas com ponto flutuante
+    return round(valor, 6) if isinstance(valor, float) else valor
+
+
+def _trocar_ids(registro, ids_novos):
+    for campo in ('id', 'produto_id'):
+        if registro.get(campo) in ids_novos:
+            registro[campo] = ids_novos[registro[campo]]
+
+
+# Históricos (entradas, saídas e exclusões registradas pelas operações)
+#
+# No modo JSON cada histórico é um arquivo com um registro JSON por linha
+# (backup/<tipo>.jsonl): registrar é só acrescentar uma linha no fim, e a
+# leitura pode ser feita registro a registro.
+
+# Pasta usada pelas versões antigas para o arquivo de saídas
+if getattr(sys, 'frozen', False):
+    _PASTA_ANTIGA = os.path.join(
+        os.path.dirname(os.path.dirname(sys.executable)), 'backup')
+else:
+    _PASTA_ANTIGA = os.path.join(os.path.dirname(os.path.dirname(
+        os.path.dirname(os.path.abspath(__file__)))), 'backup')
+
+_historicos_migrados = set()
+# tipo -> funções chamadas com (posições, fim, registros) após cada acréscimo
+_observadores = {}
+
+
+def _avisar(tipo, posicoes, fim, registros):
+    for funcao in _observadores.get(tipo, []):
+        funcao(posicoes, fim, registros)
+
+
+def _arquivo_historico(tipo):
+    caminho = os.path.join(PASTA, f'{tipo}.jsonl')
+    if tipo not in _historicos_migrados:
+        _migrar_historico(tipo, caminho)
+        _historicos_migrados.add(tipo)
+    return caminho
+
+
+def _migrar_historico(tipo, caminho):
+    """
+    Converte uma única vez o histórico antigo (uma lista JSON em <tipo>.json)
+    para o formato de uma linha por registro. O arquivo antigo é mantido
+    com o sufixo .migrado. Se ele não puder ser lido, nada é alterado e
+    ValueError é lançado.
+    """
+    if os.path.exists(caminho) or historico_antigo(tipo) is None:
+        return
+
+    with trava():
+        # Outro terminal pode ter migrado enquanto este esperava a trava
+        antigo = historico_antigo(tipo)
+        if os.path.exists(caminho) or antigo is None:
+            return
+
+        try:
+            with open(antigo, 'r', encoding='utf-8') as file:
+                registros = json.load(file)
+        except ValueError as e:
+            raise ValueError(f"O histórico antigo {antigo} está corrompido ({e}) e não foi "
+                             f"convertido. Corrija ou restaure o arquivo.") from e
+
+        linhas = ''.join(json.dumps(registro, ensure_ascii=False) + '\n'
+                         for registro in registros)
+        _escrever_atomico(caminho, linhas.encode('utf-8'))
+        _repetir(os.replace, antigo, antigo + '.migrado')
+
+
+def historico_antigo(tipo):
+    """Arquivo do histórico no formato antigo ainda não convertido, se houver."""
+    for pasta in (PASTA, _PASTA_ANTIGA):
+        antigo = os.path.join(pasta, f'{tipo}.json')
+        if os.path.exists(antigo):
+            return antigo
+    return None
+
+
+def _tamanho(caminho):
+    return os.path.getsize(caminho) if os.path.exists(caminho) else 0
+
+
+def _linhas(registros):
+    return b''.join((json.dumps(registro, ensure_ascii=False) + '\n').encode('utf-8')
+                    for registro in registros)
+
+
+def _anexar_linhas(tipo, registros):
+    """Acrescenta os registros e devolve a posição de cada um e o novo fim do arquivo."""
+    if not os.path.exists(PASTA):
+        os.makedirs(PASTA)
+
+    dados = _linhas(registros)
+    with open(_arquivo_historico(tipo), 'a+b') as file:
+        inicio = file.seek(0, os.SEEK_END)
+        # Não emenda no resto de uma linha incompleta deixada por uma queda
+        if inicio > 0:
+            file.seek(-1, os.SEEK_END)
+            if file.read(1) != b'\n':
+                dados = b'\n' + dados
+                inicio += 1
+        file.write(dados)
+        file.flush()
+        os.fsync(file.fileno())
+
+    posicoes = []
+    for registro in registros:
+        posicoes.append(inicio)
+        inicio += len(_linhas([registro]))
+    return posicoes, inicio
+
+
+def _conferir_historicos(historicos):
+    """
+    Completa registros de histórico confirmados no diário que não chegaram a
+    ser gravados por inteiro no arquivo (queda logo após a confirmação).
+    """
+    def incompleto(item):
+        tamanho = _tamanho(_arquivo_historico(item['t']))
+        return item['tam'] <= tamanho < item['tam'] + len(_linhas(item['r']))
+
+    if not any(incompleto(item) for item in historicos):
+        return
+    # Pode ser outro processo no meio da gravação: com a trava ele já terminou
+    with trava():
+        for item in historicos:
+            if not incompleto(item):
+                continue
+            caminho = _arquivo_historico(item['t'])
+            if _tamanho(caminho) > item['tam']:
+                with open(caminho, 'r+b') as file:
+                    file.truncate(item['tam'])
+            _anexar_linhas(item['t'], item['r'])
+
+
+def _iterar_historico_json(tipo, com_posicao=False, ate=None):
+    try:
+        file = open(_arquivo_historico(tipo), 'rb')
+    except FileNotFoundError:
+        return
+
+    posicao = 0
+    with file:
+        for linha in file:
+            if ate is not None and posicao >= ate:
+                break
+            inicio = posicao
+            posicao += len(linha)
+            try:
+                registro = json.loads(linha)
+            except ValueError:
+                # Linha incompleta (queda durante a gravação)
+                continue
+            yield (inicio, registro) if com_posicao else registro
+
+
+def caminho_historico(tipo):
+    """Arquivo do histórico no modo JSON (backup/<tipo>.jsonl)."""
+    return _arquivo_historico(tipo)
+
+
+def observar_historico(tipo, funcao):
+    """Registra uma função a ser chamada sempre que registros forem acrescentados ao histórico."""
+    _observadores.setdefault(tipo, []).append(funcao)
+
+
+def anexar_historico(tipo, registro):
+    """
+    Acrescenta um registro ao histórico (entradas, saídas ou exclusões). Dentro
+    de uma transação ele é gravado junto com as demais alterações. O registro
+    gravado é uma cópia com o campo data_ts preenchido.
+    """
+    registro = dict(registro)
+    datas.carimbar(registro)
+    _historico_pendente.append((tipo, registro))
+    salvar_dados()
+
+
+def iterar_historico(tipo):
+    """Percorre o histórico registro a registro, sem carregá-lo inteiro."""
+    if BACKEND == 'sqlite':
+        return banco_sqlite.iterar_historico(tipo)
+    return _iterar_historico_json(tipo)
+
+
+def historico_no_periodo(tipo, inicio, fim, com_posicao=False, ate=None):
+    """
+    Registros do histórico com data_ts entre inicio e fim (inclusive). Com
+    com_posicao=True devolve pares (posição, registro), onde a posição serve
+    para reler o registro depois com ler_historico_em. Com `ate` só considera
+    os registros antes dessa posição (o histórico como estava naquele ponto).
+    """
+    if BACKEND == 'sqlite':
+        return banco_sqlite.historico_no_periodo(tipo, inicio, fim, com_posicao, ate)
+    return (item for item in _iterar_historico_json(tipo, com_posicao, ate)
+            if inicio <= (item[1] if com_posicao else item).get(datas.CAMPO, 0) <= fim)
+
+
+def estado_historico(tipo):
+    """
+    Identificação do histórico (muda se o arquivo ou o banco for trocado) e a
+    posição onde ele termina, ou None se ainda não há histórico desse tipo.
+    """
+    if BACKEND == 'sqlite':
+        return banco_sqlite.estado_historico(tipo)
+    try:
+        info = os.stat(_arquivo_historico(tipo))
+    except FileNotFoundError:
+        return None
+    return ('json', info.st_ino), info.st_size
+
+
+def historico_desde(tipo, posicao):
+    """
+    Registros a partir da posição (um fim devolvido por estado_historico ou
+    pelos observadores), como (posição, posição seguinte, registro). No JSON
+    para antes de uma última linha ainda incompleta.
+    """
+    if BACKEND == 'sqlite':
+        yield from banco_sqlite.historico_desde(tipo, posicao)
+        return
+    try:
+        file = open(_arquivo_historico(tipo), 'rb')
+    except FileNotFoundError:
+        return
+
+    with file:
+        file.seek(posicao)
+        for linha in file:
+            if not linha.endswith(b'\n'):
+                break
+            inicio = posicao
+            posicao += len(linha)
+            try:
+                registro = json.loads(linha)
+            except ValueError:
+                continue
+            yield inicio, posicao, registro
+
+
+def ler_historico_em(tipo, posicoes):
+    """Relê os registros do histórico nas posições informadas, na mesma ordem."""
+    if BACKEND == 'sqlite':
+        return banco_sqlite.ler_historico_em(tipo, posicoes)
+    registros = []
+    with open(_arquivo_historico(tipo), 'rb') as file:
+        for posicao in posicoes:
+            file.seek(posicao)
+            registros.append(json.loads(file.readline()))
+    return registros
+
+
+def ler_historico(tipo):
+    return list(iterar_historico(tipo))
+
+
+def buscar_historico(tipo, campo, valor):
+    """
+    Registros do histórico cujo campo é igual ao valor, sem diferenciar
+    maiúsculas. No SQLite usa o índice da coluna.
+    """
+    if BACKEND == 'sqlite':
+        return banco_sqlite.buscar_historico(tipo, campo, valor)
+    return [registro for registro in _iterar_historico_json(tipo)
+            if str(registro.get(campo, '')).lower() == valor.lower()]
@@ -0,0 +1,351 @@
+# banco_sqlite.py
+import json
+import os
+import sqlite3
+import threading
+
+from estoque import datas
+
+ARQUIVO = os.path.join('backup', 'estoque.db')
+
+# Coleção/histórico do banco -> tabela no SQLite
+TABELAS = {
+    'estoque': 'produtos',
+    'descarte': 'descartes',
+    'estoque_entradas': 'entradas',
+    'estoque_saidas': 'saidas',
+    'estoque_exclusoes': 'exclusoes',
+}
+
+# entradas e saidas antigas do banco não têm tabela própria
+TABELA_OUTRAS = 'outras_colecoes'
+# Versão dos dados (número da última gravação) e próximo id de produto, ver
+# banco.sincronizar
+TABELA_CONTROLE = 'controle'
+
+INDICES = {
+    'produtos': ['nome', 'modelo', 'partNumber', 'classificacao'],
+    'saidas': ['partNumber', 'prefixo_aviao', 'classificacao', 'data_ts'],
+    'entradas': ['partNumber', 'data_ts'],
+    'descartes': ['data_ts'],
+    'exclusoes': ['data_ts'],
+}
+
+# Versão do esquema, guardada em PRAGMA user_version (ver _migrar)
+VERSAO = 1
+
+_conexao = None
+# Conexões de leitura das outras threads (relatórios em segundo plano)
+_local = threading.local()
+# id() do registro em memória -> rowid da tabela
+_rowids = {}
+
+
+def existe():
+    return os.path.exists(ARQUIVO)
+
+
+def conectar():
+    global _conexao
+
+    if _conexao is None:
+        os.makedirs(os.path.dirname(ARQUIVO), exist_ok=True)
+        _conexao = sqlite3.connect(ARQUIVO)
+        _conexao.execute("PRAGMA journal_mode=WAL")
+        _criar_tabelas(_conexao)
+    return _conexao
+
+
+def _leitura():
+    """
+    Conexão para consultas: a principal na thread principal e uma própria em
+    cada outra thread (uma conexão do sqlite3 só pode ser usada na thread que
+    a criou). Com o WAL elas leem enquanto a principal grava.
+    """
+    if threading.current_thread() is threading.main_thread():
+        return conectar()
+    if getattr(_local, 'conexao', None) is None:
+        _local.conexao = sqlite3.connect(ARQUIVO)
+    return _local.conexao
+
+
+def _criar_tabelas(conexao):
+    novo = conexao.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'produtos'").fetchone() is None
+    with conexao:
+        for tabela in TABELAS.values():
+            conexao.execute(f"""
+                CREATE TABLE IF NOT EXISTS {tabela} (
+                    id INTEGER PRIMARY KEY,
+                    nome TEXT,
+                    modelo TEXT,
+                    partNumber TEXT COLLATE NOCASE,
+                    classificacao TEXT,
+                    prefixo_aviao TEXT COLLATE NOCASE,
+                    data TEXT,
+                    data_ts INTEGER,
+                    dados TEXT NOT NULL
+                )""")
+        conexao.execute(f"""
+            CREATE TABLE IF NOT EXISTS {TABELA_OUTRAS} (
+                id INTEGER PRIMARY KEY,
+                colecao TEXT NOT NULL,
+                dados TEXT NOT NULL
+            )""")
+        conexao.execute(f"""
+            CREATE TABLE IF NOT EXISTS {TABELA_CONTROLE} (
+                chave TEXT PRIMARY KEY,
+                valor INTEGER NOT NULL
+            )""")
+        if novo:
+            conexao.execute(f"PRAGMA user_version = {VERSAO}")
+        else:
+            _migrar(conexao)
+        for tabela, colunas in INDICES.items():
+            for coluna in colunas:
+                conexao.execute(
+                    f"CREATE INDEX IF NOT EXISTS idx_{tabela}_{coluna} ON {tabela} ({coluna})")
+
+
+def _migrar(conexao):
+    """Atualiza bancos criados por versões anteriores (dentro da transação de _criar_tabelas)."""
+    versao = conexao.execute("PRAGMA user_version").fetchone()[0]
+    if versao < 1:
+        # Versão 1: coluna data_ts (e campo data_ts nos registros de histórico)
+        for tabela in TABELAS.values():
+            conexao.execute(f"ALTER TABLE {tabela} ADD COLUMN data_ts INTEGER")
+            if tabela == 'produtos':
+                continue
+            alterados = []
+            for rowid, texto in conexao.execute(f"SELECT id, dados FROM {tabela}"):
+                registro = json.loads(texto)
+                datas.carimbar(registro)
+                alterados.append((registro[datas.CAMPO],
+                                  json.dumps(registro, ensure_ascii=False), rowid))
+            conexao.executemany(
+                f"UPDATE {tabela} SET data_ts = ?, dados = ? WHERE id = ?", alterados)
+    conexao.execute(f"PRAGMA user_version = {VERSAO}")
+
+
+def _linha(registro):
+    return (
+        registro.get('nome'),
+        registro.get('modelo'),
+        registro.get('partNumber'),
+        registro.get('classificacao'),
+        registro.get('prefixo_aviao'),
+        registro.get('data', registro.get('data_hora')),
+        registro.get(datas.CAMPO),
+        json.dumps(registro, ensure_ascii=False)
+    )
+
+
+def _inserir(colecao, registro, conexao=None):
+    conexao = conexao or _conexao
+    if colecao == 'estoque':
+        # O id do produto é o próprio rowid da tabela
+        cursor = conexao.execute(
+            """INSERT INTO produtos
+                (id, nome, modelo, partNumber, classificacao, prefixo_aviao, data, data_ts, dados)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""", (registro['id'],) + _linha(registro))
+    elif colecao in TABELAS:
+        cursor = conexao.execute(
+            f"""INSERT INTO {TABELAS[colecao]}
+                (nome, modelo, partNumber, classificacao, prefixo_aviao, data, data_ts, dados)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)""", _linha(registro))
+    else:
+        cursor = conexao.execute(
+            f"INSERT INTO {TABELA_OUTRAS} (colecao, dados) VALUES (?, ?)",
+            (colecao, json.dumps(registro, ensure_ascii=False)))
+    return cursor.lastrowid
+
+
+def _atualizar(colecao, registro):
+    rowid = _rowids[id(registro)]
+    if colecao in TABELAS:
+        _conexao.execute(
+            f"""UPDATE {TABELAS[colecao]} SET nome = ?, modelo = ?, partNumber = ?,
+                classificacao = ?, prefixo_aviao = ?, data = ?, data_ts = ?, dados = ?
+                WHERE id = ?""", _linha(registro) + (rowid,))
+    else:
+        _conexao.execute(f"UPDATE {TABELA_OUTRAS} SET dados = ? WHERE id = ?",
+                         (json.dumps(registro, ensure_ascii=False), rowid))
+
+
+def _remover(colecao, registro):
+    rowid = _rowids.pop(id(registro))
+    tabela = TABELAS.get(colecao, TABELA_OUTRAS)
+    _conexao.execute(f"DELETE FROM {tabela} WHERE id = ?", (rowid,))
+
+
+def desconectar():
+    global _conexao
+
+    if _conexao is not None:
+        _conexao.close()
+        _conexao = None
+    _rowids.clear()
+
+
+def ler_controle(chave, padrao=0):
+    """Valor gravado na tabela de controle ('versao' ou 'proximo_id')."""
+    linha = conectar().execute(
+        f"SELECT valor FROM {TABELA_CONTROLE} WHERE chave = ?", (chave,)).fetchone()
+    return padrao if linha is None else linha[0]
+
+
+def _gravar_controle(controle, conexao=None):
+    (conexao or _conexao).executemany(
+        f"INSERT OR REPLACE INTO {TABELA_CONTROLE} (chave, valor) VALUES (?, ?)",
+        controle.items())
+
+
+def carregar(colecoes):
+    """Lê as coleções do banco para listas em memória."""
+    conectar()
+    dados = {}
+    for colecao in colecoes:
+        if colecao in TABELAS:
+            cursor = _conexao.execute(
+                f"SELECT id, dados FROM {TABELAS[colecao]} ORDER BY id")
+        else:
+            cursor = _conexao.execute(
+                f"SELECT id, dados FROM {TABELA_OUTRAS} WHERE colecao = ? ORDER BY id",
+                (colecao,))
+        registros = []
+        for rowid, texto in cursor:
+            registro = json.loads(texto)
+            if colecao == 'estoque':
+                # Produtos gravados antes dos ids usam o rowid como id
+                registro.setdefault('id', rowid)
+            _rowids[id(registro)] = rowid
+            registros.append(registro)
+        dados[colecao] = registros
+    return dados
+
+
+def gravar(pendentes, historicos, controle):
+    """
+    Aplica as alterações pendentes do banco e os novos registros de histórico
+    em uma única transação, junto com os valores de controle (a nova versão
+    dos dados). Cada registro alterado é escrito uma única vez, com o seu
+    estado final. Devolve os ids dados aos registros de histórico, na mesma
+    ordem.
+    """
+    acoes = {}
+    for op, colecao, registro, _posicao, _campos in pendentes:
+        anterior = acoes.get(id(registro), (None,))[0]
+        if op == 'inserir':
+            acoes[id(registro)] = ('inserir', colecao, registro)
+        elif op == 'atualizar' and anterior != 'inserir':
+            acoes[id(registro)] = ('atualizar', colecao, registro)
+        elif op == 'remover':
+            if anterior == 'inserir':
+                # Inserido e removido antes de ser gravado
+                del acoes[id(registro)]
+            else:
+                acoes[id(registro)] = ('remover', colecao, registro)
+
+    conectar()
+    ids = []
+    with _conexao:
+        for tipo, registro in historicos:
+            ids.append(_inserir(tipo, registro))
+        for op, colecao, registro in acoes.values():
+            if op == 'inserir':
+                _rowids[id(registro)] = _inserir(colecao, registro)
+            elif op == 'atualizar' and id(registro) in _rowids:
+                _atualizar(colecao, registro)
+            elif op == 'remover' and id(registro) in _rowids:
+                _remover(colecao, registro)
+        _gravar_controle(controle)
+    return ids
+
+
+def importar(colecoes, historicos):
+    """Copia para o SQLite os dados que hoje estão nos arquivos JSON."""
+    conectar()
+    with _conexao:
+        for colecao, registros in list(colecoes.items()) + list(historicos.items()):
+            for registro in registros:
+                rowid = _inserir(colecao, registro)
+                if colecao in colecoes:
+                    _rowids[id(registro)] = rowid
+
+
+def criar_banco(caminho, dados, controle):
+    """
+    Cria em `caminho` um banco novo com os dados informados (coleção ou tipo
+    de histórico -> registros, na ordem) e os valores de controle. Usado na
+    restauração de backups.
+    """
+    conexao = sqlite3.connect(caminho)
+    try:
+        _criar_tabelas(conexao)
+        with conexao:
+            for colecao, registros in dados.items():
+                for registro in registros:
+                    _inserir(colecao, registro, conexao)
+            _gravar_controle(controle, conexao)
+    finally:
+        conexao.close()
+
+
+def iterar_historico(tipo):
+    conectar()
+    cursor = _conexao.execute(
+        f"SELECT dados FROM {TABELAS[tipo]} ORDER BY id")
+    for texto, in cursor:
+        yield json.loads(texto)
+
+
+def historico_no_periodo(tipo, inicio, fim, com_posicao=False, ate=None):
+    """
+    Registros com data_ts entre inicio e fim, pelo índice da coluna (a posição
+    é o id); com `ate`, só os de id menor.
+    """
+    cursor = _leitura().execute(
+        f"""SELECT id, dados FROM {TABELAS[tipo]}
+            WHERE data_ts BETWEEN ? AND ? AND id < ? ORDER BY id""",
+        (inicio, fim, ate if ate is not None else 2 ** 63 - 1))
+    for rowid, texto in cursor:
+        yield (rowid, json.loads(texto)) if com_posicao else json.loads(texto)
+
+
+def estado_historico(tipo):
+    """Identificação do banco (inode do arquivo) e o id seguinte ao último registro."""
+    conectar()
+    ultimo, = _conexao.execute(f"SELECT MAX(id) FROM {TABELAS[tipo]}").fetchone()
+    return ('sqlite', os.stat(ARQUIVO).st_ino), (ultimo or 0) + 1
+
+
+def historico_desde(tipo, posicao):
+    """Registros com id a partir de posicao, como (id, id seguinte, registro)."""
+    conectar()
+    cursor = _conexao.execute(
+        f"SELECT id, dados FROM {TABELAS[tipo]} WHERE id >= ? ORDER BY id", (posicao,))
+    for rowid, texto in cursor:
+        yield rowid, rowid + 1, json.loads(texto)
+
+
+def ler_historico_em(tipo, ids):
+    """Registros com os ids informados, na mesma ordem (consultados em lotes)."""
+    conexao = _leitura()
+    registros = []
+    for i in range(0, len(ids), 500):
+        lote = ids[i:i + 500]
+        cursor = conexao.execute(
+            f"SELECT id, dados FROM {TABELAS[tipo]} WHERE id IN ({','.join('?' * len(lote))})",
+            lote)
+        dados = dict(cursor.fetchall())
+        registros.extend(json.loads(dados[rowid]) for rowid in lote)
+    return registros
+
+
+def buscar_historico(tipo, campo, valor):
+    """Busca pelo índice da coluna (sem diferenciar maiúsculas)."""
+    conectar()
+    cursor = _conexao.execute(
+        f"SELECT dados FROM {TABELAS[tipo]} WHERE {campo} = ? COLLATE NOCASE ORDER BY id",
+        (valor,))
+    return [json.loads(texto) for texto, in cursor]
@@ -0,0 +1,156 @@
+# cache_relatorios.py
+# Reaproveita relatórios já gerados. Cada relatório gerado é anotado em
+# cache_relatorios.json, na pasta de relatórios, junto com a versão dos dados
+# de saídas usada (ver banco.estado_historico). Como o histórico de saídas só
+# recebe registros no final, basta conferir se o que foi acrescentado depois
+# tem alguma saída no período do relatório; se não tiver, o arquivo continua
+# valendo. O cache guarda no máximo LIMITE_ARQUIVOS relatórios (e
+# LIMITE_BYTES); os usados há mais tempo são apagados primeiro.
+#
+# Este módulo não importa o pandas: um relatório reaproveitado não precisa dele.
+
+import json
+import os
+import re
+import threading
+import time
+
+from estoque import banco, datas
+
+TIPO = 'estoque_saidas'
+INDICE = 'cache_relatorios.json'
+# Mudar sempre que o conteúdo ou o layout do relatório mudar
+VERSAO = 1
+LIMITE_ARQUIVOS = 20
+LIMITE_BYTES = 200 * 1024 * 1024
+
+# Relatórios em segundo plano também registram no índice (ver tarefas.py)
+_trava = threading.Lock()
+
+
+def nome_arquivo(data_inicial, data_final, prefixo=None):
+    nome = f'Relatorio_{data_inicial.replace("/", "")}_{data_final.replace("/", "")}'
+    if prefixo:
+        # Extrato de um prefixo (ver relatorios.gerar_lote)
+        nome += '_' + re.sub(r'[^\w-]', '-', prefixo)
+    return nome + '.xlsx'
+
+
+def versao_dados():
+    """Versão atual do histórico de saídas: [identificação, fim], ou None se ele não existe."""
+    estado = banco.estado_historico(TIPO)
+    if estado is None:
+        return None
+    identidade, fim = estado
+    # Em JSON a tupla vira lista; já guarda assim para comparar
+    return [list(identidade), fim]
+
+
+def _ler_indice(pasta):
+    try:
+        with open(os.path.join(pasta, INDICE), 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def _gravar_indice(pasta, indice):
+    caminho = os.path.join(pasta, INDICE)
+    try:
+        with open(caminho + '.tmp', 'w', encoding='utf-8') as file:
+            json.dump(indice, file, ensure_ascii=False, indent=2)
+        os.replace(caminho + '.tmp', caminho)
+    except OSError:
+        # Sem o índice os relatórios só deixam de ser reaproveitados
+        pass
+
+
+def _arquivo_intacto(caminho, entrada):
+    # Um relatório aberto e salvo pelo usuário não é reaproveitado
+    try:
+        info = os.stat(caminho)
+    except FileNotFoundError:
+        return False
+    return info.st_mtime_ns == entrada['mtime'] and info.st_size == entrada['tamanho']
+
+
+def _dados_inalterados(entrada, versao, inicio, fim):
+    """
+    Confere se o histórico ainda é o mesmo da geração do relatório. Se só
+    foram acrescentadas saídas fora do período, atualiza a entrada com a
+    versão atual.
+    """
+    salva = entrada['dados']
+    if versao is None or salva is None or versao[0] != salva[0] or versao[1] < salva[1]:
+        return False
+    if versao[1] == salva[1]:
+        return True
+
+    for _posicao, seguinte, registro in banco.historico_desde(TIPO, salva[1]):
+        if inicio <= datas.carimbar(registro) <= fim:
+            return False
+        salva[1] = seguinte
+    return True
+
+
+def _podar(pasta, indice, manter):
+    """Apaga os relatórios usados há mais tempo até o cache caber nos limites."""
+    for nome in list(indice):
+        if not os.path.exists(os.path.join(pasta, nome)):
+            del indice[nome]
+
+    antigos = sorted((entrada['usado'], nome) for nome, entrada in indice.items()
+                     if nome != manter)
+    total = sum(entrada['tamanho'] for entrada in indice.values())
+    while antigos and (len(indice) > LIMITE_ARQUIVOS or total > LIMITE_BYTES):
+        _usado, nome = antigos.pop(0)
+        total -= indice.pop(nome)['tamanho']
+        try:
+            os.remove(os.path.join(pasta, nome))
+        except OSError:
+            pass
+
+
+def procurar(pasta, data_inicial, data_final):
+    """Caminho do relatório do período se ele ainda vale para os dados atuais, senão None."""
+    try:
+        inicio, fim = datas.periodo(data_inicial, data_final)
+    except ValueError:
+        return None
+
+    with _trava:
+        indice = _ler_indice(pasta)
+        nome = nome_arquivo(data_inicial, data_final)
+        entrada = indice.get(nome)
+        caminho = os.path.join(pasta, nome)
+        if entrada is None or entrada['versao'] != VERSAO or not _arquivo_intacto(caminho, entrada):
+            return None
+        if not _dados_inalterados(entrada, versao_dados(), inicio, fim):
+            return None
+
+        entrada['usado'] = time.time()
+        _gravar_indice(pasta, indice)
+        return caminho
+
+
+def registrar(pasta, caminho, data_inicial, data_final, versao):
+    """
+    Anota um relatório recém-gerado. versao é a versão do histórico lida
+    para ele (ver agregados.instantaneo): o que entrou depois invalida o
+    relatório.
+    """
+    info = os.stat(caminho)
+    with _trava:
+        indice = _ler_indice(pasta)
+        nome = os.path.basename(caminho)
+        indice[nome] = {
+            'inicio': data_inicial,
+            'fim': data_final,
+            'versao': VERSAO,
+            'dados': versao,
+            'mtime': info.st_mtime_ns,
+            'tamanho': info.st_size,
+            'usado': time.time(),
+        }
+        _podar(pasta, indice, nome)
+        _gravar_indice(pasta, indice)
@@ -0,0 +1,56 @@
+# datas.py
+# Datas dos registros de histórico em formato ordenável. Os registros guardam
+# a data como texto ("DD/MM/AAAA" ou "DD/MM/AAAA HH:MM:SS") e, junto dela, o
+# campo data_ts: um inteiro AAAAMMDDhhmmss, que pode ser comparado direto.
+
+import calendar
+from datetime import datetime
+
+CAMPO = 'data_ts'
+# Campos de data usados pelos registros (as exclusões usam data_hora)
+CAMPOS_TEXTO = ('data', 'data_hora')
+
+
+def ordenavel(texto):
+    """Converte "DD/MM/AAAA[ HH:MM:SS]" no inteiro AAAAMMDDhhmmss (0 se inválido)."""
+    try:
+        texto = str(texto).strip()
+        dia, mes, ano = texto[:10].split('/')
+        valor = (int(ano) * 10000 + int(mes) * 100 + int(dia)) * 1000000
+        if len(texto) > 10:
+            hora, minuto, segundo = texto[11:19].split(':')
+            valor += int(hora) * 10000 + int(minuto) * 100 + int(segundo)
+        return valor
+    except ValueError:
+        return 0
+
+
+def do_dia(data, fim=False):
+    """Inteiro ordenável do início (ou do fim) do dia de um datetime/date."""
+    valor = (data.year * 10000 + data.month * 100 + data.day) * 1000000
+    return valor + 235959 if fim else valor
+
+
+def periodo(data_inicial, data_final):
+    """Inteiros do início e do fim de um período "DD/MM/AAAA" (ValueError se inválido)."""
+    inicio = datetime.strptime(data_inicial, "%d/%m/%Y")
+    fim = datetime.strptime(data_final, "%d/%m/%Y")
+    return do_dia(inicio), do_dia(fim, fim=True)
+
+
+def meses(ano):
+    """Os doze períodos ("DD/MM/AAAA", "DD/MM/AAAA") dos meses do ano."""
+    return [(f'01/{mes:02d}/{ano}', f'{calendar.monthrange(ano, mes)[1]:02d}/{mes:02d}/{ano}')
+            for mes in range(1, 13)]
+
+
+def carimbar(registro):
+    """Preenche data_ts a partir da data em texto do registro, se ainda não tiver."""
+    if CAMPO not in registro:
+        for campo in CAMPOS_TEXTO:
+            if campo in registro:
+                registro[CAMPO] = ordenavel(registro[campo])
+                break
+        else:
+            registro[CAMPO] = 0
+    return registro[CAMPO]
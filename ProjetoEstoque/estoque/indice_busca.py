@@ -0,0 +1,130 @@
+# indice_busca.py
+# Índice de trigramas para as buscas por trecho de nome, modelo e partNumber
+# dos produtos do estoque. O banco avisa o índice a cada inserção, alteração e
+# remoção; a montagem completa só acontece na primeira busca.
+
+CAMPOS = ('nome', 'modelo', 'partNumber')
+TAMANHO = 3
+
+# Produtos indexados (banco.produtos.values()) e se o índice já foi montado
+_fonte = []
+_montado = False
+# id() do produto -> produto e ordem em que entrou no estoque
+_registros = {}
+_ordem = {}
+_proxima_ordem = 0
+# campo -> {id() do produto: valor em minúsculas}
+_valores = {campo: {} for campo in CAMPOS}
+# campo -> {trigrama: {id() dos produtos}}
+_postings = {campo: {} for campo in CAMPOS}
+
+
+def _texto(registro, campo):
+    valor = registro.get(campo)
+    return str(valor).lower() if valor is not None else ''
+
+
+def _trigramas(texto):
+    return {texto[i:i + TAMANHO] for i in range(len(texto) - TAMANHO + 1)}
+
+
+def _indexar_campo(chave, campo, texto):
+    _valores[campo][chave] = texto
+    postings = _postings[campo]
+    for trigrama in _trigramas(texto):
+        postings.setdefault(trigrama, set()).add(chave)
+
+
+def _desindexar_campo(chave, campo):
+    texto = _valores[campo].pop(chave, '')
+    postings = _postings[campo]
+    for trigrama in _trigramas(texto):
+        chaves = postings.get(trigrama)
+        if chaves is not None:
+            chaves.discard(chave)
+            if not chaves:
+                del postings[trigrama]
+
+
+def _adicionar(registro):
+    global _proxima_ordem
+
+    chave = id(registro)
+    _registros[chave] = registro
+    _ordem[chave] = _proxima_ordem
+    _proxima_ordem += 1
+    for campo in CAMPOS:
+        _indexar_campo(chave, campo, _texto(registro, campo))
+
+
+def _montar():
+    global _montado
+
+    for registro in _fonte:
+        _adicionar(registro)
+    _montado = True
+
+
+def reconstruir(registros):
+    """Passa a indexar outra lista de produtos (montada na próxima busca)."""
+    global _fonte, _montado, _proxima_ordem
+
+    _fonte = registros
+    _montado = False
+    _proxima_ordem = 0
+    _registros.clear()
+    _ordem.clear()
+    for campo in CAMPOS:
+        _valores[campo].clear()
+        _postings[campo].clear()
+
+
+def adicionar(registro):
+    if _montado:
+        _adicionar(registro)
+
+
+def atualizar(registro):
+    """Reindexa os campos do produto cujo valor mudou."""
+    if not _montado:
+        return
+    chave = id(registro)
+    for campo in CAMPOS:
+        texto = _texto(registro, campo)
+        if _valores[campo].get(chave) != texto:
+            _desindexar_campo(chave, campo)
+            _indexar_campo(chave, campo, texto)
+
+
+def remover(registro):
+    if not _montado:
+        return
+    chave = id(registro)
+    for campo in CAMPOS:
+        _desindexar_campo(chave, campo)
+    _registros.pop(chave, None)
+    _ordem.pop(chave, None)
+
+
+def buscar(campo, termo):
+    """
+    Produtos cujo campo contém o termo (sem diferenciar maiúsculas), na ordem
+    do estoque. Termos com menos de três letras não têm trigramas e são
+    conferidos direto nos valores já guardados em minúsculas.
+    """
+    if not _montado:
+        _montar()
+
+    termo = termo.lower()
+    valores = _valores[campo]
+    trigramas = _trigramas(termo)
+    if trigramas:
+        postings = _postings[campo]
+        listas = sorted((postings.get(trigrama, set()) for trigrama in trigramas), key=len)
+        candidatos = set(listas[0]).intersection(*listas[1:])
+    else:
+        candidatos = valores.keys()
+
+    encontrados = [chave for chave in candidatos if termo in valores[chave]]
+    encontrados.sort(key=_ordem.__getitem__)
+    return [_registros[chave] for chave in encontrados]
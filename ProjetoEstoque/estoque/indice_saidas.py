@@ -0,0 +1,157 @@
+# indice_saidas.py
+# Índice das saídas (expedições) por partNumber e por prefixo_aviao. Para cada
+# valor guarda a lista (data, posição no arquivo) ordenada por data, então
+# "saídas do PN X a partir da data Y" é uma busca binária seguida de um corte.
+#
+# O índice fica salvo em backup/cache/indice_saidas.marshal junto com até onde
+# o arquivo de saídas já foi indexado; o que foi acrescentado depois disso é
+# lido na primeira consulta. Enquanto o programa roda, cada saída registrada
+# entra no índice na hora (ver banco.observar_historico).
+
+import json
+import marshal
+import os
+from bisect import bisect_left, insort
+
+from estoque import banco, datas
+
+TIPO = 'estoque_saidas'
+CAMPOS = ('partNumber', 'prefixo_aviao')
+VERSAO = 2
+ARQUIVO = os.path.join(banco.PASTA_CACHE, 'indice_saidas.marshal')
+
+_carregado = False
+_alterado = False
+# Arquivo indexado (inode) e até que posição ele já foi lido
+_inode = None
+_coberto = 0
+# campo -> {valor em minúsculas: [(data_ts, posição), ...]}
+_postings = {campo: {} for campo in CAMPOS}
+
+
+def _adicionar(posicao, registro):
+    data = datas.carimbar(registro)
+    for campo in CAMPOS:
+        valor = registro.get(campo)
+        if valor is None:
+            continue
+        insort(_postings[campo].setdefault(str(valor).lower(), []), (data, posicao))
+
+
+def _limpar():
+    global _coberto, _alterado
+
+    _coberto = 0
+    _alterado = True
+    for campo in CAMPOS:
+        _postings[campo].clear()
+
+
+def _ler_salvo(inode):
+    global _coberto
+
+    try:
+        with open(ARQUIVO, 'rb') as file:
+            versao, inode_salvo, coberto, postings = marshal.loads(file.read())
+    except (OSError, EOFError, ValueError, TypeError):
+        return
+    if versao != VERSAO or inode_salvo != inode:
+        return
+    _coberto = coberto
+    _postings.update(postings)
+
+
+def _salvar():
+    global _alterado
+
+    try:
+        os.makedirs(banco.PASTA_CACHE, exist_ok=True)
+        with open(ARQUIVO + '.tmp', 'wb') as file:
+            file.write(marshal.dumps((VERSAO, _inode, _coberto, _postings)))
+        os.replace(ARQUIVO + '.tmp', ARQUIVO)
+        _alterado = False
+    except (OSError, ValueError):
+        # O índice pode sempre ser refeito a partir do arquivo de saídas
+        pass
+
+
+def _atualizar():
+    """Carrega o índice salvo e indexa o que foi acrescentado ao arquivo depois dele."""
+    global _carregado, _inode, _coberto, _alterado
+
+    caminho = banco.caminho_historico(TIPO)
+    try:
+        info = os.stat(caminho)
+    except FileNotFoundError:
+        # Nenhuma saída registrada ainda
+        _inode = None
+        _limpar()
+        _alterado = False
+        if not _carregado:
+            banco.observar_historico(TIPO, anexados)
+        _carregado = True
+        return
+
+    if not _carregado or info.st_ino != _inode:
+        _limpar()
+        _inode = info.st_ino
+        _ler_salvo(_inode)
+        if not _carregado:
+            banco.observar_historico(TIPO, anexados)
+        _carregado = True
+    if _coberto > info.st_size:
+        # O arquivo foi trocado ou truncado: indexa tudo de novo
+        _limpar()
+    if _coberto == info.st_size:
+        return
+
+    with open(caminho, 'rb') as file:
+        file.seek(_coberto)
+        for linha in file:
+            if not linha.endswith(b'\n'):
+                # Linha ainda incompleta: fica para a próxima vez
+                break
+            try:
+                _adicionar(_coberto, json.loads(linha))
+            except ValueError:
+                pass
+            _coberto += len(linha)
+    _alterado = True
+
+
+def anexados(posicoes, fim, registros):
+    """
+    Chamado pelo banco logo após acrescentar saídas ao arquivo, com a posição
+    de cada uma e onde o arquivo termina agora.
+    """
+    global _coberto, _alterado
+
+    if not posicoes or posicoes[0] != _coberto:
+        # Há algo antes delas ainda não indexado: a próxima consulta lê tudo
+        return
+    for posicao, registro in zip(posicoes, registros):
+        _adicionar(posicao, registro)
+    _coberto = fim
+    _alterado = True
+
+
+def buscar(campo, valor, desde=None):
+    """
+    Saídas cujo campo (partNumber ou prefixo_aviao) é igual ao valor, sem
+    diferenciar maiúsculas, a partir da data `desde` (datetime), em ordem de data.
+    """
+    inicio = datas.do_dia(desde) if desde else 0
+
+    if banco.BACKEND == 'sqlite':
+        # O SQLite já tem índice nessas colunas
+        saidas = [saida for saida in banco.buscar_historico(TIPO, campo, valor)
+                  if datas.carimbar(saida) >= inicio]
+        return sorted(saidas, key=lambda saida: saida[datas.CAMPO])
+
+    _atualizar()
+    if _alterado:
+        _salvar()
+
+    lista = _postings[campo].get(valor.lower(), [])
+    encontrados = lista[bisect_left(lista, (inicio,)):]
+    return banco.ler_historico_em(TIPO, [posicao for _data_saida, posicao in encontrados])
@@ -0,0 +1,375 @@
+# lote.py
+# Operações em lote a partir de planilhas (CSV ou XLSX), para uso pela linha
+# de comando (ver main.py): entradas no estoque e expedições. Importa o
+# pandas, por isso só é importado quando um desses comandos é usado.
+#
+# Todas as linhas são validadas antes de qualquer alteração; se alguma tiver
+# erro, nada é gravado. As alterações de um arquivo formam uma única
+# transação do banco, gravada uma vez no final.
+
+from datetime import datetime
+
+import pandas as pd
+
+from estoque import banco
+
+CLASSIFICACOES = ('AERO', 'AUTO', 'EPI', 'CONS')
+CONDICOES = {'novo': 'Novo', 'usado': 'Usado', 'revisado': 'Revisado'}
+
+# Colunas da planilha de entradas (os nomes dos campos do produto)
+COLUNAS_ENTRADAS = ('classificacao', 'nome', 'modelo', 'quantidade', 'valor', 'condicao',
+                    'origem', 'partNumber', 'serialNumber', 'tipo_produto', 'frete',
+                    'quantidade_fretada')
+OBRIGATORIAS_ENTRADAS = ('classificacao', 'nome', 'modelo', 'quantidade', 'valor')
+
+# Colunas da planilha de expedições: o produto (id ou part number) e a
+# quantidade; os dados de cada classificação podem vir por linha ou, para o
+# lote todo, da linha de comando
+COLUNAS_EXPEDICOES = ('id', 'partNumber', 'quantidade', 'serialNumber', 'placa_camionete',
+                      'nome_badeco', 'observacoes')
+
+# Erros mostrados por arquivo (os demais só são contados)
+LIMITE_ERROS = 30
+
+
+def ler_planilha(caminho, colunas):
+    """
+    Lê o CSV (separador ; ou , detectado) ou XLSX como texto, com os nomes
+    das colunas reconhecidos sem diferenciar maiúsculas. Colunas que não
+    estão em `colunas` são ignoradas.
+    """
+    if caminho.lower().endswith(('.xlsx', '.xls')):
+        # Precisa do openpyxl instalado
+        df = pd.read_excel(caminho, dtype=str, keep_default_na=False)
+    else:
+        df = pd.read_csv(caminho, dtype=str, keep_default_na=False, sep=None,
+                         engine='python', encoding='utf-8-sig')
+
+    nomes = {coluna.lower(): coluna for coluna in colunas}
+    df = df.rename(columns=lambda coluna: nomes.get(str(coluna).strip().lower(), coluna))
+    df = df[[coluna for coluna in df.columns if coluna in colunas]]
+    # Linhas totalmente vazias (comuns no fim de planilhas) são descartadas
+    df = df[(df.apply(lambda serie: serie.str.strip()) != '').any(axis=1)]
+    return df.apply(lambda serie: serie.str.strip())
+
+
+def numeros(serie):
+    """Converte texto em número aceitando vírgula decimal ("1.234,56"); inválidos viram NaN."""
+    com_virgula = serie.str.contains(',', regex=False)
+    serie = serie.where(~com_virgula,
+                        serie.str.replace('.', '', regex=False).str.replace(',', '.', regex=False))
+    return pd.to_numeric(serie, errors='coerce')
+
+
+def marcar(erros, df, mascara, mensagem):
+    """Anota o erro em cada linha da máscara, pelo número da linha no arquivo (1 é o cabeçalho)."""
+    erros.extend((indice + 2, mensagem) for indice in df.index[mascara])
+
+
+def mostrar_erros(erros):
+    erros.sort()
+    for linha, mensagem in erros[:LIMITE_ERROS]:
+        print(f"Linha {linha}: {mensagem}")
+    if len(erros) > LIMITE_ERROS:
+        print(f"... e mais {len(erros) - LIMITE_ERROS} erros.")
+
+
+def _numero(valor):
+    # Inteiro quando não tem parte fracionária (as mangueiras usam metros fracionados)
+    return int(valor) if float(valor).is_integer() else float(valor)
+
+
+def _chave(nome, modelo, part_number, condicao):
+    return (str(nome).strip().lower(), str(modelo).strip().lower(),
+            str(part_number or '-').strip().lower(), str(condicao or '').strip().lower())
+
+
+def validar_entradas(df):
+    """
+    Confere todas as linhas de uma vez (coluna a coluna) e devolve a planilha
+    com os valores já convertidos e a lista de erros.
+    """
+    erros = []
+    faltando = [coluna for coluna in OBRIGATORIAS_ENTRADAS if coluna not in df.columns]
+    if faltando:
+        erros.append((1, f"colunas obrigatórias ausentes: {', '.join(faltando)}"))
+        return df, erros
+
+    df = df.copy()
+    for coluna in COLUNAS_ENTRADAS:
+        if coluna not in df.columns:
+            df[coluna] = ''
+
+    df['classificacao'] = df['classificacao'].str.upper()
+    marcar(erros, df, ~df['classificacao'].isin(CLASSIFICACOES),
+           f"classificação deve ser uma de {', '.join(CLASSIFICACOES)}")
+    marcar(erros, df, df['nome'] == '', "nome vazio")
+    marcar(erros, df, df['modelo'] == '', "modelo vazio")
+
+    consumo = df['classificacao'] == 'CONS'
+    df['tipo_produto'] = df['tipo_produto'].str.lower().replace('', 'normal')
+    mangueira = df['tipo_produto'] == 'mangueira'
+    marcar(erros, df, ~df['tipo_produto'].isin(['normal', 'mangueira']),
+           "tipo_produto deve ser normal ou mangueira")
+    marcar(erros, df, mangueira & ~consumo, "só produtos CONS podem ser mangueira")
+
+    condicao = df['condicao'].str.lower()
+    marcar(erros, df, ~consumo & ~condicao.isin(list(CONDICOES)),
+           "condição deve ser Novo, Usado ou Revisado")
+    df['condicao'] = condicao.map(CONDICOES).where(~consumo, '')
+
+    df['quantidade'] = numeros(df['quantidade'])
+    marcar(erros, df, ~(df['quantidade'] > 0), "quantidade deve ser um número maior que zero")
+    marcar(erros, df, (df['quantidade'] % 1 != 0) & ~mangueira & (df['quantidade'] > 0),
+           "quantidade deve ser inteira (só mangueiras usam metros fracionados)")
+
+    df['valor'] = numeros(df['valor'])
+    marcar(erros, df, ~(df['valor'] >= 0), "valor deve ser um número maior ou igual a zero")
+
+    df['frete'] = numeros(df['frete'].replace('', '0'))
+    marcar(erros, df, ~(df['frete'] >= 0), "frete deve ser um número maior ou igual a zero")
+    fretada = numeros(df['quantidade_fretada'])
+    # Como no cadastro: sem informar, a quantidade fretada é a própria quantidade
+    fretada = fretada.where(df['quantidade_fretada'] != '', df['quantidade'])
+    df['quantidade_fretada'] = fretada.where(df['frete'] > 0, 0)
+    marcar(erros, df, (df['frete'] > 0) & ~(fretada > 0),
+           "quantidade_fretada deve ser um número maior que zero")
+
+    df['partNumber'] = df['partNumber'].replace('', '-')
+    df['serialNumber'] = df['serialNumber'].replace('', '-')
+    return df, erros
+
+
+def importar_entradas(caminho, simular=False):
+    """
+    Importa uma planilha de entradas no estoque. Cada linha soma a quantidade
+    ao produto com o mesmo nome, modelo, part number e condição (sem
+    diferenciar maiúsculas) ou cadastra um produto novo, e fica registrada no
+    histórico de entradas. Com simular=True só valida e mostra o resultado.
+    Devolve True se o arquivo foi importado (ou seria, na simulação).
+    """
+    try:
+        df = ler_planilha(caminho, COLUNAS_ENTRADAS)
+    except (OSError, ValueError, ImportError) as e:
+        print(f"Erro ao ler {caminho}: {e}")
+        return False
+
+    df, erros = validar_entradas(df)
+    if erros:
+        print(f"{len(erros)} erro(s) em {caminho}; nada foi importado.")
+        mostrar_erros(erros)
+        return False
+    if df.empty:
+        print(f"Nenhuma linha para importar em {caminho}.")
+        return False
+
+    existentes = {}
+    for produto in banco.produtos.values():
+        existentes.setdefault(_chave(produto['nome'], produto['modelo'],
+                                     produto.get('partNumber'), produto.get('condicao')), produto)
+
+    novos = atualizados = 0
+    data = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
+    with banco.transacao():
+        for linha in df.itertuples(index=False):
+            quantidade = _numero(linha.quantidade)
+            frete = float(linha.frete)
+            quantidade_fretada = _numero(linha.quantidade_fretada)
+            chave = _chave(linha.nome, linha.modelo, linha.partNumber, linha.condicao)
+            produto = existentes.get(chave)
+
+            if produto is None:
+                produto = {
+                    'classificacao': linha.classificacao,
+                    'nome': linha.nome,
+                    'modelo': linha.modelo,
+                    'valor': float(linha.valor),
+                    'quantidade': quantidade,
+                    'origem': linha.origem,
+                    'data': data,
+                    'partNumber': linha.partNumber,
+                    'serialNumber': linha.serialNumber,
+                    'tipo_produto': linha.tipo_produto,
+                    'frete': frete,
+                    'quantidade_fretada': quantidade_fretada
+                }
+                if linha.condicao:
+                    produto['condicao'] = linha.condicao
+                if not simular:
+                    banco.inserir('estoque', produto)
+                existentes[chave] = produto
+                entrada = dict(produto)
+                novos += 1
+            else:
+                if not simular:
+                    banco.atualizar('estoque', produto, {
+                        'quantidade': produto['quantidade'] + quantidade,
+                        'frete': frete,
+                        'quantidade_fretada': quantidade_fretada})
+                entrada = dict(produto, quantidade=quantidade, valor=float(linha.valor),
+                               origem=linha.origem, data=data, frete=frete,
+                               quantidade_fretada=quantidade_fretada)
+                atualizados += 1
+
+            if not simular:
+                banco.anexar_historico('estoque_entradas', entrada)
+
+    acao = "Seriam importadas" if simular else "Importadas"
+    print(f"{acao} {len(df)} entradas: {novos} produtos novos, "
+          f"{atualizados} entradas em produtos existentes.")
+    return True
+
+
+def _ids_por_part_number():
+    """part number (sem diferenciar maiúsculas) -> id, ou None se houver mais de um produto com ele."""
+    ids = {}
+    for produto in banco.produtos.values():
+        part_number = str(produto.get('partNumber') or '').strip().lower()
+        if part_number and part_number not in ('-', 'n/a'):
+            ids[part_number] = None if part_number in ids else produto['id']
+    return ids
+
+
+def validar_expedicoes(df, prefixo, placa='', badeco=''):
+    """
+    Confere todas as linhas de uma vez, inclusive se o estoque de cada produto
+    basta para a soma das quantidades pedidas no arquivo, e devolve a planilha
+    com o id do produto de cada linha e a lista de erros.
+    """
+    erros = []
+    if 'quantidade' not in df.columns or ('id' not in df.columns
+                                          and 'partNumber' not in df.columns):
+        erros.append((1, "o arquivo precisa das colunas quantidade e id ou partNumber"))
+        return df, erros
+
+    df = df.copy()
+    for coluna in COLUNAS_EXPEDICOES:
+        if coluna not in df.columns:
+            df[coluna] = ''
+
+    # O id tem precedência; sem ele o produto é achado pelo part number
+    ids = numeros(df['id'])
+    por_part_number = _ids_por_part_number()
+    part_number = df['partNumber'].str.lower()
+    ambiguo = (df['id'] == '') & part_number.isin(
+        [pn for pn, id_produto in por_part_number.items() if id_produto is None])
+    marcar(erros, df, ambiguo, "mais de um produto com este part number; informe o id")
+    ids = ids.where(df['id'] != '', part_number.map(por_part_number))
+    ids = ids.where(ids.isin(list(banco.produtos)))
+    marcar(erros, df, ~ambiguo & ids.isna(), "produto não encontrado")
+    df['produto_id'] = ids
+
+    encontrados = ids.notna()
+    produtos = ids[encontrados].astype(int).map(banco.produtos)
+    classificacao = produtos.map(lambda produto: produto['classificacao']).reindex(df.index)
+    mangueira = produtos.map(lambda produto: produto.get('tipo_produto') == 'mangueira') \
+        .reindex(df.index, fill_value=False)
+    disponivel = produtos.map(lambda produto: produto['quantidade']).reindex(df.index)
+
+    df['quantidade'] = numeros(df['quantidade'])
+    marcar(erros, df, ~(df['quantidade'] > 0), "quantidade deve ser um número maior que zero")
+    marcar(erros, df, (df['quantidade'] % 1 != 0) & ~mangueira & (df['quantidade'] > 0),
+           "quantidade deve ser inteira (só mangueiras usam metros fracionados)")
+    # Várias linhas podem tirar do mesmo produto: vale a soma delas
+    pedido = df['quantidade'].groupby(df['produto_id']).transform('sum')
+    marcar(erros, df, encontrados & (pedido > disponivel),
+           "estoque insuficiente para a quantidade pedida no arquivo")
+
+    df['placa_camionete'] = df['placa_camionete'].replace('', placa)
+    df['nome_badeco'] = df['nome_badeco'].replace('', badeco)
+    if not prefixo:
+        marcar(erros, df, classificacao.isin(['AERO', 'AUTO', 'EPI']),
+               "o prefixo é obrigatório para peças AERO, AUTO e EPI")
+    marcar(erros, df, (classificacao == 'AUTO') & (df['placa_camionete'] == ''),
+           "para peças AUTO, a placa da camionete é obrigatória")
+    marcar(erros, df, (classificacao == 'EPI') & (df['nome_badeco'] == ''),
+           "para peças EPI, o nome do badeco é obrigatório")
+    return df, erros
+
+
+def _saida(produto, quantidade, data, prefixo, linha):
+    """O registro de saída como o de operacoes.registrar_saida."""
+    valor = produto['valor']
+    if produto.get('frete', 0) > 0 and produto.get('quantidade_fretada', 0) > 0:
+        frete_proporcional = produto['frete'] / produto['quantidade_fretada']
+    else:
+        frete_proporcional = 0
+
+    saida = {
+        'produto_id': produto['id'],
+        'data': data,
+        'nome': produto['nome'],
+        'modelo': produto['modelo'],
+        'classificacao': produto['classificacao'],
+        'condicao': produto.get('condicao', 'N/A'),
+        'quantidade': quantidade,
+        'valor': valor,
+        'frete_proporcional': frete_proporcional,
+        'valor_frete_total': quantidade * (valor + frete_proporcional),
+        'origem': produto.get('origem', 'N/A'),
+        'partNumber': produto.get('partNumber', 'N/A'),
+        'frete_original': produto.get('frete', 0),
+        'quantidade_fretada': produto.get('quantidade_fretada', 0),
+        'observacoes': 'N/A'
+    }
+    if produto.get('tipo_produto') == 'mangueira':
+        saida['tipo_produto'] = 'mangueira'
+
+    saida['prefixo_aviao'] = prefixo or 'N/A'
+    if produto['classificacao'] == 'AERO':
+        saida['serialNumber'] = linha.serialNumber or 'N/A'
+    elif produto['classificacao'] == 'AUTO':
+        saida['placa_camionete'] = linha.placa_camionete
+    elif produto['classificacao'] == 'EPI':
+        saida['nome_badeco'] = linha.nome_badeco
+    saida['observacoes'] = linha.observacoes or 'N/A'
+    return saida
+
+
+def expedir(caminho, prefixo, data, placa='', badeco='', simular=False):
+    """
+    Registra de uma vez as expedições de uma planilha para o prefixo na data
+    (DD/MM/AAAA): cada linha baixa a quantidade do produto e fica no histórico
+    de saídas. Tudo é conferido antes e gravado numa única transação; com
+    simular=True só valida e mostra o resultado. Devolve True se o arquivo foi
+    expedido (ou seria, na simulação).
+    """
+    try:
+        df = ler_planilha(caminho, COLUNAS_EXPEDICOES)
+    except (OSError, ValueError, ImportError) as e:
+        print(f"Erro ao ler {caminho}: {e}")
+        return False
+
+    df, erros = validar_expedicoes(df, prefixo.strip(), placa.strip(), badeco.strip())
+    if erros:
+        print(f"{len(erros)} erro(s) em {caminho}; nenhuma expedição foi registrada.")
+        mostrar_erros(erros)
+        return False
+    if df.empty:
+        print(f"Nenhuma linha para expedir em {caminho}.")
+        return False
+
+    total = 0.0
+    removidos = 0
+    with banco.transacao():
+        for linha in df.itertuples(index=False):
+            produto = banco.produtos[int(linha.produto_id)]
+            quantidade = _numero(linha.quantidade)
+            saida = _saida(produto, quantidade, data, prefixo.strip(), linha)
+            total += saida['valor_frete_total']
+            if simular:
+                continue
+
+            banco.atualizar('estoque', produto, {
+                'quantidade': produto['quantidade'] - quantidade})
+            banco.anexar_historico('estoque_saidas', saida)
+            if produto['quantidade'] == 0:
+                banco.remover('estoque', produto)
+                removidos += 1
+
+    acao = "Seriam registradas" if simular else "Registradas"
+    print(f"{acao} {len(df)} expedições para {prefixo.strip() or 'sem prefixo'} "
+          f"em {data}, valor total R$ {total:.2f}.")
+    if removidos:
+        print(f"{removidos} produto(s) zerado(s) removido(s) do estoque.")
+    return True
@@ -2,17 +2,13 @@
 
 from typing import Optional
 import os
-import json
 from functools import wraps
-import keyboard
 import sys
 from datetime import datetime
-from estoque import banco
-import pandas as pd
+from estoque import banco, cache_relatorios, indice_busca, indice_saidas, tarefas
 import subprocess
 import logging
 from pathlib import Path
-import re
 
 # limpar tela
 
@@ -41,39 +37,19 @@ def verificar_cancelamento(func):
 
 def salvar_dados_seguro(func):
     """
-    Decorador para garantir o salvamento seguro de dados com backup automático
-    e registro de erros!!
+    Decorador que executa a operação como uma transação do banco: tudo que ela
+    alterar é gravado uma única vez no final, ou desfeito se ocorrer um erro,
+    com registro do erro.
     """
     @wraps(func)
     def wrapper(*args, **kwargs):
-        # Criar backup antes da operação
         try:
-            if os.path.exists('dados.json'):
-                with open('dados.json', 'r') as f:
-                    backup_data = f.read()
-
-                # Criar pasta de backup se não existir
-                if not os.path.exists('backup'):
-                    os.makedirs('backup')
-
-                # Salvar backup com timestamp
-                backup_file = f'backup/backup_{
-                    datetime.now().strftime("%Y%m%d_%H%M%S")}.json'
-                with open(backup_file, 'w') as f:
-                    f.write(backup_data)
-        except Exception as e:
-            print(f"Erro ao criar backup: {e}")
-            return None
-
-        try:
-            result = func(*args, **kwargs)
-            banco.salvar_dados()
-            return result
+            with banco.transacao():
+                return func(*args, **kwargs)
 
         except Exception as e:
             # Registrar erro em um arquivo de log
-            error_msg = f"[{datetime.now()}] Erro na função {
-                func.__name__}: {str(e)}"
+            error_msg = f"[{datetime.now()}] Erro na função {func.__name__}: {str(e)}\n"
 
             try:
                 with open('error_log.txt', 'a') as f:
@@ -81,39 +57,13 @@ def salvar_dados_seguro(func):
             except:
                 print("Não foi possível salvar o log de erro")
 
-            try:
-                if os.path.exists(backup_file):
-                    with open(backup_file, 'r') as f:
-                        backup_data = json.load(f)
-                    with open('dados.json', 'w') as f:
-                        json.dump(backup_data, f, indent=4)
-                    print("Dados restaurados do backup após erro")
-            except:
-                print("Não foi possível restaurar o backup")
-
+            print("As alterações da operação foram desfeitas.")
             print(f"Erro ao processar operação: {e}")
             return None
 
     return wrapper
 
 
-def limpar_backups_antigos(dias=365):
-    """Remove backups mais antigos que o número de dias especificado"""
-    try:
-        import time
-        now = time.time()
-        backup_dir = 'backup'
-
-        if os.path.exists(backup_dir):
-            for f in os.listdir(backup_dir):
-                if f.startswith('backup_') and f.endswith('.json'):
-                    f_path = os.path.join(backup_dir, f)
-                    if os.stat(f_path).st_mtime < now - (dias * 86400):
-                        os.remove(f_path)
-    except Exception as e:
-        print(f"Erro ao limpar backups antigos: {e}")
-
-
 def configurar_log():
     """Configura log básico para rastreamento de erros"""
     if not os.path.exists('logs'):
@@ -197,14 +147,13 @@ def adicionar_produto():
 
         resultados = []
         if opcao_busca == "1":
-            resultados = [p for p in banco.estoque if termo_busca.lower(
-            ) in p['nome'].lower() and p['classificacao'] == classificacao]
+            resultados = [p for p in indice_busca.buscar('nome', termo_busca)
+                          if p['classificacao'] == classificacao]
         elif opcao_busca == "2":
-            resultados = [p for p in banco.estoque if termo_busca.lower(
-            ) in p['modelo'].lower() and p['classificacao'] == classificacao]
+            resultados = [p for p in indice_busca.buscar('modelo', termo_busca)
+                          if p['classificacao'] == classificacao]
         elif opcao_busca == "3" and classificacao == "AERO":
-            resultados = [p for p in banco.estoque if termo_busca.lower() in str(
-                p.get('partNumber', '')).lower()]
+            resultados = indice_busca.buscar('partNumber', termo_busca)
 
         if resultados:
             print("\nProdutos encontrados:")
@@ -228,7 +177,8 @@ def adicionar_produto():
                     if quantidade <= 0:
                         print("Quantidade inválida!")
                         return
-                    produto_existente['quantidade'] += quantidade
+                    banco.atualizar('estoque', produto_existente, {
+                        'quantidade': produto_existente['quantidade'] + quantidade})
                     print(
                         f"Quantidade atualizada com sucesso! Nova quantidade: {produto_existente['quantidade']} metros")
                 else:
@@ -236,7 +186,8 @@ def adicionar_produto():
                     if quantidade <= 0:
                         print("Quantidade inválida!")
                         return
-                    produto_existente['quantidade'] += quantidade
+                    banco.atualizar('estoque', produto_existente, {
+                        'quantidade': produto_existente['quantidade'] + quantidade})
                     print(
                         f"Quantidade atualizada com sucesso! Nova quantidade: {produto_existente['quantidade']}")
 
@@ -260,36 +211,35 @@ def adicionar_produto():
                             frete = input("Novo valor do frete: R$ ")
                             if frete.lower() == 'cancelar':
                                 return
-                            produto_existente['frete'] = float(
-                                frete) if frete.strip() else 0
+                            banco.atualizar('estoque', produto_existente, {
+                                'frete': float(frete) if frete.strip() else 0})
 
                             # Adicionar quantidade total fretada
                             quant_fretada = input(
                                 "Quantidade total de itens que vieram neste frete: ")
                             if quant_fretada.lower() == 'cancelar':
                                 return
-                            produto_existente['quantidade_fretada'] = int(
-                                quant_fretada) if quant_fretada.strip() else produto_existente['quantidade']
+                            banco.atualizar('estoque', produto_existente, {
+                                'quantidade_fretada': int(quant_fretada) if quant_fretada.strip() else produto_existente['quantidade']})
                     else:
                         frete = input("Valor do frete: R$ ")
                         if frete.lower() == 'cancelar':
                             return
-                        produto_existente['frete'] = float(
-                            frete) if frete.strip() else 0
+                        banco.atualizar('estoque', produto_existente, {
+                            'frete': float(frete) if frete.strip() else 0})
 
                         # Adicionar quantidade total fretada
                         quant_fretada = input(
                             "Quantidade total de itens que vieram neste frete: ")
                         if quant_fretada.lower() == 'cancelar':
                             return
-                        produto_existente['quantidade_fretada'] = int(
-                            quant_fretada) if quant_fretada.strip() else produto_existente['quantidade']
+                        banco.atualizar('estoque', produto_existente, {
+                            'quantidade_fretada': int(quant_fretada) if quant_fretada.strip() else produto_existente['quantidade']})
                 else:
                     # Se não tem frete, garantir que o valor seja zero
-                    produto_existente['frete'] = 0
-                    produto_existente['quantidade_fretada'] = 0
+                    banco.atualizar('estoque', produto_existente, {
+                        'frete': 0, 'quantidade_fretada': 0})
 
-                banco.salvar_dados()
                 return
 
             except (ValueError, IndexError):
@@ -400,23 +350,10 @@ def adicionar_produto():
         if produto['serialNumber'].lower() == 'cancelar':
             return
 
-    banco.estoque.append(produto)
+    banco.inserir('estoque', produto)
     print(f"Produto {produto['nome']} adicionado com sucesso!")
-    banco.salvar_dados()
 
-    arquivo_log = 'backup/estoque_entradas.json'
-    if not os.path.exists('backup'):
-        os.makedirs('backup')
-
-    if not os.path.exists(arquivo_log):
-        with open(arquivo_log, 'w') as file:
-            json.dump([], file)
-
-    with open(arquivo_log, 'r+') as file:
-        logs = json.load(file)
-        logs.append(produto)
-        file.seek(0)
-        json.dump(logs, file, indent=4)
+    banco.anexar_historico('estoque_entradas', produto)
 
 
 # registrar saida
@@ -442,14 +379,11 @@ def registrar_saida():
             return
 
         if opcao_busca == "1":
-            resultados = [
-                p for p in banco.estoque if termo_busca.lower() in p['nome'].lower()]
+            resultados = indice_busca.buscar('nome', termo_busca)
         elif opcao_busca == "2":
-            resultados = [
-                p for p in banco.estoque if termo_busca.lower() in p['modelo'].lower()]
+            resultados = indice_busca.buscar('modelo', termo_busca)
         elif opcao_busca == "3":
-            resultados = [p for p in banco.estoque if termo_busca.lower() in str(
-                p.get('partNumber', '')).lower()]
+            resultados = indice_busca.buscar('partNumber', termo_busca)
         else:
             print("Opção inválida! Tente novamente.")
             return
@@ -557,6 +491,7 @@ def registrar_saida():
                 print("Data inválida! Use o formato DD/MM/AAAA")
 
         saida = {
+            'produto_id': produto_selecionado['id'],
             'data': data,
             'nome': produto_selecionado['nome'],
             'modelo': produto_selecionado['modelo'],
@@ -667,36 +602,14 @@ def registrar_saida():
                 'observacoes': observacoes.strip() if observacoes.strip() else 'N/A'
             })
 
-        produto_selecionado['quantidade'] -= quantidade
-
-        if getattr(sys, 'frozen', False):
-            base_path = os.path.dirname(os.path.dirname(sys.executable))
-        else:
-            base_path = os.path.dirname(os.path.dirname(
-                os.path.dirname(os.path.abspath(__file__))))
-
-        caminho_backup = os.path.join(base_path, 'backup')
-        os.makedirs(caminho_backup, exist_ok=True)
-
-        arquivo_saidas = os.path.join(
-            base_path, 'backup', 'estoque_saidas.json')
-
-        try:
-            with open(arquivo_saidas, 'r', encoding='utf-8') as f:
-                estoque_saidas = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            estoque_saidas = []
-
-        estoque_saidas.append(saida)
+        banco.atualizar('estoque', produto_selecionado, {
+            'quantidade': produto_selecionado['quantidade'] - quantidade})
 
-        with open(arquivo_saidas, 'w', encoding='utf-8') as f:
-            json.dump(estoque_saidas, f, ensure_ascii=False, indent=4)
+        banco.anexar_historico('estoque_saidas', saida)
 
         if produto_selecionado['quantidade'] == 0:
-            banco.estoque.remove(produto_selecionado)
-            print(f"Produto removido do estoque.")
-
-        banco.salvar_dados()
+            banco.remover('estoque', produto_selecionado)
+            print("Produto removido do estoque.")
 
         # Mensagem final uniforme com exibição de valor total
         if produto_selecionado.get('tipo_produto') == 'mangueira':
@@ -713,9 +626,9 @@ def registrar_saida():
             print(f"Valor total: R$ {valor_frete_total:.2f}")
 
     except Exception as e:
+        # O erro sobe para salvar_dados_seguro desfazer as alterações
         logging.error(f"Erro ao registrar saída: {str(e)}")
-        print(f"Erro ao registrar saída: {str(e)}")
-        return None
+        raise
 
 
 # Função para registrar o descarte de um produto
@@ -741,11 +654,9 @@ def registrar_descarte():
 
     # Filtra os produtos
     if opcao_busca == "1":
-        resultados = [p for p in banco.estoque if termo_busca.lower()
-                      in p['nome'].lower()]
+        resultados = indice_busca.buscar('nome', termo_busca)
     elif opcao_busca == "2":
-        resultados = [p for p in banco.estoque if termo_busca.lower()
-                      in p['modelo'].lower()]
+        resultados = indice_busca.buscar('modelo', termo_busca)
     else:
         print("Opção inválida! Tente novamente.")
         return
@@ -782,14 +693,16 @@ def registrar_descarte():
         return
 
     # Atualiza o estoque
-    produto_selecionado['quantidade'] -= quantidade
+    banco.atualizar('estoque', produto_selecionado, {
+        'quantidade': produto_selecionado['quantidade'] - quantidade})
 
     if produto_selecionado['quantidade'] == 0:
-        banco.estoque.remove(produto_selecionado)
+        banco.remover('estoque', produto_selecionado)
         print(f"Produto removido do estoque.")
 
     # Registra o descarte
     descarte = {
+        'produto_id': produto_selecionado['id'],
         'data': datetime.now().strftime("%d/%m/%Y %H:%M:%S"),
         'nome': produto_selecionado['nome'],
         'modelo': produto_selecionado['modelo'],
@@ -810,8 +723,7 @@ def registrar_descarte():
         descarte['nome_badeco'] = produto_selecionado.get('nome_badeco')
         descarte['prefixo_aviao'] = produto_selecionado.get('prefixo_aviao')
 
-    banco.descarte.append(descarte)
-    banco.salvar_dados()
+    banco.inserir('descarte', descarte)
 
     print("Descarte registrado com sucesso!")
 
@@ -824,14 +736,14 @@ def mostrar_estoque():
     limpar_tela()
     print("\nEstoque atual:")
 
-    if not banco.estoque:
+    if not banco.produtos:
         print("O estoque está vazio.")
     else:
         # Agrupa produtos por classificação
-        aero = [p for p in banco.estoque if p['classificacao'] == "AERO"]
-        auto = [p for p in banco.estoque if p['classificacao'] == "AUTO"]
-        epi = [p for p in banco.estoque if p['classificacao'] == "EPI"]
-        cons = [p for p in banco.estoque if p['classificacao'] == "CONS"]
+        aero = [p for p in banco.produtos.values() if p['classificacao'] == "AERO"]
+        auto = [p for p in banco.produtos.values() if p['classificacao'] == "AUTO"]
+        epi = [p for p in banco.produtos.values() if p['classificacao'] == "EPI"]
+        cons = [p for p in banco.produtos.values() if p['classificacao'] == "CONS"]
 
         def mostrar_produto(produto):
             print("=" * 50)
@@ -901,7 +813,7 @@ def buscar_produto():
     if opcao == "4":
         classificacao = selecionar_classificacao()
         resultados = [
-            p for p in banco.estoque if p['classificacao'] == classificacao]
+            p for p in banco.produtos.values() if p['classificacao'] == classificacao]
     else:
         termo_busca = input("Digite o termo de busca: ").strip()
         if termo_busca.lower() == "cancelar":
@@ -909,19 +821,13 @@ def buscar_produto():
 
         if opcao == "1":
             resultados = [
-                p for p in banco.estoque
-                if p.get('partNumber') and termo_busca.lower() in p['partNumber'].lower()
+                p for p in indice_busca.buscar('partNumber', termo_busca)
+                if p.get('partNumber')
             ]
         elif opcao == "2":
-            resultados = [
-                p for p in banco.estoque
-                if termo_busca.lower() in p['nome'].lower()
-            ]
+            resultados = indice_busca.buscar('nome', termo_busca)
         elif opcao == "3":
-            resultados = [
-                p for p in banco.estoque
-                if termo_busca.lower() in p['modelo'].lower()
-            ]
+            resultados = indice_busca.buscar('modelo', termo_busca)
         else:
             print("Opção inválida.")
             return
@@ -968,14 +874,11 @@ def editar_produto():
 
     resultados = []
     if opcao == "1":
-        resultados = [p for p in banco.estoque if termo_busca.lower()
-                      in p['nome'].lower()]
+        resultados = indice_busca.buscar('nome', termo_busca)
     elif opcao == "2":
-        resultados = [p for p in banco.estoque if termo_busca.lower()
-                      in p['modelo'].lower()]
+        resultados = indice_busca.buscar('modelo', termo_busca)
     elif opcao == "3":
-        resultados = [p for p in banco.estoque if termo_busca.lower() in str(
-            p.get('partNumber', '')).lower()]
+        resultados = indice_busca.buscar('partNumber', termo_busca)
     else:
         print("Opção inválida.")
         return
@@ -997,7 +900,6 @@ def editar_produto():
                 return
 
             produto_selecionado = resultados[escolha - 1]
-            index_original = banco.estoque.index(produto_selecionado)
 
             print("\nDados atuais do produto:")
             for key, value in produto_selecionado.items():
@@ -1094,9 +996,7 @@ def editar_produto():
                 print("Alteração cancelada.")
                 return
 
-            produto_selecionado[campo] = novo_valor
-            banco.estoque[index_original] = produto_selecionado
-            banco.salvar_dados()
+            banco.atualizar('estoque', produto_selecionado, {campo: novo_valor})
             print("Produto atualizado com sucesso!")
 
         except (ValueError, IndexError):
@@ -1125,11 +1025,9 @@ def excluir_produto():
 
     resultados = []
     if opcao == "1":
-        resultados = [p for p in banco.estoque if termo_busca.lower()
-                      in p['nome'].lower()]
+        resultados = indice_busca.buscar('nome', termo_busca)
     elif opcao == "2":
-        resultados = [p for p in banco.estoque if termo_busca.lower()
-                      in p['modelo'].lower()]
+        resultados = indice_busca.buscar('modelo', termo_busca)
     else:
         print("Opção inválida.")
         return
@@ -1160,11 +1058,11 @@ def excluir_produto():
                 return
 
             # Remove o produto do estoque
-            banco.estoque.remove(produto_selecionado)
-            banco.salvar_dados()
+            banco.remover('estoque', produto_selecionado)
 
             # Registro da exclusão
             log_exclusao = {
+                'produto_id': produto_selecionado['id'],
                 'data_hora': datetime.now().strftime("%d/%m/%Y %H:%M:%S"),
                 'classificacao': produto_selecionado['classificacao'],
                 'nome': produto_selecionado['nome'],
@@ -1193,21 +1091,7 @@ def excluir_produto():
                 })
 
             # Salva o log de exclusão
-            arquivo_log = 'backup/estoque_exclusoes.json'
-            if not os.path.exists('backup'):
-                os.makedirs('backup')
-
-            # Carrega ou cria o arquivo de log
-            if os.path.exists(arquivo_log):
-                with open(arquivo_log, 'r') as file:
-                    logs_exclusao = json.load(file)
-            else:
-                logs_exclusao = []
-
-            # Adiciona o novo log e salva
-            logs_exclusao.append(log_exclusao)
-            with open(arquivo_log, 'w') as file:
-                json.dump(logs_exclusao, file, indent=4)
+            banco.anexar_historico('estoque_exclusoes', log_exclusao)
 
             print("\nProduto excluído com sucesso!")
             print("Log de exclusão registrado.")
@@ -1229,37 +1113,6 @@ if sys.platform.startswith('win'):
     sys.stdout.reconfigure(encoding='utf-8')
 
 
-def criar_pasta_backup():
-    """
-    Cria a pasta de backup se não existir, funcionando tanto em desenvolvimento quanto em exe
-    """
-    try:
-        # Determina o caminho base do aplicativo
-        if getattr(sys, 'frozen', False):
-            base_path = os.path.dirname(sys.executable)
-        else:
-            base_path = os.path.dirname(os.path.abspath(__file__))
-
-        # Cria o caminho absoluto para a pasta de backup
-        caminho_backup = os.path.join(base_path, 'backup')
-
-        # Cria a pasta se não existir
-        Path(caminho_backup).mkdir(parents=True, exist_ok=True)
-
-        # Cria o arquivo JSON se não existir
-        arquivo_saidas = os.path.join(caminho_backup, 'estoque_saidas.json')
-        if not os.path.exists(arquivo_saidas):
-            with open(arquivo_saidas, 'w', encoding='utf-8') as f:
-                json.dump([], f, ensure_ascii=False, indent=4)
-
-        return caminho_backup
-
-    except Exception as e:
-        logging.error(f"Erro ao criar pasta de backup: {str(e)}")
-        print(f"Erro ao criar pasta de backup: {str(e)}")
-        return None
-
-
 def criar_pasta_relatorios():
     """
     Cria a pasta de relatórios se não existir, funcionando tanto em desenvolvimento quanto em exe
@@ -1301,600 +1154,28 @@ def configurar_log():
 
 def gerar_relatorio_saidas(data_inicial: str, data_final: str) -> str:
     """
-    Gera relatório de saídas do estoque com tratamento de erros e validações
+    Gera relatório de saídas do estoque. O pandas e o restante da parte de
+    relatórios só são importados aqui, na primeira vez que um relatório é gerado.
+    Se o relatório do período já existe e nenhuma saída do período entrou
+    depois dele, o arquivo é reaproveitado.
     """
-    try:
-        caminho_relatorios = criar_pasta_relatorios()
-        if not caminho_relatorios:
-            print("Erro: Não foi possível criar a pasta de relatórios")
-            return None
-
-        configurar_log()
-        logging.info(f"Iniciando relatório: {data_inicial} a {data_final}")
-
-        if getattr(sys, 'frozen', False):
-            base_path = os.path.dirname(os.path.dirname(sys.executable))
-        else:
-            base_path = os.path.dirname(os.path.dirname(
-                os.path.dirname(os.path.abspath(__file__))))
-
-        backup_path = criar_pasta_backup()
-        if not backup_path:
-            logging.error("Erro ao criar pasta de backup")
-            print("Erro: Não foi possível criar a pasta de backup")
-            return None
-
-        arquivo_saidas = os.path.join(
-            base_path, 'backup', 'estoque_saidas.json')
-
-        if not os.path.exists(arquivo_saidas):
-            logging.error(f"Arquivo não encontrado: {arquivo_saidas}")
-            print(f"Erro: Arquivo de saídas não encontrado em {
-                  arquivo_saidas}")
-            return None
-
-        try:
-            with open(arquivo_saidas, 'r', encoding='utf-8') as f:
-                conteudo = f.read()
-                if not conteudo.strip():
-                    logging.error("Arquivo de saídas está vazio")
-                    print("Erro: Arquivo de saídas está vazio")
-                    return None
-
-                saidas = json.loads(conteudo)
-
-                if not isinstance(saidas, list):
-                    logging.error(
-                        "Formato de dados inválido - esperado uma lista de saídas")
-                    print("Erro: Formato de dados inválido no arquivo de saídas")
-                    return None
-
-                if not saidas:
-                    logging.warning("Nenhum dado encontrado no arquivo")
-                    print("Nenhum dado encontrado no arquivo de saídas")
-                    return None
-
-        except json.JSONDecodeError as e:
-            logging.error(f"Erro ao decodificar JSON: {str(e)}")
-            print(f"Erro: Arquivo de saídas contém JSON inválido - {str(e)}")
-            return None
-        except Exception as e:
-            logging.error(f"Erro ao ler arquivo de saídas: {str(e)}")
-            print(f"Erro ao ler arquivo de saídas: {str(e)}")
-            return None
-
-        # Tratamento para registros antigos sem campo de frete
-        for saida in saidas:
-            if 'frete' not in saida:
-                saida['frete'] = 0
-
-        df = pd.DataFrame(saidas)
-
-        colunas_necessarias = {
-            'nome': 'Nome',
-            'modelo': 'Modelo',
-            'partNumber': 'Part Number',
-            'serialNumber': 'Serial Number',
-            'prefixo_aviao': 'Prefixo',
-            'nome_badeco': 'Ajudante EPI',
-            'data': 'Data',
-            'quantidade': 'Quantidade',
-            'valor': 'Valor Unit.',
-            'frete_original': 'Valor Frete',
-            'valor_frete_total': 'VF_Total',
-            'frete_proporcional': 'Frete_propo',
-            'classificacao': 'Classificação',
-            'placa_camionete': 'Placa',
-            'condicao': 'Condição',
-            'origem': 'Origem',
-            'observacoes': 'Observações'
-        }
-
-        for col_original, col_novo in colunas_necessarias.items():
-            if col_original not in df.columns:
-                df[col_original] = '-'
-            # Adicionado 'frete' aos numéricos
-            if col_original not in ['quantidade', 'valor', 'data', 'frete']:
-                df[col_original] = df[col_original].fillna('-').astype(str)
-
-        df = df.rename(columns=colunas_necessarias)
-
-        df['Quantidade'] = pd.to_numeric(
-            df['Quantidade'], errors='coerce').fillna(0).astype(float)
-        df['Valor Unit.'] = pd.to_numeric(
-            df['Valor Unit.'], errors='coerce').fillna(0).astype(float)
-        df['Frete_propo'] = pd.to_numeric(
-            df['Frete_propo'], errors='coerce').fillna(0).astype(float)
-
-        try:
-            data_inicial_dt = datetime.strptime(data_inicial, "%d/%m/%Y")
-            data_final_dt = datetime.strptime(data_final, "%d/%m/%Y")
-
-            # Converter a coluna 'Data' para datetime
-            df['Data'] = pd.to_datetime(df['Data'], format="%d/%m/%Y")
-
-        except ValueError as e:
-            logging.error(f"Erro no processamento de datas: {str(e)}")
-            print("Erro: Formato de data inválido!")
-            return None
-
-        mask = (df['Data'].dt.date >= data_inicial_dt.date()) & (
-            df['Data'].dt.date <= data_final_dt.date())
-        df_periodo = df.loc[mask].copy()
-
-        if df_periodo.empty:
-            logging.warning("Nenhum dado encontrado no período especificado")
-            print("Nenhum dado encontrado para o período especificado")
-            return None
-
-        # Cálculo do Valor Total - CORRIGIDO
-        df_periodo['Valor Total'] = df_periodo['Quantidade'] * (
-            df_periodo['Valor Unit.'] + df_periodo['Frete_propo'])
-        df_periodo['Valor Total'] = df_periodo['Valor Total'].fillna(
-            0).astype(float)
-
-        df_periodo = df_periodo.sort_values('Data')
-
-        nome_arquivo = f'Relatorio_{data_inicial.replace(
-            "/", "")}_{data_final.replace("/", "")}.xlsx'
-        caminho_completo = os.path.join(caminho_relatorios, nome_arquivo)
-
-        try:
-            writer = pd.ExcelWriter(caminho_completo, engine='xlsxwriter')
-            workbook = writer.book
-            workbook.nan_inf_to_errors = True
-
-            # Definição das cores
-            cores = {
-                'header': '#1B5E20',  # Verde escuro
-                'subheader': '#2E7D32',  # Verde médio escuro
-                'linha_clara': '#E8F5E9',  # Verde muito claro
-                'linha_escura': '#C8E6C9',  # Verde claro
-                'total': '#81C784',  # Verde médio
-                'total_geral': '#4CAF50'  # Verde vibrante
-            }
-
-            formatos = {
-                'header': workbook.add_format({
-                    'bold': True,
-                    'align': 'center',
-                    'bg_color': cores['header'],
-                    'font_color': 'white',
-                    'border': 1,
-                    'text_wrap': True,
-                    'valign': 'vcenter'
-                }),
-                'subheader': workbook.add_format({
-                    'bold': True,
-                    'align': 'left',
-                    'bg_color': cores['subheader'],
-                    'font_color': 'white',
-                    'border': 1
-                }),
-                'data': workbook.add_format({
-                    'border': 1,
-                    'border_color': '#81C784',
-                    'align': 'left',
-                    'valign': 'vcenter'
-                }),
-                'data_clara': workbook.add_format({
-                    'border': 1,
-                    'border_color': '#81C784',
-                    'align': 'left',
-                    'valign': 'vcenter',
-                    'bg_color': cores['linha_clara']
-                }),
-                'data_escura': workbook.add_format({
-                    'border': 1,
-                    'border_color': '#81C784',
-                    'align': 'left',
-                    'valign': 'vcenter',
-                    'bg_color': cores['linha_escura']
-                }),
-                'date': workbook.add_format({
-                    'border': 1,
-                    'border_color': '#81C784',
-                    'align': 'center',
-                    'num_format': 'dd/mm/yyyy'
-                }),
-                'number_clara': workbook.add_format({
-                    'border': 1,
-                    'border_color': '#81C784',
-                    'align': 'right',
-                    'bg_color': cores['linha_clara']
-                }),
-                'number_escura': workbook.add_format({
-                    'border': 1,
-                    'border_color': '#81C784',
-                    'align': 'right',
-                    'bg_color': cores['linha_escura']
-                }),
-                'money_clara': workbook.add_format({
-                    'num_format': 'R$ #,##0.00',
-                    'border': 1,
-                    'border_color': '#81C784',
-                    'align': 'right',
-                    'bg_color': cores['linha_clara']
-                }),
-                'money_escura': workbook.add_format({
-                    'num_format': 'R$ #,##0.00',
-                    'border': 1,
-                    'border_color': '#81C784',
-                    'align': 'right',
-                    'bg_color': cores['linha_escura']
-                }),
-                'total': workbook.add_format({
-                    'bold': True,
-                    'num_format': 'R$ #,##0.00',
-                    'bg_color': cores['total'],
-                    'border': 1,
-                    'border_color': '#4CAF50',
-                    'align': 'right'
-                }),
-                'total_geral': workbook.add_format({
-                    'bold': True,
-                    'num_format': 'R$ #,##0.00',
-                    'bg_color': cores['total_geral'],
-                    'font_color': 'white',
-                    'border': 2,
-                    'border_color': '#1B5E20',
-                    'align': 'right'
-                })
-            }
-
-            # Aba Resumo Geral - apenas com valor total incluindo frete
-            sheet_resumo = workbook.add_worksheet('Resumo Geral')
-
-            larguras_colunas = {
-                'A:A': 15,  # Data
-                'B:B': 15,  # Classificação
-                'C:C': 20,  # Nome
-                'D:D': 20,  # Modelo
-                'E:E': 20,  # Part Number
-                'F:F': 20,  # Serial Number
-                'G:G': 15,  # Prefixo
-                'H:H': 15,  # Condição
-                'I:I': 20,  # Origem
-                'J:J': 10,  # Quantidade
-                'K:K': 15,  # Valor Total (com frete)
-            }
-
-            for col, width in larguras_colunas.items():
-                sheet_resumo.set_column(col, width)
-
-            sheet_resumo.merge_range(
-                'A1:K1',
-                f'RESUMO DE SAÍDAS - {data_inicial} a {data_final}',
-                formatos['header']
-            )
-
-            headers = ['Data', 'Classificação', 'Nome', 'Modelo', 'Part Number', 'Serial Number',
-                       'Prefixo', 'Condição', 'Origem', 'Quantidade', 'Valor Total']
-            for idx, header in enumerate(headers):
-                sheet_resumo.write(2, idx, header, formatos['header'])
-
-            row = 3
-            for _, item in df_periodo.iterrows():
-                linha_alternada = row % 2 == 0
-                formato = formatos['data_clara'] if linha_alternada else formatos['data_escura']
-                formato_number = formatos['number_clara'] if linha_alternada else formatos['number_escura']
-                formato_money = formatos['money_clara'] if linha_alternada else formatos['money_escura']
-
-                sheet_resumo.write(row, 0, item['Data'], formatos['date'])
-                sheet_resumo.write(row, 1, str(item['Classificação']), formato)
-                sheet_resumo.write(row, 2, str(item['Nome']), formato)
-                sheet_resumo.write(row, 3, str(item['Modelo']), formato)
-                sheet_resumo.write(row, 4, str(item['Part Number']), formato)
-                sheet_resumo.write(row, 5, str(item['Serial Number']), formato)
-                sheet_resumo.write(row, 6, str(item['Prefixo']), formato)
-                sheet_resumo.write(row, 7, str(item['Condição']), formato)
-                sheet_resumo.write(row, 8, str(item['Origem']), formato)
-                sheet_resumo.write(row, 9, float(
-                    item['Quantidade']), formato_number)
-                sheet_resumo.write(row, 10, float(
-                    item['Valor Total']), formato_money)
-                row += 1
-
-            # Total para o resumo geral
-            sheet_resumo.merge_range(
-                f'A{row + 1}:J{row + 1}', 'TOTAL', formatos['header'])
-            sheet_resumo.write(row, 10, float(
-                df_periodo['Valor Total'].sum()), formatos['total'])
-
-            # Criar páginas para cada prefixo de avião
-            for prefixo in sorted(df_periodo['Prefixo'].unique()):
-                if pd.notna(prefixo) and prefixo != '-':
-                    df_prefixo = df_periodo[df_periodo['Prefixo'] == prefixo].copy(
-                    )
-
-                    sheet_name = re.sub(
-                        r'[\\/*?:\[\]]', '-', str(prefixo))[:31]
-                    sheet = workbook.add_worksheet(sheet_name)
-
-                    larguras_prefixo = {
-                        'A:A': 15,  # Data
-                        'B:B': 20,  # Nome
-                        'C:C': 20,  # Modelo
-                        'D:D': 20,  # Part Number
-                        'E:E': 20,  # Serial Number
-                        'F:F': 15,  # Classificação
-                        'G:G': 15,  # Condição
-                        'H:H': 20,  # Origem
-                        'I:I': 20,  # Ajudante EPI
-                        'J:J': 15,  # Placa
-                        'K:K': 20,  # Observações
-                        'L:L': 10,  # Quantidade
-                        'M:M': 15,  # Valor Unit.
-                        'N:N': 15,  # Frete Prop.
-                        'O:O': 15,  # Valor Total
-                    }
-
-                    for col, width in larguras_prefixo.items():
-                        sheet.set_column(col, width)
-
-                    sheet.merge_range(
-                        'A1:O1',
-                        f'SAÍDAS {prefixo} - {data_inicial} a {data_final}',
-                        formatos['header']
-                    )
-
-                    colunas_ordenadas = [
-                        'Data', 'Nome', 'Modelo', 'Part Number', 'Serial Number',
-                        'Classificação', 'Condição', 'Origem', 'Ajudante EPI', 'Placa',
-                        'Observações',
-                        'Quantidade', 'Valor Unit.', 'Frete_propo', 'Valor Total'
-                    ]
-
-                    for idx, col in enumerate(colunas_ordenadas):
-                        sheet.write(2, idx, col, formatos['header'])
-
-                    linha_alternada = True
-                    row = 3
-                    for _, item in df_prefixo.iterrows():
-                        formato = formatos['data_clara'] if linha_alternada else formatos['data_escura']
-                        formato_number = formatos['number_clara'] if linha_alternada else formatos['number_escura']
-                        formato_money = formatos['money_clara'] if linha_alternada else formatos['money_escura']
-
-                        sheet.write(row, 0, item['Data'], formatos['date'])
-                        sheet.write(row, 1, str(item['Nome']), formato)
-                        sheet.write(row, 2, str(item['Modelo']), formato)
-                        sheet.write(row, 3, str(item['Part Number']), formato)
-                        sheet.write(row, 4, str(
-                            item['Serial Number']), formato)
-                        sheet.write(row, 5, str(
-                            item['Classificação']), formato)
-                        sheet.write(row, 6, str(item['Condição']), formato)
-                        sheet.write(row, 7, str(item['Origem']), formato)
-                        sheet.write(row, 8, str(item['Ajudante EPI']), formato)
-                        sheet.write(row, 9, str(item['Placa']), formato)
-                        sheet.write(row, 10, str(item['Observações']), formato)
-                        sheet.write(row, 11, float(
-                            item['Quantidade']), formato_number)
-                        sheet.write(row, 12, float(
-                            item['Valor Unit.']), formato_money)
-                        sheet.write(row, 13, float(
-                            item['Frete_propo']), formato_money)
-                        sheet.write(row, 14, float(
-                            item['Valor Total']), formato_money)
-
-                        row += 1
-                        linha_alternada = not linha_alternada
-
-                    ultima_linha = len(df_prefixo) + 3
-                    sheet.merge_range(
-                        f'A{ultima_linha + 1}:N{ultima_linha + 1}', 'TOTAL', formatos['header'])
-                    sheet.write(ultima_linha, 14, float(
-                        df_prefixo['Valor Total'].sum()), formatos['total'])
-
-            # Aba de Consumo
-            df_consumo = df_periodo[df_periodo['Classificação']
-                                    == 'CONS'].copy()
-            if not df_consumo.empty:
-                sheet_consumo = workbook.add_worksheet('Consumo')
-
-                larguras_consumo = {
-                    'A:A': 15,  # Data
-                    'B:B': 20,  # Nome
-                    'C:C': 20,  # Modelo
-                    'D:D': 15,  # Classificação
-                    'E:E': 15,  # Condição
-                    'F:F': 20,  # Origem
-                    'G:G': 10,  # Quantidade
-                    'H:H': 15,  # Valor Unit.
-                    'I:I': 15,  # Frete Prop.
-                    'J:J': 15,  # Valor Total
-                }
-
-                for col, width in larguras_consumo.items():
-                    sheet_consumo.set_column(col, width)
-
-                sheet_consumo.merge_range(
-                    'A1:J1',
-                    f'ITENS DE CONSUMO - {data_inicial} a {data_final}',
-                    formatos['header']
-                )
-
-                colunas_consumo = [
-                    'Data', 'Nome', 'Modelo', 'Classificação',
-                    'Condição', 'Origem', 'Quantidade', 'Valor Unit.',
-                    'Frete_propo', 'Valor Total'
-                ]
-
-                for idx, col in enumerate(colunas_consumo):
-                    sheet_consumo.write(2, idx, col, formatos['header'])
-
-                linha_alternada = True
-                row = 3
-                for _, item in df_consumo.iterrows():
-                    formato = formatos['data_clara'] if linha_alternada else formatos['data_escura']
-                    formato_number = formatos['number_clara'] if linha_alternada else formatos['number_escura']
-                    formato_money = formatos['money_clara'] if linha_alternada else formatos['money_escura']
-
-                    sheet_consumo.write(row, 0, item['Data'], formatos['date'])
-                    sheet_consumo.write(row, 1, str(item['Nome']), formato)
-                    sheet_consumo.write(row, 2, str(item['Modelo']), formato)
-                    sheet_consumo.write(row, 3, str(
-                        item['Classificação']), formato)
-                    sheet_consumo.write(row, 4, str(item['Condição']), formato)
-                    sheet_consumo.write(row, 5, str(item['Origem']), formato)
-                    sheet_consumo.write(row, 6, float(
-                        item['Quantidade']), formato_number)
-                    sheet_consumo.write(row, 7, float(
-                        item['Valor Unit.']), formato_money)
-                    sheet_consumo.write(row, 8, float(
-                        item['Frete_propo']), formato_money)
-                    sheet_consumo.write(row, 9, float(
-                        item['Valor Total']), formato_money)
-
-                    row += 1
-                    linha_alternada = not linha_alternada
-
-                ultima_linha = len(df_consumo) + 3
-                sheet_consumo.merge_range(
-                    f'A{ultima_linha + 1}:I{ultima_linha + 1}', 'TOTAL', formatos['header'])
-                sheet_consumo.write(ultima_linha, 9, float(
-                    df_consumo['Valor Total'].sum()), formatos['total'])
-
-            # Criar aba única de saidas com todas as classificações
-            sheet_compras = workbook.add_worksheet('Saídas')
-
-            larguras_compras = {
-                'A:A': 25,  # Nome
-                'B:B': 20,  # Modelo
-                'C:C': 20,  # Part Number
-                'D:D': 15,  # Classificação
-                'E:E': 15,  # Quantidade Total
-                'F:F': 15,  # Valor Unit.
-                'G:G': 15,  # Frete Proporcional
-                'H:H': 20,  # Valor Total
-                'I:I': 25,  # Origem
-            }
-
-            for col, width in larguras_compras.items():
-                sheet_compras.set_column(col, width)
-
-            sheet_compras.merge_range(
-                'A1:I1',
-                f'SAÍDAS POR CLASSIFICAÇÃO DO PERÍODO - {data_inicial} a {data_final}',
-                formatos['header']
-            )
-
-            headers_compras = ['Nome', 'Modelo', 'Part Number', 'Classificação',
-                            'Quantidade Total', 'Valor Unit.', 'Frete Prop.', 'Valor Total',
-                            'Origem']
-
-            for idx, header in enumerate(headers_compras):
-                sheet_compras.write(2, idx, header, formatos['header'])
-
-            row = 3
-            valor_total_geral = 0
-            totais_por_classificacao = {}
-
-            classificacoes_ordem = ['AERO', 'AUTO', 'EPI', 'CONS']
-            classificacoes_existentes = [
-                c for c in classificacoes_ordem if c in df_periodo['Classificação'].unique()]
-
-            row += 1
-
-            for classificacao in classificacoes_existentes:
-                df_class = df_periodo[df_periodo['Classificação'] == classificacao].copy()
-
-                sheet_compras.merge_range(
-                    f'A{row}:I{row}', 
-                    f'Classificação: {classificacao}', 
-                    formatos['subheader']
-                )
-                row += 1
-
-                # Incluindo Frete_propo no agrupamento
-                df_itens = df_class.groupby(['Nome', 'Modelo', 'Part Number', 'Valor Unit.', 'Origem', 'Frete_propo']).agg({
-                    'Quantidade': 'sum'
-                }).reset_index()
-
-                # Corrigindo o cálculo do valor total para incluir o frete proporcional
-                df_itens['Valor Total'] = df_itens['Quantidade'] * (df_itens['Valor Unit.'] + df_itens['Frete_propo'])
-                df_itens = df_itens.sort_values(['Origem', 'Nome'])
-
-                linha_alternada = True
-                for _, item in df_itens.iterrows():
-                    formato = formatos['data_clara'] if linha_alternada else formatos['data_escura']
-                    formato_number = formatos['number_clara'] if linha_alternada else formatos['number_escura']
-                    formato_money = formatos['money_clara'] if linha_alternada else formatos['money_escura']
-
-                    sheet_compras.write(row, 0, str(item['Nome']), formato)
-                    sheet_compras.write(row, 1, str(item['Modelo']), formato)
-                    sheet_compras.write(row, 2, str(item['Part Number']), formato)
-                    sheet_compras.write(row, 3, classificacao, formato)
-                    sheet_compras.write(row, 4, float(item['Quantidade']), formato_number)
-                    sheet_compras.write(row, 5, float(item['Valor Unit.']), formato_money)
-                    sheet_compras.write(row, 6, float(item['Frete_propo']), formato_money)  # Nova coluna
-                    sheet_compras.write(row, 7, float(item['Valor Total']), formato_money)
-                    sheet_compras.write(row, 8, str(item['Origem']), formato)
-
-                    row += 1
-                    linha_alternada = not linha_alternada
-
-                total_classificacao = df_itens['Valor Total'].sum()
-                totais_por_classificacao[classificacao] = total_classificacao
-                
-                # Mantendo o layout original do total por classificação, mas ajustando os índices
-                sheet_compras.merge_range(
-                    f'A{row + 1}:G{row + 1}', 
-                    f'Total {classificacao}', 
-                    formatos['total']
-                )
-                sheet_compras.write(row, 7, float(total_classificacao), formatos['total'])
-                sheet_compras.write(row, 8, '', formatos['total'])
-                row += 1
-
-                row += 1
-
-                valor_total_geral += total_classificacao
-
-            row += 1
-
-            # Mantendo o layout do total geral estimado conforme seu código original
-            sheet_compras.merge_range(
-                f'A{row}:F{row}', 
-                'TOTAL GERAL ESTIMADO:', 
-                formatos['total_geral']
-            )
-            sheet_compras.merge_range(
-                f'G{row}:H{row}', 
-                valor_total_geral, 
-                formatos['total_geral']
-            )
-            sheet_compras.write(row, 8, '', formatos['total_geral'])
-
-            row += 1
-
-            # Observação final com ajuste para o novo número de colunas
-            sheet_compras.merge_range(
-                f'A{row}:I{row}', 
-                '* Valores podem variar conforme fornecedor e data da compra', 
-                formatos['data_clara']
-            )
-            writer.close()
-            logging.info(f"Relatório gerado com sucesso: {caminho_completo}")
-            print(f"\nRelatório gerado com sucesso!")
-            print(f"Caminho: {caminho_completo}")
-            return caminho_completo
-
-        except Exception as e:
-            logging.error(f"Erro ao gerar Excel: {str(e)}")
-            print(f"Erro ao gerar arquivo Excel: {str(e)}")
-            return None
-
-    except Exception as e:
-        logging.error(f"Erro inesperado: {str(e)}")
-        print(f"Erro inesperado: {str(e)}")
-        return None
+    caminho_relatorios = criar_pasta_relatorios()
+    if caminho_relatorios:
+        caminho = cache_relatorios.procurar(caminho_relatorios, data_inicial, data_final)
+        if caminho:
+            print("\nNenhuma saída nova no período desde a última geração: relatório reaproveitado.")
+            print(f"Caminho: {caminho}")
+            return caminho
 
+    from estoque import relatorios
+    return relatorios.gerar_relatorio_saidas(data_inicial, data_final)
 
 
 def executar_relatorio():
     """
-    Função principal para execução do relatório
+    Função principal para execução do relatório. O relatório é gerado em
+    segundo plano (ver tarefas.py): o menu volta na hora, mostra o andamento
+    e avisa quando o arquivo estiver pronto.
     """
     while True:
         try:
@@ -1917,22 +1198,26 @@ def executar_relatorio():
                 continue
 
             # Verifica se a pasta de relatórios existe/pode ser criada
-            if not criar_pasta_relatorios():
+            caminho_relatorios = criar_pasta_relatorios()
+            if not caminho_relatorios:
                 print("Erro: Não foi possível criar/acessar a pasta de relatórios")
                 return
 
-            caminho = gerar_relatorio_saidas(data_inicial, data_final)
-
+            caminho = cache_relatorios.procurar(caminho_relatorios, data_inicial, data_final)
             if caminho:
-                print(f"\nRelatório gerado com sucesso!")
+                print("\nNenhuma saída nova no período desde a última geração: relatório reaproveitado.")
+                print(f"Caminho: {caminho}")
                 print("Deseja abrir a pasta de relatórios? (s/n): ")
                 if input().lower() == 's':
                     abrir_pasta_relatorios()
                 return
 
-            retry = input("\nDeseja tentar novamente? (s/n): ")
-            if retry.lower() != 's':
-                break
+            configurar_log()
+            logging.info(f"Iniciando relatório: {data_inicial} a {data_final}")
+            tarefas.iniciar_relatorio(caminho_relatorios, data_inicial, data_final)
+            print("\nO relatório está sendo gerado em segundo plano.")
+            print("O andamento aparece no menu e você será avisado quando o arquivo estiver pronto.")
+            return
 
         except Exception as e:
             print(f"\nErro inesperado: {str(e)}")
@@ -1997,14 +1282,6 @@ def buscar_saida_por_pn():
         if data_inicial.lower() == 'cancelar':
             return
 
-        try:
-            with open('backup/estoque_saidas.json', 'r') as f:
-                saidas = json.load(f)
-        except FileNotFoundError:
-            print("Arquivo de saídas não encontrado!")
-            input("\nPressione Enter para continuar...")
-            return
-
         try:
             data_inicial_dt = datetime.strptime(data_inicial, "%d/%m/%Y")
         except ValueError:
@@ -2018,11 +1295,8 @@ def buscar_saida_por_pn():
             if termo_busca.lower() == 'cancelar':
                 return
 
-            saidas_filtradas = [
-                saida for saida in saidas
-                if saida.get('partNumber') and saida['partNumber'].lower() == termo_busca.lower()
-                and datetime.strptime(saida['data'], "%d/%m/%Y %H:%M:%S") >= data_inicial_dt
-            ]
+            saidas_filtradas = indice_saidas.buscar(
+                'partNumber', termo_busca, data_inicial_dt)
             filtro_texto = f"PN {termo_busca}"
 
         elif opcao == '2':
@@ -2030,11 +1304,8 @@ def buscar_saida_por_pn():
             if termo_busca.lower() == 'cancelar':
                 return
 
-            saidas_filtradas = [
-                saida for saida in saidas
-                if saida.get('prefixo_aviao') and saida['prefixo_aviao'].lower() == termo_busca.lower()
-                and datetime.strptime(saida['data'], "%d/%m/%Y %H:%M:%S") >= data_inicial_dt
-            ]
+            saidas_filtradas = indice_saidas.buscar(
+                'prefixo_aviao', termo_busca, data_inicial_dt)
             filtro_texto = f"Prefixo {termo_busca}"
         else:
             print("Opção inválida!")
@@ -0,0 +1,603 @@
+# relatorios.py
+# Geração dos relatórios em Excel. Este módulo importa o pandas, por isso só é
+# importado quando um relatório é pedido (ver operacoes.gerar_relatorio_saidas).
+#
+# A aba Saídas e os totais de todas as abas vêm dos totais diários por item
+# (ver agregados.py). Só as abas de detalhe precisam das saídas uma a uma: a
+# primeira passada sobre o histórico anota a data e a posição de cada saída do
+# período, e a segunda relê as saídas em ordem de data, em blocos, e acrescenta
+# as linhas de cada bloco às abas. Em períodos grandes (modo contínuo) só um
+# bloco fica na memória por vez e o xlsxwriter grava cada linha no disco assim
+# que ela termina (constant_memory).
+#
+# gerar_arquivo trabalha sobre um instantâneo das saídas (agregados.instantaneo)
+# e pode rodar em segundo plano (ver tarefas.py): as saídas registradas depois
+# do instantâneo não entram no relatório.
+#
+# gerar_lote faz vários relatórios de uma vez (os meses do ano, extratos por
+# prefixo): lê e converte as saídas uma única vez e escreve os arquivos em
+# paralelo, em processos separados.
+
+import logging
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import xlsxwriter
+
+from estoque import agregados, banco, cache_relatorios, datas
+from estoque.operacoes import configurar_log, criar_pasta_relatorios
+
+# Acima dessa quantidade de saídas no período o relatório usa o modo contínuo
+LIMITE_EM_MEMORIA = 50000
+# Saídas lidas, convertidas e gravadas por vez (o progresso avança a cada bloco)
+TAMANHO_BLOCO = 10000
+# Bits da posição da saída na chave de ordenação (dia << _BITS_POSICAO | posição)
+_BITS_POSICAO = 40
+
+COLUNAS_NECESSARIAS = {
+    'nome': 'Nome',
+    'modelo': 'Modelo',
+    'partNumber': 'Part Number',
+    'serialNumber': 'Serial Number',
+    'prefixo_aviao': 'Prefixo',
+    'nome_badeco': 'Ajudante EPI',
+    'data': 'Data',
+    'quantidade': 'Quantidade',
+    'valor': 'Valor Unit.',
+    'frete_original': 'Valor Frete',
+    'valor_frete_total': 'VF_Total',
+    'frete_proporcional': 'Frete_propo',
+    'classificacao': 'Classificação',
+    'placa_camionete': 'Placa',
+    'condicao': 'Condição',
+    'origem': 'Origem',
+    'observacoes': 'Observações'
+}
+
+# Definição das cores
+CORES = {
+    'header': '#1B5E20',  # Verde escuro
+    'subheader': '#2E7D32',  # Verde médio escuro
+    'linha_clara': '#E8F5E9',  # Verde muito claro
+    'linha_escura': '#C8E6C9',  # Verde claro
+    'total': '#81C784',  # Verde médio
+    'total_geral': '#4CAF50'  # Verde vibrante
+}
+
+# Colunas de cada aba, (coluna do DataFrame, formato), e suas larguras
+COLUNAS_RESUMO = [
+    ('Data', 'date'), ('Classificação', 'data'), ('Nome', 'data'),
+    ('Modelo', 'data'), ('Part Number', 'data'), ('Serial Number', 'data'),
+    ('Prefixo', 'data'), ('Condição', 'data'), ('Origem', 'data'),
+    ('Quantidade', 'number'), ('Valor Total', 'money'),
+]
+LARGURAS_RESUMO = [15, 15, 20, 20, 20, 20, 15, 15, 20, 10, 15]
+
+COLUNAS_PREFIXO = [
+    ('Data', 'date'), ('Nome', 'data'), ('Modelo', 'data'),
+    ('Part Number', 'data'), ('Serial Number', 'data'),
+    ('Classificação', 'data'), ('Condição', 'data'), ('Origem', 'data'),
+    ('Ajudante EPI', 'data'), ('Placa', 'data'), ('Observações', 'data'),
+    ('Quantidade', 'number'), ('Valor Unit.', 'money'),
+    ('Frete_propo', 'money'), ('Valor Total', 'money'),
+]
+LARGURAS_PREFIXO = [15, 20, 20, 20, 20, 15, 15, 20, 20, 15, 20, 10, 15, 15, 15]
+
+COLUNAS_CONSUMO = [
+    ('Data', 'date'), ('Nome', 'data'), ('Modelo', 'data'),
+    ('Classificação', 'data'), ('Condição', 'data'), ('Origem', 'data'),
+    ('Quantidade', 'number'), ('Valor Unit.', 'money'),
+    ('Frete_propo', 'money'), ('Valor Total', 'money'),
+]
+LARGURAS_CONSUMO = [15, 20, 20, 15, 15, 20, 10, 15, 15, 15]
+
+COLUNAS_SAIDAS = [
+    ('Nome', 'data'), ('Modelo', 'data'), ('Part Number', 'data'),
+    ('Classificação', 'data'), ('Quantidade', 'number'),
+    ('Valor Unit.', 'money'), ('Frete_propo', 'money'),
+    ('Valor Total', 'money'), ('Origem', 'data'),
+]
+CABECALHOS_SAIDAS = ['Nome', 'Modelo', 'Part Number', 'Classificação',
+                     'Quantidade Total', 'Valor Unit.', 'Frete Prop.', 'Valor Total',
+                     'Origem']
+LARGURAS_SAIDAS = [25, 20, 20, 15, 15, 15, 15, 20, 25]
+
+# Colunas da chave dos agregados (agregados.CAMPOS_TEXTO + CAMPOS_NUMERO)
+COLUNAS_AGREGADOS = ['Classificação', 'Prefixo', 'Nome', 'Modelo', 'Part Number',
+                     'Origem', 'Valor Unit.', 'Frete_propo']
+# Itens iguais da aba Saídas são somados (incluindo o frete proporcional)
+CHAVES_ITENS = ['Classificação', 'Nome', 'Modelo', 'Part Number',
+                'Valor Unit.', 'Origem', 'Frete_propo']
+CLASSIFICACOES_ORDEM = ['AERO', 'AUTO', 'EPI', 'CONS']
+
+
+def _textos(serie):
+    return serie.astype(str).tolist()
+
+
+def _numeros(serie):
+    return serie.astype(float).tolist()
+
+
+def _datas(serie):
+    # Número de série de data do Excel (dias desde 30/12/1899), já calculado
+    # para a coluna toda; o formato 'date' mostra como dd/mm/aaaa
+    return _numeros((serie - pd.Timestamp(1899, 12, 30)).dt.days)
+
+
+_CONVERSOES = {'date': _datas, 'data': _textos, 'number': _numeros, 'money': _numeros}
+
+
+def _valores(df, colunas):
+    """Lista de (valores, formato) das colunas do DataFrame, para _escrever_tabela."""
+    return [(_CONVERSOES[formato](df[coluna]), formato) for coluna, formato in colunas]
+
+
+def _escrever_tabela(sheet, linha, colunas, formatos, por_linha=False):
+    """
+    Escreve a tabela a partir da linha: colunas é uma lista de (valores,
+    formato), com formato 'date', 'data', 'number' ou 'money'. Cada coluna é
+    escrita inteira de uma vez; no modo constant_memory o xlsxwriter exige a
+    escrita linha a linha (por_linha=True). Devolve a linha seguinte à última.
+    """
+    if not por_linha:
+        for coluna, (valores, formato) in enumerate(colunas):
+            sheet.write_column(linha, coluna, valores, formatos[formato])
+        return linha + len(colunas[0][0])
+
+    escritas = [(sheet.write if formato == 'data' else sheet.write_number, formatos[formato])
+                for _valores, formato in colunas]
+    for valores in zip(*(valores for valores, _formato in colunas)):
+        for coluna, valor in enumerate(valores):
+            escrever, formato = escritas[coluna]
+            escrever(linha, coluna, valor, formato)
+        linha += 1
+    return linha
+
+
+def _listrar(sheet, linha, total, colunas, formatos, clara_primeiro=True):
+    """Cores alternadas das linhas com formatação condicional (as datas ficam sem cor de fundo)."""
+    listradas = [coluna for coluna, (_coluna, formato) in enumerate(colunas)
+                 if formato != 'date']
+    if not total or not listradas:
+        return
+
+    primeira, segunda = ('fundo_claro', 'fundo_escuro') if clara_primeiro \
+        else ('fundo_escuro', 'fundo_claro')
+    intervalo = (linha, listradas[0], linha + total - 1, listradas[-1])
+    for resto, fundo in ((0, primeira), (1, segunda)):
+        sheet.conditional_format(*intervalo, {
+            'type': 'formula',
+            'criteria': f'=MOD(ROW()-{linha + 1},2)={resto}',
+            'format': formatos[fundo]
+        })
+
+
+def _criar_formatos(workbook):
+    borda = {'border': 1, 'border_color': '#81C784'}
+    return {
+        'header': workbook.add_format({
+            'bold': True,
+            'align': 'center',
+            'bg_color': CORES['header'],
+            'font_color': 'white',
+            'border': 1,
+            'text_wrap': True,
+            'valign': 'vcenter'
+        }),
+        'subheader': workbook.add_format({
+            'bold': True,
+            'align': 'left',
+            'bg_color': CORES['subheader'],
+            'font_color': 'white',
+            'border': 1
+        }),
+        'data': workbook.add_format({**borda, 'align': 'left', 'valign': 'vcenter'}),
+        'number': workbook.add_format({**borda, 'align': 'right'}),
+        'money': workbook.add_format({**borda, 'num_format': 'R$ #,##0.00', 'align': 'right'}),
+        # Fundos das linhas alternadas (formatação condicional)
+        'fundo_claro': workbook.add_format({'bg_color': CORES['linha_clara']}),
+        'fundo_escuro': workbook.add_format({'bg_color': CORES['linha_escura']}),
+        'data_clara': workbook.add_format({
+            **borda, 'align': 'left', 'valign': 'vcenter', 'bg_color': CORES['linha_clara']}),
+        'date': workbook.add_format({**borda, 'align': 'center', 'num_format': 'dd/mm/yyyy'}),
+        'total': workbook.add_format({
+            'bold': True,
+            'num_format': 'R$ #,##0.00',
+            'bg_color': CORES['total'],
+            'border': 1,
+            'border_color': '#4CAF50',
+            'align': 'right'
+        }),
+        'total_geral': workbook.add_format({
+            'bold': True,
+            'num_format': 'R$ #,##0.00',
+            'bg_color': CORES['total_geral'],
+            'font_color': 'white',
+            'border': 2,
+            'border_color': '#1B5E20',
+            'align': 'right'
+        })
+    }
+
+
+def _nova_aba(workbook, nome, titulo, cabecalhos, larguras, formatos):
+    """Cria a aba com as larguras, o título (linha 1) e os cabeçalhos (linha 3)."""
+    sheet = workbook.add_worksheet(nome)
+    for coluna, largura in enumerate(larguras):
+        sheet.set_column(coluna, coluna, largura)
+    sheet.merge_range(0, 0, 0, len(cabecalhos) - 1, titulo, formatos['header'])
+    for coluna, cabecalho in enumerate(cabecalhos):
+        sheet.write(2, coluna, cabecalho, formatos['header'])
+    return sheet
+
+
+def _escrever_total(sheet, linha, colunas, total, formatos):
+    ultima = len(colunas) - 1
+    sheet.merge_range(linha, 0, linha, ultima - 1, 'TOTAL', formatos['header'])
+    sheet.write(linha, ultima, float(total), formatos['total'])
+
+
+def _nome_aba(prefixo):
+    return re.sub(r'[\\/*?:\[\]]', '-', str(prefixo))[:31]
+
+
+def _preparar(saidas):
+    """DataFrame de um bloco de saídas, com as colunas usadas no relatório."""
+    # Tratamento para registros antigos sem campo de frete
+    for saida in saidas:
+        if 'frete' not in saida:
+            saida['frete'] = 0
+
+    df = pd.DataFrame(saidas)
+
+    for col_original in COLUNAS_NECESSARIAS:
+        if col_original not in df.columns:
+            df[col_original] = '-'
+        # Adicionado 'frete' aos numéricos
+        if col_original not in ['quantidade', 'valor', 'data', 'frete']:
+            df[col_original] = df[col_original].fillna('-').astype(str)
+
+    df = df.rename(columns=COLUNAS_NECESSARIAS)
+
+    df['Quantidade'] = pd.to_numeric(
+        df['Quantidade'], errors='coerce').fillna(0).astype(float)
+    df['Valor Unit.'] = pd.to_numeric(
+        df['Valor Unit.'], errors='coerce').fillna(0).astype(float)
+    df['Frete_propo'] = pd.to_numeric(
+        df['Frete_propo'], errors='coerce').fillna(0).astype(float)
+
+    # Converter a coluna 'Data' para datetime a partir do data_ts (AAAAMMDDhhmmss)
+    dia = df['data_ts'] // 1000000
+    df['Data'] = pd.to_datetime(pd.DataFrame({
+        'year': dia // 10000, 'month': dia // 100 % 100, 'day': dia % 100}))
+
+    # Cálculo do Valor Total - CORRIGIDO
+    df['Valor Total'] = df['Quantidade'] * (df['Valor Unit.'] + df['Frete_propo'])
+    df['Valor Total'] = df['Valor Total'].fillna(0).astype(float)
+    return df
+
+
+def _itens(totais):
+    """Quantidade e valor total de cada item (por classificação e prefixo) dos totais do período."""
+    itens = pd.DataFrame(list(totais), columns=COLUNAS_AGREGADOS)
+    itens['Quantidade'] = list(totais.values())
+    itens['Valor Total'] = itens['Quantidade'] * (itens['Valor Unit.'] + itens['Frete_propo'])
+    return itens
+
+
+def _saidas_do_periodo(inicio, fim, ate):
+    """
+    Primeira passada: chaves (dia, posição) das saídas do período anteriores
+    à posição `ate`, em ordem de data, para as abas de detalhe.
+    """
+    chaves = [saida[datas.CAMPO] // 1000000 << _BITS_POSICAO | posicao
+              for posicao, saida in banco.historico_no_periodo('estoque_saidas', inicio, fim,
+                                                               com_posicao=True, ate=ate)]
+    chaves.sort()
+    return chaves
+
+
+def _itens_de(df):
+    """Os mesmos itens de _itens, calculados a partir das próprias saídas."""
+    itens = df.groupby(COLUNAS_AGREGADOS)['Quantidade'].sum().reset_index()
+    itens['Valor Total'] = itens['Quantidade'] * (itens['Valor Unit.'] + itens['Frete_propo'])
+    return itens
+
+
+def _blocos(chaves, tamanho):
+    """Segunda passada: relê as saídas em ordem de data, um bloco por vez."""
+    mascara = (1 << _BITS_POSICAO) - 1
+    for i in range(0, len(chaves), tamanho):
+        posicoes = [chave & mascara for chave in chaves[i:i + tamanho]]
+        yield _preparar(banco.ler_historico_em('estoque_saidas', posicoes))
+
+
+def _escrever_aba_saidas(sheet, itens, formatos, por_linha):
+    """Aba Saídas: itens somados por classificação, com o total de cada uma e o geral."""
+    row = 4
+    valor_total_geral = 0
+
+    classificacoes_existentes = [
+        c for c in CLASSIFICACOES_ORDEM if c in itens['Classificação'].unique()]
+
+    for classificacao in classificacoes_existentes:
+        sheet.merge_range(
+            f'A{row}:I{row}',
+            f'Classificação: {classificacao}',
+            formatos['subheader']
+        )
+        row += 1
+
+        df_itens = itens[itens['Classificação'] == classificacao].copy()
+        # Corrigindo o cálculo do valor total para incluir o frete proporcional
+        df_itens['Valor Total'] = df_itens['Quantidade'] * (df_itens['Valor Unit.'] + df_itens['Frete_propo'])
+        df_itens = df_itens.sort_values(['Origem', 'Nome'], kind='stable')
+
+        colunas = _valores(df_itens, COLUNAS_SAIDAS)
+        _listrar(sheet, row, len(df_itens), colunas, formatos)
+        row = _escrever_tabela(sheet, row, colunas, formatos, por_linha)
+
+        total_classificacao = df_itens['Valor Total'].sum()
+
+        # Mantendo o layout original do total por classificação, mas ajustando os índices
+        sheet.merge_range(
+            f'A{row + 1}:G{row + 1}',
+            f'Total {classificacao}',
+            formatos['total']
+        )
+        sheet.write(row, 7, float(total_classificacao), formatos['total'])
+        sheet.write(row, 8, '', formatos['total'])
+        row += 2
+
+        valor_total_geral += total_classificacao
+
+    row += 1
+
+    # Mantendo o layout do total geral estimado conforme seu código original
+    sheet.merge_range(
+        f'A{row}:F{row}',
+        'TOTAL GERAL ESTIMADO:',
+        formatos['total_geral']
+    )
+    sheet.merge_range(
+        f'G{row}:H{row}',
+        valor_total_geral,
+        formatos['total_geral']
+    )
+    sheet.write(row, 8, '', formatos['total_geral'])
+
+    row += 1
+
+    # Observação final com ajuste para o novo número de colunas
+    sheet.merge_range(
+        f'A{row}:I{row}',
+        '* Valores podem variar conforme fornecedor e data da compra',
+        formatos['data_clara']
+    )
+
+
+def _gravar(caminho, blocos, total, itens, periodo, continuo, progresso=None):
+    """
+    Escreve o arquivo Excel. As abas são todas criadas antes (a ordem delas no
+    arquivo é a ordem de criação) e cada bloco de saídas (DataFrames de
+    _preparar, em ordem de data, `total` saídas ao todo) é acrescentado a cada
+    uma; a aba Saídas, montada a partir dos itens do período, fica por último.
+    """
+    workbook = xlsxwriter.Workbook(caminho, {
+        'constant_memory': continuo,
+        # Evita testar cada texto como link
+        'strings_to_urls': False,
+        'nan_inf_to_errors': True,
+    })
+    formatos = _criar_formatos(workbook)
+
+    def cabecalhos(colunas):
+        return [coluna for coluna, _formato in colunas]
+
+    # Aba Resumo Geral - apenas com valor total incluindo frete
+    # (aba, colunas, filtro (coluna, valor) das saídas que entram nela)
+    abas = [(_nova_aba(workbook, 'Resumo Geral', f'RESUMO DE SAÍDAS - {periodo}',
+                       cabecalhos(COLUNAS_RESUMO), LARGURAS_RESUMO, formatos),
+             COLUNAS_RESUMO, None)]
+
+    # Criar páginas para cada prefixo de avião
+    for prefixo in sorted(itens['Prefixo'].unique()):
+        if prefixo != '-':
+            sheet = _nova_aba(workbook, _nome_aba(prefixo), f'SAÍDAS {prefixo} - {periodo}',
+                              cabecalhos(COLUNAS_PREFIXO), LARGURAS_PREFIXO, formatos)
+            abas.append((sheet, COLUNAS_PREFIXO, ('Prefixo', prefixo)))
+
+    # Aba de Consumo
+    if 'CONS' in itens['Classificação'].values:
+        sheet = _nova_aba(workbook, 'Consumo', f'ITENS DE CONSUMO - {periodo}',
+                          cabecalhos(COLUNAS_CONSUMO), LARGURAS_CONSUMO, formatos)
+        abas.append((sheet, COLUNAS_CONSUMO, ('Classificação', 'CONS')))
+
+    # Criar aba única de saidas com todas as classificações
+    sheet_compras = _nova_aba(workbook, 'Saídas',
+                              f'SAÍDAS POR CLASSIFICAÇÃO DO PERÍODO - {periodo}',
+                              CABECALHOS_SAIDAS, LARGURAS_SAIDAS, formatos)
+
+    linhas = [3] * len(abas)
+    feitas = 0
+    for df in blocos:
+        for i, (sheet, colunas, filtro) in enumerate(abas):
+            parte = df if filtro is None else df[df[filtro[0]] == filtro[1]]
+            if not parte.empty:
+                linhas[i] = _escrever_tabela(sheet, linhas[i], _valores(parte, colunas),
+                                             formatos, por_linha=continuo)
+        feitas += len(df)
+        if progresso:
+            progresso(feitas, total)
+
+    for i, (sheet, colunas, filtro) in enumerate(abas):
+        # No Resumo Geral a primeira linha (linha 4 da planilha) é a escura
+        _listrar(sheet, 3, linhas[i] - 3, colunas, formatos, clara_primeiro=i > 0)
+        parte = itens if filtro is None else itens[itens[filtro[0]] == filtro[1]]
+        _escrever_total(sheet, linhas[i], colunas, parte['Valor Total'].sum(), formatos)
+
+    _escrever_aba_saidas(sheet_compras,
+                         itens.groupby(CHAVES_ITENS)['Quantidade'].sum().reset_index(),
+                         formatos, por_linha=continuo)
+    workbook.close()
+
+
+def gerar_arquivo(caminho_relatorios, data_inicial, data_final, instantaneo,
+                  continuo=None, progresso=None):
+    """
+    Escreve o relatório do período com as saídas do instantâneo (o que
+    agregados.instantaneo devolveu) e o anota no cache de relatórios. Devolve
+    o caminho do arquivo, ou None se não há saídas no período. continuo=True
+    força o modo contínuo (constant_memory); com None ele é usado quando o
+    período tem mais de LIMITE_EM_MEMORIA saídas. progresso(feitas, total) é
+    chamada a cada bloco gravado. Os erros são repassados para quem chamou.
+    """
+    versao, totais = instantaneo
+    if versao is None:
+        return None
+
+    # Percorre o histórico registro a registro e guarda só o período
+    chaves = _saidas_do_periodo(*datas.periodo(data_inicial, data_final), versao[1])
+    if not chaves:
+        return None
+
+    if continuo is None:
+        continuo = len(chaves) > LIMITE_EM_MEMORIA
+
+    caminho = os.path.join(caminho_relatorios,
+                           cache_relatorios.nome_arquivo(data_inicial, data_final))
+    _gravar(caminho, _blocos(chaves, TAMANHO_BLOCO), len(chaves), _itens(totais),
+            f'{data_inicial} a {data_final}', continuo, progresso)
+    cache_relatorios.registrar(caminho_relatorios, caminho, data_inicial, data_final, versao)
+    return caminho
+
+
+def _saidas_do_lote(inicio, fim, ate):
+    """Uma passada: as saídas entre inicio e fim anteriores a `ate`, convertidas e em ordem de data."""
+    saidas = sorted(((saida[datas.CAMPO] // 1000000, posicao), saida)
+                    for posicao, saida in banco.historico_no_periodo(
+                        'estoque_saidas', inicio, fim, com_posicao=True, ate=ate))
+    if not saidas:
+        return None
+    return _preparar([saida for _chave, saida in saidas])
+
+
+def _gravar_pedido(caminho, df, periodo):
+    """Escreve um relatório do lote (roda nos processos do lote)."""
+    blocos = (df.iloc[i:i + TAMANHO_BLOCO] for i in range(0, len(df), TAMANHO_BLOCO))
+    _gravar(caminho, blocos, len(df), _itens_de(df), periodo, len(df) > LIMITE_EM_MEMORIA)
+    return caminho
+
+
+def gerar_lote(caminho_relatorios, pedidos, processos=None):
+    """
+    Gera vários relatórios de uma vez. pedidos é uma lista de (data_inicial,
+    data_final) ou (data_inicial, data_final, prefixo), este último um
+    relatório só com as saídas daquele prefixo. As saídas de todos os
+    períodos são lidas e convertidas uma única vez e os arquivos são escritos
+    em até `processos` processos (com None, um por processador). Devolve o
+    caminho de cada relatório na ordem dos pedidos (None se o período não tem
+    saídas). Relatórios de período ainda válidos no cache são reaproveitados.
+    Datas inválidas dão ValueError; os demais erros são repassados.
+    """
+    pedidos = [(tuple(pedido) + (None,))[:3] for pedido in pedidos]
+    periodos = [datas.periodo(data_inicial, data_final)
+                for data_inicial, data_final, _prefixo in pedidos]
+    versao = cache_relatorios.versao_dados()
+
+    caminhos = [None] * len(pedidos)
+    pendentes = []
+    for i, (data_inicial, data_final, prefixo) in enumerate(pedidos):
+        if not prefixo:
+            caminhos[i] = cache_relatorios.procurar(caminho_relatorios, data_inicial, data_final)
+        if caminhos[i] is None:
+            pendentes.append(i)
+    if not pendentes or versao is None:
+        return caminhos
+
+    df = _saidas_do_lote(min(periodos[i][0] for i in pendentes),
+                         max(periodos[i][1] for i in pendentes), versao[1])
+    if df is None:
+        return caminhos
+
+    trabalhos = []
+    for i in pendentes:
+        data_inicial, data_final, prefixo = pedidos[i]
+        inicio, fim = periodos[i]
+        parte = df[(df['data_ts'] >= inicio) & (df['data_ts'] <= fim)]
+        periodo = f'{data_inicial} a {data_final}'
+        if prefixo:
+            parte = parte[parte['Prefixo'] == prefixo]
+            periodo = f'{periodo} - {prefixo}'
+        if not parte.empty:
+            nome = cache_relatorios.nome_arquivo(data_inicial, data_final, prefixo)
+            trabalhos.append((i, os.path.join(caminho_relatorios, nome), parte, periodo))
+
+    processos = min(processos or os.cpu_count() or 1, len(trabalhos))
+    if processos <= 1:
+        for i, caminho, parte, periodo in trabalhos:
+            caminhos[i] = _gravar_pedido(caminho, parte, periodo)
+    else:
+        # spawn em todo sistema: no Windows é o único, e no Linux evita copiar
+        # (fork) um processo com relatórios rodando em outras threads
+        with ProcessPoolExecutor(processos, mp_context=multiprocessing.get_context('spawn')) \
+                as executor:
+            futuros = [(i, executor.submit(_gravar_pedido, caminho, parte, periodo))
+                       for i, caminho, parte, periodo in trabalhos]
+            for i, futuro in futuros:
+                caminhos[i] = futuro.result()
+
+    for i, (data_inicial, data_final, prefixo) in enumerate(pedidos):
+        if caminhos[i] and not prefixo and i in pendentes:
+            cache_relatorios.registrar(caminho_relatorios, caminhos[i],
+                                       data_inicial, data_final, versao)
+    return caminhos
+
+
+def gerar_relatorio_saidas(data_inicial: str, data_final: str, continuo=None) -> str:
+    """
+    Gera relatório de saídas do estoque com tratamento de erros e validações
+    (ver gerar_arquivo).
+    """
+    try:
+        caminho_relatorios = criar_pasta_relatorios()
+        if not caminho_relatorios:
+            print("Erro: Não foi possível criar a pasta de relatórios")
+            return None
+
+        configurar_log()
+        logging.info(f"Iniciando relatório: {data_inicial} a {data_final}")
+
+        try:
+            instantaneo = agregados.instantaneo(*datas.periodo(data_inicial, data_final))
+        except ValueError as e:
+            logging.error(f"Erro no processamento de datas: {str(e)}")
+            print("Erro: Formato de data inválido!")
+            return None
+
+        try:
+            caminho_completo = gerar_arquivo(caminho_relatorios, data_inicial, data_final,
+                                             instantaneo, continuo)
+        except Exception as e:
+            logging.error(f"Erro ao gerar Excel: {str(e)}")
+            print(f"Erro ao gerar arquivo Excel: {str(e)}")
+            return None
+
+        if not caminho_completo:
+            logging.warning("Nenhum dado encontrado no período especificado")
+            print("Nenhum dado encontrado para o período especificado")
+            return None
+
+        logging.info(f"Relatório gerado com sucesso: {caminho_completo}")
+        print(f"\nRelatório gerado com sucesso!")
+        print(f"Caminho: {caminho_completo}")
+        return caminho_completo
+
+    except Exception as e:
+        logging.error(f"Erro inesperado: {str(e)}")
+        print(f"Erro inesperado: {str(e)}")
+        return None
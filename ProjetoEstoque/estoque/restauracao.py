@@ -0,0 +1,204 @@
+# restauracao.py
+# Restauração das gerações de backup (ver backup.py): listar as gerações pelo
+# catálogo, comparar uma geração com os dados atuais sem alterar nada e
+# restaurá-la.
+#
+# A restauração prepara os arquivos novos em banco.PASTA_RESTAURACAO (os
+# arquivos JSON e os históricos, ou o banco SQLite inteiro) e só depois grava
+# o plano da troca; a troca em si é banco.concluir_restauracao, que a termina
+# na próxima inicialização se o programa parar no meio. Os dados atuais só
+# mudam depois que tudo foi preparado e conferido.
+#
+# Tudo é feito com a trava das gravações (banco.trava) e os dados restaurados
+# entram como uma versão nova, para os outros processos que usam a mesma
+# pasta relerem tudo antes da próxima gravação (ver banco.sincronizar).
+
+import hashlib
+import json
+import os
+import shutil
+
+from estoque import backup, banco, banco_sqlite
+
+# Produtos diferentes mostrados na comparação (os demais só são contados)
+LIMITE_DIFERENCAS = 50
+
+
+def listar():
+    return backup.catalogo()
+
+
+def _geracao(nome):
+    """Manifesto da geração, conferido com o sha256 anotado no catálogo."""
+    for entrada in backup.catalogo():
+        if entrada['nome'] == nome:
+            break
+    else:
+        raise ValueError(f"Geração de backup não encontrada: {nome}")
+
+    with open(os.path.join(backup.PASTA_GERACOES, nome + '.json'), 'rb') as file:
+        conteudo = file.read()
+    if hashlib.sha256(conteudo).hexdigest() != entrada['sha256']:
+        raise ValueError(f"O manifesto da geração {nome} foi alterado ou está corrompido")
+    return json.loads(conteudo), entrada
+
+
+def _quantidade_atual(nome, manifesto):
+    if nome in banco.COLECOES:
+        return len(getattr(banco, nome))
+
+    estado = banco.estado_historico(nome)
+    if estado is None:
+        return 0
+    identidade, fim = estado
+    salvo = manifesto['historicos'].get(nome)
+    if salvo and salvo['identidade'] == list(identidade) and salvo['fim'] <= fim:
+        # O mesmo histórico: só conta o que foi acrescentado depois do backup
+        return sum(pedaco[2] for pedaco in salvo['pedacos']) + \
+            sum(1 for _item in banco.historico_desde(nome, salvo['fim']))
+    return sum(1 for _registro in banco.iterar_historico(nome))
+
+
+def _descricao(produto):
+    return f"id {produto['id']} {produto.get('nome', '')} {produto.get('modelo', '')}".rstrip()
+
+
+def diferencas(nome):
+    """
+    Compara a geração com os dados atuais sem alterar nada: a quantidade de
+    registros de cada coleção e histórico e os produtos que a restauração
+    traria de volta, tiraria do estoque ou alteraria. Devolve as linhas aos
+    poucos, conforme a comparação avança (os produtos do backup são lidos
+    pedaço a pedaço).
+    """
+    manifesto, entrada = _geracao(nome)
+    yield f"Geração {nome} ({entrada['data']})"
+    nomes = list(banco.COLECOES) + [tipo for tipo in banco.HISTORICOS
+                                     if tipo in entrada['registros']]
+    for colecao in nomes:
+        no_backup = entrada['registros'].get(colecao, 0)
+        atual = _quantidade_atual(colecao, manifesto)
+        marca = '' if no_backup == atual else '  *'
+        yield f"{colecao}: {no_backup} no backup, {atual} hoje{marca}"
+
+    contagem = {'voltam': 0, 'saem': 0, 'mudam': 0}
+    vistos = set()
+    for produto in backup.registros(manifesto, 'estoque'):
+        vistos.add(produto['id'])
+        atual = banco.produtos.get(produto['id'])
+        if atual is None:
+            tipo, texto = 'voltam', (f"+ {_descricao(produto)} volta ao estoque "
+                                     f"(quantidade {produto.get('quantidade')})")
+        elif atual != produto:
+            campos = sorted(set(atual) | set(produto))
+            mudancas = ', '.join(f"{campo}: {atual.get(campo)} -> {produto.get(campo)}"
+                                 for campo in campos if atual.get(campo) != produto.get(campo))
+            tipo, texto = 'mudam', f"~ {_descricao(produto)}: {mudancas}"
+        else:
+            continue
+        contagem[tipo] += 1
+        if sum(contagem.values()) <= LIMITE_DIFERENCAS:
+            yield texto
+
+    for id_produto, atual in banco.produtos.items():
+        if id_produto not in vistos:
+            contagem['saem'] += 1
+            if sum(contagem.values()) <= LIMITE_DIFERENCAS:
+                yield (f"- {_descricao(atual)} sai do estoque "
+                       f"(quantidade {atual.get('quantidade')})")
+
+    diferentes = sum(contagem.values())
+    if diferentes > LIMITE_DIFERENCAS:
+        yield f"... e mais {diferentes - LIMITE_DIFERENCAS} produtos diferentes."
+    yield (f"Produtos: {contagem['voltam']} voltam, {contagem['saem']} saem, "
+           f"{contagem['mudam']} mudam.")
+
+
+def _gravar(caminho, partes):
+    with open(caminho, 'wb') as file:
+        for parte in partes:
+            file.write(parte)
+        file.flush()
+        os.fsync(file.fileno())
+
+
+def _preparar_json(manifesto, versao, proximo_id):
+    """
+    Escreve os arquivos JSON e os históricos da geração e um checkpoint deles
+    na versão informada. Devolve (substituir, remover).
+    """
+    substituir = []
+    remover = [os.path.basename(banco.ARQUIVO_DIARIO)]
+    checkpoint = {}
+    for colecao in banco.COLECOES:
+        registros = list(backup.registros(manifesto, colecao))
+        arquivo = f'{colecao}.json'
+        checkpoint[colecao] = {'sequencia': versao, 'anterior': versao, 'sha1': None}
+        # Como no checkpoint: entradas e saidas vazias não ficam com arquivo
+        if not registros and colecao in ('entradas', 'saidas'):
+            remover.append(arquivo)
+            continue
+        conteudo = json.dumps(registros, indent=4).encode('utf-8')
+        _gravar(os.path.join(banco.PASTA_RESTAURACAO, arquivo), [conteudo])
+        checkpoint[colecao]['sha1'] = hashlib.sha1(conteudo).hexdigest()
+        substituir.append(arquivo)
+    checkpoint['estoque']['proximo_id'] = proximo_id
+
+    for tipo in banco.HISTORICOS:
+        arquivo = f'{tipo}.jsonl'
+        if tipo not in manifesto['historicos']:
+            remover.append(arquivo)
+            continue
+        # Os pedaços já são linhas JSON: o arquivo é só a junção deles
+        _gravar(os.path.join(banco.PASTA_RESTAURACAO, arquivo),
+                (backup.ler_objeto(pedaco[0])
+                 for pedaco in manifesto['historicos'][tipo]['pedacos']))
+        substituir.append(arquivo)
+
+    arquivo = os.path.basename(banco.ARQUIVO_CHECKPOINT)
+    _gravar(os.path.join(banco.PASTA_RESTAURACAO, arquivo),
+            [json.dumps(checkpoint, indent=4).encode('utf-8')])
+    substituir.append(arquivo)
+    return substituir, remover
+
+
+def _preparar_sqlite(manifesto, versao, proximo_id):
+    """Cria o banco SQLite com os dados da geração. Devolve (substituir, remover)."""
+    arquivo = os.path.basename(banco_sqlite.ARQUIVO)
+    dados = {colecao: backup.registros(manifesto, colecao) for colecao in banco.COLECOES}
+    dados.update({tipo: backup.registros(manifesto, tipo) for tipo in manifesto['historicos']})
+    banco_sqlite.criar_banco(os.path.join(banco.PASTA_RESTAURACAO, arquivo), dados,
+                             {'versao': versao, 'proximo_id': proximo_id})
+    return [arquivo], []
+
+
+def restaurar(nome):
+    """
+    Substitui os dados atuais pelos da geração e os carrega de novo. Se algum
+    pedaço estiver faltando ou corrompido, nada é alterado (ValueError ou
+    OSError).
+    """
+    manifesto, _entrada = _geracao(nome)
+    with banco.trava():
+        # A versão nova vem depois da última gravada, por qualquer processo, e
+        # o contador de ids não volta atrás
+        banco.sincronizar()
+        versao, proximo_id = banco.estado_gravacao()
+        shutil.rmtree(banco.PASTA_RESTAURACAO, ignore_errors=True)
+        os.makedirs(banco.PASTA_RESTAURACAO)
+        try:
+            if banco.BACKEND == 'sqlite':
+                substituir, remover = _preparar_sqlite(manifesto, versao + 1, proximo_id)
+            else:
+                substituir, remover = _preparar_json(manifesto, versao + 1, proximo_id)
+
+            plano = os.path.join(banco.PASTA_RESTAURACAO, 'plano.json')
+            _gravar(plano + '.tmp', [json.dumps({'geracao': nome, 'substituir': substituir,
+                                                 'remover': remover}).encode('utf-8')])
+            os.replace(plano + '.tmp', plano)
+        except BaseException:
+            shutil.rmtree(banco.PASTA_RESTAURACAO, ignore_errors=True)
+            raise
+
+        banco.concluir_restauracao()
+        banco.carregar_dados()
@@ -0,0 +1,127 @@
+# retencao.py
+# Retenção das gerações de backup (ver backup.py). Das gerações salvas ficam
+# a mais recente e, em cada faixa, a mais recente de cada hora, dia, semana e
+# mês, até o número de horas, dias, semanas e meses de RETENCAO (contando só
+# os períodos que têm backup). Se o que sobrar ainda passar de
+# ORCAMENTO_BYTES, as mais antigas saem até caber.
+#
+# A compactação apaga as gerações que saíram e depois os pedaços que nenhuma
+# geração restante usa. Tudo é decidido pelo catálogo e pelo inventário de
+# pedaços, sem percorrer as pastas. Ela roda em segundo plano ao abrir o
+# programa (iniciar) e sob a backup.trava(), então nunca junto com um backup,
+# nem com o de outro processo.
+
+import logging
+import os
+import threading
+from collections import Counter
+from datetime import datetime
+
+from estoque import backup
+
+# Faixa -> quantos períodos guardar
+RETENCAO = {'hora': 24, 'dia': 30, 'semana': 12, 'mes': 24}
+# Espaço máximo dos pedaços das gerações mantidas
+ORCAMENTO_BYTES = 500 * 1024 * 1024
+
+_PERIODOS = {
+    'hora': lambda data: (data.year, data.month, data.day, data.hour),
+    'dia': lambda data: (data.year, data.month, data.day),
+    'semana': lambda data: tuple(data.isocalendar())[:2],
+    'mes': lambda data: (data.year, data.month),
+}
+
+_thread = None
+
+
+def selecionar(entradas):
+    """Nomes das gerações (entradas do catálogo) que a retenção mantém."""
+    if not entradas:
+        return set()
+    manter = {entradas[-1]['nome']}
+    vistos = {faixa: set() for faixa in RETENCAO}
+    for entrada in reversed(entradas):
+        data = datetime.strptime(entrada['data'], '%d/%m/%Y %H:%M:%S')
+        for faixa, limite in RETENCAO.items():
+            periodo = _PERIODOS[faixa](data)
+            if periodo not in vistos[faixa] and len(vistos[faixa]) < limite:
+                vistos[faixa].add(periodo)
+                manter.add(entrada['nome'])
+    return manter
+
+
+def _remover(caminho):
+    try:
+        os.remove(caminho)
+    except FileNotFoundError:
+        pass
+
+
+def compactar():
+    """
+    Aplica a retenção e o orçamento de disco. Devolve (gerações apagadas,
+    pedaços apagados, bytes liberados).
+    """
+    with backup.trava():
+        entradas = backup.catalogo()
+        manter = selecionar(entradas)
+        mantidas = [entrada['nome'] for entrada in entradas if entrada['nome'] in manter]
+
+        # Pedaços de cada geração mantida e quantas gerações usam cada um
+        usados = {}
+        for nome in mantidas:
+            try:
+                usados[nome] = backup.chaves(backup.ler_manifesto(nome))
+            except (OSError, ValueError, KeyError):
+                # Sem saber o que a geração usa, nenhum pedaço pode ser apagado
+                logging.error(f"Manifesto do backup {nome} ilegível; compactação cancelada")
+                return 0, 0, 0
+        referencias = Counter()
+        for chaves in usados.values():
+            referencias.update(chaves)
+
+        objetos = backup.inventario()
+        total = sum(objetos.get(chave, 0) for chave in referencias)
+        while total > ORCAMENTO_BYTES and len(mantidas) > 1:
+            for chave in usados.pop(mantidas.pop(0)):
+                referencias[chave] -= 1
+                if not referencias[chave]:
+                    del referencias[chave]
+                    total -= objetos.get(chave, 0)
+
+        # Primeiro o catálogo: uma geração fora dele não é mais usada
+        apagadas = [entrada['nome'] for entrada in entradas if entrada['nome'] not in usados]
+        if apagadas:
+            backup.gravar_catalogo([entrada for entrada in entradas
+                                    if entrada['nome'] in usados])
+            for nome in apagadas:
+                _remover(os.path.join(backup.PASTA_GERACOES, nome + '.json'))
+
+        lixo = [chave for chave in objetos if chave not in referencias]
+        liberados = 0
+        for chave in lixo:
+            _remover(backup.caminho_objeto(chave))
+            liberados += objetos.pop(chave)
+        if lixo:
+            backup.gravar_inventario(objetos)
+    return len(apagadas), len(lixo), liberados
+
+
+def _executar():
+    try:
+        geracoes, pedacos, liberados = compactar()
+        if geracoes or pedacos:
+            logging.info(f"Compactação dos backups: {geracoes} gerações e {pedacos} pedaços "
+                         f"apagados, {liberados / 1024:.1f} KB liberados")
+    except Exception as e:
+        logging.error(f"Erro ao compactar os backups: {str(e)}")
+
+
+def iniciar():
+    """Começa a compactação em segundo plano (se ainda não estiver rodando)."""
+    global _thread
+
+    if _thread is not None and _thread.is_alive():
+        return
+    _thread = threading.Thread(target=_executar, daemon=True)
+    _thread.start()
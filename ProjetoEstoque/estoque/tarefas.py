@@ -0,0 +1,115 @@
+# tarefas.py
+# Relatórios gerados em segundo plano, para o menu continuar atendendo
+# enquanto o arquivo é escrito. O pedido tira na hora um instantâneo das
+# saídas (agregados.instantaneo: os totais do período e até que ponto do
+# histórico eles vão) e uma thread escreve o relatório só com essas saídas;
+# o que for registrado enquanto isso fica para o próximo relatório.
+#
+# O menu mostra o andamento (status) e avisa quando cada relatório termina
+# (avisos). Cada tarefa é um dicionário atualizado pela thread dela; as
+# atualizações são atribuições simples, então a thread principal pode lê-lo a
+# qualquer momento.
+
+import logging
+import threading
+
+from estoque import agregados, datas
+
+_tarefas = []
+
+
+def _executar(tarefa, caminho_relatorios, instantaneo):
+    def progresso(feitas, total):
+        tarefa['feitas'] = feitas
+        tarefa['total'] = total
+
+    try:
+        # O pandas é importado aqui, fora da thread principal
+        from estoque import relatorios
+        tarefa['estado'] = 'gerando'
+        caminho = relatorios.gerar_arquivo(caminho_relatorios, tarefa['data_inicial'],
+                                           tarefa['data_final'], instantaneo,
+                                           progresso=progresso)
+        tarefa['caminho'] = caminho
+        tarefa['estado'] = 'concluido' if caminho else 'sem dados'
+        if caminho:
+            logging.info(f"Relatório gerado com sucesso: {caminho}")
+        else:
+            logging.warning("Nenhum dado encontrado no período especificado")
+    except Exception as e:
+        logging.error(f"Erro ao gerar Excel: {str(e)}")
+        tarefa['erro'] = str(e)
+        tarefa['estado'] = 'erro'
+
+
+def iniciar_relatorio(caminho_relatorios, data_inicial, data_final):
+    """
+    Começa a gerar o relatório do período em segundo plano e devolve a
+    tarefa. As datas já devem ter sido validadas (ValueError se inválidas).
+    """
+    instantaneo = agregados.instantaneo(*datas.periodo(data_inicial, data_final))
+    tarefa = {
+        'data_inicial': data_inicial,
+        'data_final': data_final,
+        'estado': 'iniciando',
+        'feitas': 0,
+        'total': 0,
+        'caminho': None,
+        'erro': None,
+    }
+    tarefa['thread'] = threading.Thread(
+        target=_executar, args=(tarefa, caminho_relatorios, instantaneo), daemon=True)
+    _tarefas.append(tarefa)
+    tarefa['thread'].start()
+    return tarefa
+
+
+def _descricao(tarefa):
+    return f"Relatório {tarefa['data_inicial']} a {tarefa['data_final']}"
+
+
+def status():
+    """Uma linha de andamento para cada relatório ainda em geração."""
+    linhas = []
+    for tarefa in _tarefas:
+        if tarefa['estado'] == 'iniciando':
+            linhas.append(f"{_descricao(tarefa)}: lendo as saídas...")
+        elif tarefa['estado'] == 'gerando':
+            total = tarefa['total']
+            if total and tarefa['feitas'] == total:
+                linhas.append(f"{_descricao(tarefa)}: finalizando o arquivo...")
+            elif total:
+                linhas.append(f"{_descricao(tarefa)}: {tarefa['feitas']} de {total} saídas "
+                              f"({tarefa['feitas'] * 100 // total}%)")
+            else:
+                linhas.append(f"{_descricao(tarefa)}: lendo as saídas...")
+    return linhas
+
+
+def avisos():
+    """
+    Mensagens dos relatórios que terminaram desde a última chamada (cada
+    tarefa é avisada uma vez e sai da lista).
+    """
+    mensagens = []
+    for tarefa in list(_tarefas):
+        if tarefa['estado'] == 'concluido':
+            mensagens.append(f"{_descricao(tarefa)} pronto: {tarefa['caminho']}")
+        elif tarefa['estado'] == 'sem dados':
+            mensagens.append(f"{_descricao(tarefa)}: nenhum dado encontrado para o período")
+        elif tarefa['estado'] == 'erro':
+            mensagens.append(f"{_descricao(tarefa)}: erro ao gerar arquivo Excel: {tarefa['erro']}")
+        else:
+            continue
+        _tarefas.remove(tarefa)
+    return mensagens
+
+
+def em_andamento():
+    return any(tarefa['thread'].is_alive() for tarefa in _tarefas)
+
+
+def aguardar():
+    """Espera os relatórios em geração terminarem (antes de encerrar o programa)."""
+    for tarefa in list(_tarefas):
+        tarefa['thread'].join()
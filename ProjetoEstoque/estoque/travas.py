@@ -0,0 +1,69 @@
+# travas.py
+# Travas entre processos, para mais de um terminal usar a mesma pasta backup/
+# (por exemplo em um disco compartilhado). A trava é um arquivo vazio travado
+# pelo sistema operacional (fcntl.lockf no Linux, msvcrt.locking no Windows)
+# e é só consultiva: vale entre os processos deste programa que a pedem. Só
+# as gravações a pedem; as leituras não esperam por ela.
+#
+# Dentro do processo a trava também exclui as outras threads e pode ser
+# pedida de novo por quem já a tem (as gravações chamam umas às outras).
+
+import os
+import threading
+from contextlib import contextmanager
+
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
+
+# Caminho do arquivo -> {'thread': RLock, 'arquivo': aberto, 'nivel': quantas vezes pedida}
+_travas = {}
+_protecao = threading.Lock()
+
+
+def _bloquear(arquivo):
+    if os.name == 'nt':
+        # Trava o primeiro byte (pode estar além do fim do arquivo vazio).
+        # LK_LOCK desiste depois de 10 tentativas: espera enquanto for preciso
+        arquivo.seek(0)
+        while True:
+            try:
+                msvcrt.locking(arquivo.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                continue
+    fcntl.lockf(arquivo.fileno(), fcntl.LOCK_EX)
+
+
+def _liberar(arquivo):
+    if os.name == 'nt':
+        arquivo.seek(0)
+        msvcrt.locking(arquivo.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        fcntl.lockf(arquivo.fileno(), fcntl.LOCK_UN)
+
+
+@contextmanager
+def travar(caminho):
+    """Segura a trava do arquivo durante o bloco, esperando se outro processo estiver com ela."""
+    # O arquivo fica aberto: um caminho relativo (backup/...) valeria na pasta
+    # de quando foi aberto, não na atual
+    caminho = os.path.abspath(caminho)
+    with _protecao:
+        trava = _travas.setdefault(caminho, {'thread': threading.RLock(),
+                                             'arquivo': None, 'nivel': 0})
+    with trava['thread']:
+        if not trava['nivel']:
+            # O arquivo fica aberto entre uma gravação e outra
+            if trava['arquivo'] is None:
+                os.makedirs(os.path.dirname(caminho) or '.', exist_ok=True)
+                trava['arquivo'] = open(caminho, 'a+b')
+            _bloquear(trava['arquivo'])
+        trava['nivel'] += 1
+        try:
+            yield
+        finally:
+            trava['nivel'] -= 1
+            if not trava['nivel']:
+                _liberar(trava['arquivo'])
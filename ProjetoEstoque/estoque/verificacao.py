@@ -0,0 +1,563 @@
+# verificacao.py
+# Verificação da integridade dos dados e dos backups (comando verificar).
+#
+# Os arquivos são lidos em blocos, sem carregar nenhum inteiro: os arquivos
+# JSON das coleções item a item (ver _itens_lista), o diário e os históricos
+# linha a linha, cada um com a soma sha256 calculada na mesma leitura. Com os
+# produtos montados do arquivo e do diário (como o banco os carregaria) são
+# conferidas as regras: nenhuma quantidade negativa, frete e quantidade
+# fretada coerentes e saídas de produtos conhecidos. Por fim cada geração de
+# backup é conferida (cada pedaço uma vez só, mesmo se usado por várias).
+#
+# A verificação não grava nada: migrações, conversões e restaurações
+# pendentes são informadas à parte, não feitas (e não contam como problemas).
+#
+# Só os primeiros LIMITE_PROBLEMAS problemas são guardados com detalhes; os
+# demais são só contados por tipo, então a memória usada não cresce com a
+# quantidade de problemas.
+
+import codecs
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from collections import Counter
+
+from estoque import backup, banco, banco_sqlite
+
+LIMITE_PROBLEMAS = 100
+TAMANHO_BLOCO = 1024 * 1024
+# Maior item aceito num arquivo de coleção; acima disso o arquivo está corrompido
+LIMITE_ITEM = 16 * 1024 * 1024
+# Diferença aceita no frete proporcional (arredondamentos)
+TOLERANCIA = 1e-6
+
+
+def _problema(relatorio, tipo, local, detalhe=''):
+    relatorio['por_tipo'][tipo] += 1
+    if len(relatorio['problemas']) < LIMITE_PROBLEMAS:
+        relatorio['problemas'].append(f"{local}: {tipo}{detalhe}")
+
+
+def _numero(valor):
+    try:
+        numero = float(valor)
+    except (TypeError, ValueError):
+        return None
+    return None if numero != numero else numero
+
+
+# Leitura em blocos
+
+def _linhas(caminho, soma):
+    """
+    Linhas do arquivo como (número, conteúdo, completa), lidas em blocos. Todo
+    o conteúdo passa pela soma.
+    """
+    resto = b''
+    numero = 0
+    with open(caminho, 'rb') as file:
+        while True:
+            bloco = file.read(TAMANHO_BLOCO)
+            if not bloco:
+                break
+            soma.update(bloco)
+            linhas = (resto + bloco).split(b'\n')
+            resto = linhas.pop()
+            for linha in linhas:
+                numero += 1
+                yield numero, linha, True
+    if resto:
+        yield numero + 1, resto, False
+
+
+def _ler_bloco(file, utf8, soma, texto):
+    bloco = file.read(TAMANHO_BLOCO)
+    soma.update(bloco)
+    return texto + utf8.decode(bloco, final=not bloco), not bloco
+
+
+def _itens_lista(caminho, soma):
+    """
+    Itens de um arquivo com uma lista JSON, um a um, lidos em blocos. Todo o
+    conteúdo passa pela soma. ValueError se o arquivo não for uma lista JSON
+    válida.
+    """
+    decodificador = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    texto, i, fim = '', 0, False
+    esperado = '['
+    with open(caminho, 'rb') as file:
+        while True:
+            while i < len(texto) and texto[i] in ' \t\r\n':
+                i += 1
+            # Mantém um bloco à frente: o item atual pode continuar no próximo
+            if not fim and len(texto) - i < TAMANHO_BLOCO:
+                texto, fim = _ler_bloco(file, utf8, soma, texto[i:])
+                i = 0
+                continue
+            if i == len(texto):
+                if esperado == 'fim':
+                    return
+                raise ValueError("o arquivo termina antes do fim da lista")
+
+            caractere = texto[i]
+            if esperado == 'fim':
+                raise ValueError("há conteúdo depois do fim da lista")
+            if esperado == '[':
+                if caractere != '[':
+                    raise ValueError("o arquivo não é uma lista JSON")
+                i += 1
+                esperado = 'item ou ]'
+            elif caractere == ']' and esperado in ('item ou ]', ', ou ]'):
+                i += 1
+                esperado = 'fim'
+            elif esperado == ', ou ]':
+                if caractere != ',':
+                    raise ValueError("esperado ',' ou ']' entre os itens")
+                i += 1
+                esperado = 'item'
+            else:
+                try:
+                    item, j = decodificador.raw_decode(texto, i)
+                except ValueError:
+                    if fim or len(texto) - i > LIMITE_ITEM:
+                        raise
+                    # Item maior que um bloco: lê mais e tenta de novo
+                    texto, fim = _ler_bloco(file, utf8, soma, texto[i:])
+                    i = 0
+                    continue
+                yield item
+                i = j
+                esperado = ', ou ]'
+
+
+# Arquivos de dados
+#
+# Os arquivos são lidos aqui mesmo, e não por banco.carregar_dados, que
+# faria as migrações pendentes e concluiria uma restauração interrompida.
+
+def _pendencia(relatorio, tipo, local):
+    # Não é um problema: é o que o programa faz na próxima vez que for aberto
+    relatorio['pendencias'].append(f"{local}: {tipo}")
+
+
+def _caminho_historico(tipo):
+    # Sem banco.caminho_historico, que converteria um histórico antigo
+    return os.path.join(banco.PASTA, f'{tipo}.jsonl')
+
+
+def _ha_dados_json():
+    caminhos = [banco.ARQUIVO_CHECKPOINT, banco.ARQUIVO_DIARIO]
+    caminhos += [os.path.join(banco.PASTA, f'{colecao}.json') for colecao in banco.COLECOES]
+    caminhos += [_caminho_historico(tipo) for tipo in banco.HISTORICOS]
+    return (any(os.path.exists(caminho) for caminho in caminhos)
+            or any(banco.historico_antigo(tipo) for tipo in banco.HISTORICOS))
+
+
+def _verificar_pendencias(relatorio):
+    if os.path.exists(banco.PASTA_RESTAURACAO):
+        _pendencia(relatorio, "restauração pendente", banco.PASTA_RESTAURACAO)
+    if (banco.BACKEND == 'sqlite' and banco_sqlite.existe()) or not _ha_dados_json():
+        return
+    if banco.BACKEND == 'sqlite':
+        _pendencia(relatorio, "importação dos arquivos JSON para o SQLite pendente",
+                   banco_sqlite.ARQUIVO)
+
+    try:
+        with open(banco.ARQUIVO_VERSAO, 'r') as file:
+            versao = json.load(file).get('versao', 0)
+    except FileNotFoundError:
+        versao = 0
+    except (ValueError, AttributeError) as e:
+        _problema(relatorio, "arquivo de versão ilegível", banco.ARQUIVO_VERSAO, f" ({e})")
+        return
+    if versao < banco.VERSAO_DADOS:
+        _pendencia(relatorio, f"migração dos dados da versão {versao} pendente",
+                   banco.ARQUIVO_VERSAO)
+
+
+def _ler_checkpoint(relatorio):
+    try:
+        with open(banco.ARQUIVO_CHECKPOINT, 'r') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+    except ValueError as e:
+        _problema(relatorio, "checkpoint ilegível", banco.ARQUIVO_CHECKPOINT, f" ({e})")
+        relatorio['dados_ilegiveis'] = True
+        return {}
+
+
+def _sequencia_contida(info, sha1):
+    # Como em banco._ler_colecao: se o arquivo não é o do último checkpoint,
+    # ele é o anterior
+    return info.get('sequencia', 0) if info.get('sha1') == sha1 else info.get('anterior', 0)
+
+
+def _verificar_colecoes(relatorio, mostrar, checkpoint):
+    """Confere os arquivos das coleções. Devolve (produtos lidos, sequência já contida neles)."""
+    com_diario = os.path.exists(banco.ARQUIVO_DIARIO)
+    estoque = None
+    for colecao in banco.COLECOES:
+        caminho = os.path.join(banco.PASTA, f'{colecao}.json')
+        info = checkpoint.get(colecao, {})
+        esperado = info.get('sha1')
+        if not os.path.exists(caminho):
+            if esperado is not None and not com_diario:
+                _problema(relatorio, "arquivo ausente", caminho)
+            if colecao == 'estoque':
+                estoque = [], _sequencia_contida(info, None)
+            continue
+
+        soma = hashlib.sha1()
+        quantidade = 0
+        registros = []
+        try:
+            for item in _itens_lista(caminho, soma):
+                quantidade += 1
+                if colecao == 'estoque':
+                    registros.append(item)
+        except (OSError, ValueError) as e:
+            _problema(relatorio, "JSON inválido", caminho, f" (depois de {quantidade} itens: {e})")
+            relatorio['dados_ilegiveis'] = True
+            continue
+        # Numa queda no meio do checkpoint o arquivo pode ser o anterior; aí o
+        # diário ainda tem as gravações que faltam
+        if colecao in checkpoint and esperado != soma.hexdigest() and not com_diario:
+            _problema(relatorio, "arquivo diferente do gravado no último checkpoint", caminho)
+        if colecao == 'estoque':
+            estoque = registros, _sequencia_contida(info, soma.hexdigest())
+        mostrar(f"{caminho}: {quantidade} registros, sha1 {soma.hexdigest()}")
+    return estoque
+
+
+def _verificar_diario(relatorio, mostrar):
+    """Confere o diário. Devolve as alterações do estoque como (sequência, alteração)."""
+    alteracoes = []
+    if not os.path.exists(banco.ARQUIVO_DIARIO):
+        return alteracoes
+    soma = hashlib.sha256()
+    anterior = 0
+    quantidade = 0
+    for numero, linha, completa in _linhas(banco.ARQUIVO_DIARIO, soma):
+        local = f"{banco.ARQUIVO_DIARIO} linha {numero}"
+        if not completa:
+            _problema(relatorio, "última gravação incompleta", local,
+                      " (será descartada na próxima carga)")
+            break
+        try:
+            gravacao = json.loads(linha)
+            sequencia = gravacao['s']
+            alteracoes.extend((sequencia, alteracao) for alteracao in gravacao['alteracoes']
+                              if alteracao['c'] == 'estoque')
+        except (ValueError, KeyError, TypeError):
+            _problema(relatorio, "gravação ilegível", local)
+            relatorio['dados_ilegiveis'] = True
+            break
+        if sequencia <= anterior:
+            _problema(relatorio, "sequência fora de ordem", local)
+        anterior = sequencia
+        quantidade += 1
+    mostrar(f"{banco.ARQUIVO_DIARIO}: {quantidade} gravações, sha256 {soma.hexdigest()}")
+    return alteracoes
+
+
+# Regras dos dados
+
+def _montar_produtos(registros, proximo_id, alteracoes=()):
+    """
+    Os produtos como o banco os carregaria (ver banco._definir_produtos e
+    banco._aplicar_produto). Devolve (produtos por id, próximo id).
+    """
+    proximo_id = max([p['id'] + 1 for p in registros if 'id' in p] + [proximo_id])
+    produtos = {}
+    for registro in registros:
+        if 'id' not in registro:
+            registro['id'] = proximo_id
+            proximo_id += 1
+        produtos[registro['id']] = registro
+
+    for alteracao in alteracoes:
+        if alteracao['op'] == 'inserir':
+            registro = alteracao['r']
+            registro.setdefault('id', proximo_id)
+            proximo_id = max(proximo_id, registro['id'] + 1)
+            produtos[registro['id']] = registro
+            continue
+        # Diários gravados antes dos ids guardam a posição no estoque ('i')
+        chave = alteracao['id'] if 'id' in alteracao else list(produtos)[alteracao['i']]
+        if alteracao['op'] == 'atualizar':
+            produtos[chave].update(alteracao['r'])
+        elif alteracao['op'] == 'remover':
+            del produtos[chave]
+    return produtos, proximo_id
+
+
+def _verificar_produtos(relatorio, registros, proximo_id, alteracoes=()):
+    """Confere as regras dos produtos. Devolve o próximo id (None se os dados não fecham)."""
+    try:
+        produtos, proximo_id = _montar_produtos(registros, proximo_id, alteracoes)
+    except (KeyError, IndexError, TypeError, ValueError) as e:
+        _problema(relatorio, "diário não combina com o arquivo do estoque", banco.PASTA,
+                  f" ({e!r})")
+        return None
+
+    for produto in produtos.values():
+        local = f"produto id {produto['id']}"
+        quantidade = _numero(produto.get('quantidade'))
+        if quantidade is None:
+            _problema(relatorio, "quantidade não numérica", local)
+        elif quantidade < 0:
+            _problema(relatorio, "quantidade negativa", local, f" ({quantidade:g})")
+        if (_numero(produto.get('valor')) or 0) < 0:
+            _problema(relatorio, "valor negativo", local)
+
+        frete = _numero(produto.get('frete', 0))
+        fretada = _numero(produto.get('quantidade_fretada', 0))
+        if frete is None or fretada is None or frete < 0 or fretada < 0:
+            _problema(relatorio, "frete ou quantidade fretada inválidos", local)
+        elif frete > 0 and fretada == 0:
+            _problema(relatorio, "frete sem quantidade fretada", local)
+    return proximo_id
+
+
+def _verificar_registro(relatorio, tipo, local, registro, proximo_id):
+    if tipo == 'estoque_exclusoes':
+        return
+    quantidade = _numero(registro.get('quantidade'))
+    if quantidade is None or quantidade <= 0:
+        _problema(relatorio, "quantidade não positiva", local)
+    if tipo != 'estoque_saidas':
+        return
+
+    # Os ids crescem e nunca são reaproveitados: todo id abaixo do próximo
+    # já foi de um produto, mesmo que ele tenha sido removido depois
+    produto_id = registro.get('produto_id')
+    if ('produto_id' in registro and proximo_id is not None
+            and not (isinstance(produto_id, int) and 1 <= produto_id < proximo_id)):
+        _problema(relatorio, "saída de produto desconhecido", local,
+                  f" (produto_id {produto_id}; os ids dados vão de 1 a {proximo_id - 1})")
+    if 'frete_proporcional' in registro and 'frete_original' in registro:
+        frete = _numero(registro['frete_original']) or 0
+        fretada = _numero(registro.get('quantidade_fretada')) or 0
+        esperado = frete / fretada if frete > 0 and fretada > 0 else 0
+        proporcional = _numero(registro['frete_proporcional'])
+        if proporcional is None or abs(proporcional - esperado) > TOLERANCIA * max(1, esperado):
+            _problema(relatorio, "frete proporcional diferente de frete / quantidade fretada",
+                      local, f" ({registro['frete_proporcional']} em vez de {esperado:.6g})")
+
+
+def _verificar_historico(relatorio, tipo, proximo_id, mostrar):
+    """Confere as linhas, a soma e os registros de um histórico no modo JSON."""
+    caminho = _caminho_historico(tipo)
+    if not os.path.exists(caminho):
+        antigo = banco.historico_antigo(tipo)
+        if antigo is not None:
+            _verificar_historico_antigo(relatorio, tipo, antigo, proximo_id, mostrar)
+        return
+
+    soma = hashlib.sha256()
+    quantidade = 0
+    for numero, linha, completa in _linhas(caminho, soma):
+        local = f"{caminho} linha {numero}"
+        if not completa:
+            _problema(relatorio, "última linha incompleta", local)
+            break
+        try:
+            registro = json.loads(linha)
+        except ValueError:
+            _problema(relatorio, "linha ilegível", local)
+            continue
+        quantidade += 1
+        _verificar_registro(relatorio, tipo, local, registro, proximo_id)
+    mostrar(f"{caminho}: {quantidade} registros, sha256 {soma.hexdigest()}")
+
+
+def _verificar_historico_antigo(relatorio, tipo, caminho, proximo_id, mostrar):
+    """Histórico ainda no formato antigo (uma lista JSON), que banco converte ao abrir."""
+    soma = hashlib.sha256()
+    quantidade = 0
+    try:
+        for registro in _itens_lista(caminho, soma):
+            quantidade += 1
+            _verificar_registro(relatorio, tipo, f"{caminho} registro {quantidade}",
+                                registro, proximo_id)
+    except (OSError, ValueError) as e:
+        _problema(relatorio, "histórico antigo ilegível", caminho,
+                  f" (depois de {quantidade} registros: {e}; ele não será convertido)")
+        return
+    _pendencia(relatorio, "conversão do histórico antigo pendente", caminho)
+    mostrar(f"{caminho}: {quantidade} registros, sha256 {soma.hexdigest()}")
+
+
+def _verificar_json(relatorio, mostrar):
+    checkpoint = _ler_checkpoint(relatorio)
+    estoque = _verificar_colecoes(relatorio, mostrar, checkpoint)
+    alteracoes = _verificar_diario(relatorio, mostrar)
+
+    proximo_id = None
+    if not relatorio['dados_ilegiveis']:
+        registros, contida = estoque
+        proximo_id = _verificar_produtos(
+            relatorio, registros, checkpoint.get('estoque', {}).get('proximo_id', 1),
+            [alteracao for sequencia, alteracao in alteracoes if sequencia > contida])
+    for tipo in banco.HISTORICOS:
+        _verificar_historico(relatorio, tipo, proximo_id, mostrar)
+
+
+def _verificar_sqlite(relatorio, mostrar):
+    # Uma conexão só de consulta: banco_sqlite.conectar criaria as tabelas
+    # que faltassem e migraria o esquema
+    conexao = sqlite3.connect(banco_sqlite.ARQUIVO)
+    try:
+        _verificar_banco_sqlite(relatorio, mostrar, conexao)
+    finally:
+        conexao.close()
+
+
+def _verificar_banco_sqlite(relatorio, mostrar, conexao):
+    local = banco_sqlite.ARQUIVO
+    try:
+        resultado = [linha for linha, in conexao.execute("PRAGMA quick_check")]
+    except sqlite3.DatabaseError as e:
+        resultado = [str(e)]
+    if resultado != ['ok']:
+        for linha in resultado[:10]:
+            _problema(relatorio, "banco SQLite corrompido", local, f" ({linha})")
+        relatorio['dados_ilegiveis'] = True
+        return
+    mostrar(f"{local}: integridade ok")
+
+    if conexao.execute("PRAGMA user_version").fetchone()[0] < banco_sqlite.VERSAO:
+        _pendencia(relatorio, "migração do banco SQLite pendente", local)
+    tabelas = {nome for nome, in conexao.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+    try:
+        registros = []
+        for rowid, texto in conexao.execute(
+                f"SELECT id, dados FROM {banco_sqlite.TABELAS['estoque']} ORDER BY id"):
+            registro = json.loads(texto)
+            # Produtos gravados antes dos ids usam o rowid como id
+            registro.setdefault('id', rowid)
+            registros.append(registro)
+        proximo_id = 1
+        if banco_sqlite.TABELA_CONTROLE in tabelas:
+            linha = conexao.execute(
+                f"SELECT valor FROM {banco_sqlite.TABELA_CONTROLE} WHERE chave = 'proximo_id'"
+            ).fetchone()
+            proximo_id = linha[0] if linha else 1
+    except (sqlite3.DatabaseError, ValueError) as e:
+        _problema(relatorio, "produtos ilegíveis", local, f" ({e})")
+        proximo_id = None
+    else:
+        proximo_id = _verificar_produtos(relatorio, registros, proximo_id)
+
+    for tipo in banco.HISTORICOS:
+        tabela = banco_sqlite.TABELAS[tipo]
+        if tabela not in tabelas:
+            continue
+        quantidade = 0
+        for quantidade, (texto,) in enumerate(
+                conexao.execute(f"SELECT dados FROM {tabela} ORDER BY id"), 1):
+            try:
+                registro = json.loads(texto)
+            except ValueError:
+                _problema(relatorio, "registro ilegível", f"{tipo} registro {quantidade}")
+                continue
+            _verificar_registro(relatorio, tipo, f"{tipo} registro {quantidade}",
+                                registro, proximo_id)
+        mostrar(f"{tipo}: {quantidade} registros")
+
+
+def _verificar_dados(relatorio, mostrar):
+    _verificar_pendencias(relatorio)
+    if banco.BACKEND == 'sqlite' and banco_sqlite.existe():
+        _verificar_sqlite(relatorio, mostrar)
+    else:
+        # Sem o banco ainda, os arquivos JSON são os dados que ele importará
+        _verificar_json(relatorio, mostrar)
+
+
+# Backups
+
+def _verificar_backups(relatorio, mostrar):
+    objetos = backup.inventario(gravar=False)
+    # chave -> linhas do pedaço (None se ele está ausente ou corrompido)
+    linhas_por_chave = {}
+    entradas = backup.catalogo(gravar=False)
+    for entrada in entradas:
+        nome = entrada['nome']
+        local = f"backup {nome}"
+        try:
+            with open(os.path.join(backup.PASTA_GERACOES, nome + '.json'), 'rb') as file:
+                conteudo = file.read()
+            manifesto = json.loads(conteudo)
+        except (OSError, ValueError) as e:
+            _problema(relatorio, "manifesto ilegível", local, f" ({e})")
+            continue
+        if hashlib.sha256(conteudo).hexdigest() != entrada['sha256']:
+            _problema(relatorio, "manifesto diferente do catálogo", local)
+
+        listas = dict(manifesto['colecoes'])
+        listas.update((tipo, [[pedaco[0], pedaco[2]] for pedaco in historico['pedacos']])
+                      for tipo, historico in manifesto['historicos'].items())
+        for colecao, pedacos in listas.items():
+            total = 0
+            for chave, quantidade in pedacos:
+                if chave not in linhas_por_chave:
+                    linhas_por_chave[chave] = _verificar_pedaco(relatorio, chave, objetos)
+                if linhas_por_chave[chave] is not None and linhas_por_chave[chave] != quantidade:
+                    _problema(relatorio, "pedaço com quantidade de registros diferente do manifesto",
+                              f"{local} {colecao}", f" ({chave[:12]})")
+                total += quantidade
+            if total != entrada['registros'].get(colecao, total):
+                _problema(relatorio, "quantidade de registros diferente do catálogo",
+                          f"{local} {colecao}")
+    mostrar(f"Backups: {len(entradas)} gerações, {len(linhas_por_chave)} pedaços conferidos")
+
+
+def _verificar_pedaco(relatorio, chave, objetos):
+    local = f"pedaço {chave[:12]}"
+    if chave not in objetos:
+        _problema(relatorio, "pedaço fora do inventário", local)
+    try:
+        dados = backup.ler_objeto(chave)
+    except FileNotFoundError:
+        _problema(relatorio, "pedaço ausente", local)
+        return None
+    except (OSError, ValueError) as e:
+        _problema(relatorio, "pedaço corrompido", local, f" ({e})")
+        return None
+
+    linhas = dados.splitlines()
+    for linha in linhas:
+        try:
+            json.loads(linha)
+        except ValueError:
+            _problema(relatorio, "registro ilegível no pedaço", local)
+            break
+    return len(linhas)
+
+
+def verificar(dados=True, backups=True, mostrar=print):
+    """
+    Confere os dados e/ou os backups, mostrando o resumo de cada arquivo
+    conforme avança. Devolve o relatório: 'problemas' (os primeiros
+    LIMITE_PROBLEMAS, com detalhes), 'por_tipo' (quantos de cada tipo) e
+    'pendencias' (migrações, conversões e restaurações que o programa fará ao
+    ser aberto; não são problemas).
+    """
+    relatorio = {'problemas': [], 'por_tipo': Counter(), 'pendencias': [],
+                 'dados_ilegiveis': False}
+    inicio = time.perf_counter()
+    if dados:
+        _verificar_dados(relatorio, mostrar)
+    # Sem nenhum backup não há o que conferir (e a trava criaria o arquivo dela)
+    if backups and (os.path.exists(backup.CATALOGO) or os.path.exists(backup.PASTA_GERACOES)):
+        with backup.trava():
+            _verificar_backups(relatorio, mostrar)
+    mostrar(f"Verificação concluída em {time.perf_counter() - inicio:.1f} s")
+    return relatorio
@@ -1,6 +1,18 @@
+import argparse
 import os
 import sys
-from estoque import banco, operacoes, backup
+import time
+from datetime import datetime
+
+_inicio = time.perf_counter()
+
+from estoque import banco, datas, operacoes, backup, retencao, tarefas
+
+# ESTOQUE_TEMPOS=1 mostra quanto tempo a inicialização levou
+MOSTRAR_TEMPOS = os.environ.get('ESTOQUE_TEMPOS') == '1'
+
+# Módulos lentos de importar que não devem ser carregados antes do menu
+MODULOS_PESADOS = ('pandas', 'xlsxwriter', 'keyboard')
 
 
 def exibir_menu():
@@ -25,11 +37,256 @@ def exibir_menu():
     for i, opcao in enumerate(opcoes, 1):
         print(f"{i}. {opcao}")
 
+    # Relatórios sendo gerados em segundo plano
+    andamento = tarefas.status()
+    if andamento:
+        print()
+        for linha in andamento:
+            print(f"[em andamento] {linha}")
+
+
+def mostrar_tempos_inicializacao(fim_importacoes, fim_carga):
+    print(f"Importações: {(fim_importacoes - _inicio) * 1000:.1f} ms")
+    print(f"Carga dos dados: {(fim_carga - fim_importacoes) * 1000:.1f} ms")
+    print(f"Total até o menu: {(fim_carga - _inicio) * 1000:.1f} ms")
+    conferir_importacoes()
+
+
+def conferir_importacoes():
+    """Avisa se algum módulo pesado foi importado durante a inicialização."""
+    carregados = [nome for nome in MODULOS_PESADOS if nome in sys.modules]
+    if carregados:
+        print(f"Aviso: módulos pesados importados na inicialização: {', '.join(carregados)}")
+    return not carregados
+
+
+def mostrar_avisos():
+    """Avisa dos relatórios em segundo plano que terminaram."""
+    for aviso in tarefas.avisos():
+        print(f"\n>>> {aviso}")
+
+
+def encerrar():
+    if tarefas.em_andamento():
+        print("Aguardando os relatórios em geração terminarem...")
+        tarefas.aguardar()
+        mostrar_avisos()
+    print("Encerrando sistema...")
+    banco.consolidar_diario()
+    backup.salvar_backup()
+    exit()
+
+
+def ler_argumentos(argv=None):
+    """Sem comando o programa abre o menu interativo."""
+    parser = argparse.ArgumentParser(description="Gerenciador de Estoque")
+    comandos = parser.add_subparsers(dest='comando')
+
+    importar = comandos.add_parser(
+        'importar', help="importa entradas no estoque a partir de planilhas CSV ou XLSX")
+    importar.add_argument('arquivos', nargs='+', help="planilhas de entradas")
+    importar.add_argument('--simular', action='store_true',
+                          help="só valida e mostra o que seria importado")
+
+    expedir = comandos.add_parser(
+        'expedir', help="registra as expedições de uma planilha (id ou partNumber e quantidade)")
+    expedir.add_argument('arquivo', help="planilha de expedições")
+    expedir.add_argument('--prefixo', default='', help="prefixo que recebe as peças")
+    expedir.add_argument('--data', help="data das expedições, DD/MM/AAAA (padrão: hoje)")
+    expedir.add_argument('--placa', default='', help="placa da camionete (peças AUTO)")
+    expedir.add_argument('--badeco', default='', help="nome do badeco (peças EPI)")
+    expedir.add_argument('--simular', action='store_true',
+                         help="só valida e mostra o que seria registrado")
+
+    relatorio = comandos.add_parser(
+        'relatorio', help="gera relatórios de saídas (de um período ou dos meses de um ano)")
+    relatorio.add_argument('periodo', nargs='*', metavar='DD/MM/AAAA',
+                           help="data inicial e data final")
+    relatorio.add_argument('--ano', type=int, help="um relatório para cada mês do ano")
+    relatorio.add_argument('--prefixo', action='append', default=[],
+                           help="também um extrato do prefixo no período (pode repetir)")
+    relatorio.add_argument('--processos', type=int,
+                           help="processos usados para escrever os arquivos")
+
+    backups = comandos.add_parser('backups', help="lista as gerações de backup")
+    backups.add_argument('--compactar', action='store_true',
+                         help="antes aplica a retenção e apaga os backups que saíram dela")
+
+    restaurar = comandos.add_parser(
+        'restaurar', help="restaura uma geração de backup (mostra antes as diferenças)")
+    restaurar.add_argument('geracao', help="nome da geração (ver o comando backups)")
+    restaurar.add_argument('--simular', action='store_true',
+                           help="só compara a geração com os dados atuais")
+    restaurar.add_argument('--confirmar', action='store_true',
+                           help="restaura sem pedir confirmação")
+
+    verificar = comandos.add_parser(
+        'verificar', help="confere a integridade dos dados e dos backups")
+    verificar.add_argument('--sem-backups', action='store_true', help="só os dados")
+    verificar.add_argument('--sem-dados', action='store_true', help="só os backups")
+
+    args = parser.parse_args(argv)
+    if args.comando == 'relatorio' and not args.ano and len(args.periodo) != 2:
+        parser.error("informe a data inicial e a final, ou --ano")
+    return args
+
+
+def comando_importar(args):
+    # O pandas só é importado quando o comando é usado
+    from estoque import lote
+
+    resultados = [lote.importar_entradas(arquivo, args.simular) for arquivo in args.arquivos]
+    return 0 if all(resultados) else 1
+
+
+def comando_expedir(args):
+    from estoque import lote
+
+    if args.data is None:
+        data = datetime.now().strftime("%d/%m/%Y")
+    else:
+        try:
+            data = datetime.strptime(args.data, "%d/%m/%Y").strftime("%d/%m/%Y")
+        except ValueError:
+            print("Data inválida! Use o formato DD/MM/AAAA")
+            return 1
+    expedido = lote.expedir(args.arquivo, args.prefixo, data, args.placa, args.badeco,
+                            args.simular)
+    return 0 if expedido else 1
+
+
+def comando_relatorio(args):
+    from estoque import relatorios
+
+    if args.ano:
+        periodos = datas.meses(args.ano)
+        ano = (f'01/01/{args.ano}', f'31/12/{args.ano}')
+    else:
+        periodos = [tuple(args.periodo)]
+        ano = periodos[0]
+    pedidos = periodos + [ano + (prefixo,) for prefixo in args.prefixo]
+
+    caminho_relatorios = operacoes.criar_pasta_relatorios()
+    if not caminho_relatorios:
+        print("Erro: Não foi possível criar a pasta de relatórios")
+        return 1
+    try:
+        caminhos = relatorios.gerar_lote(caminho_relatorios, pedidos, args.processos)
+    except ValueError:
+        print("Erro: Use o formato DD/MM/AAAA!")
+        return 1
+
+    for pedido, caminho in zip(pedidos, caminhos):
+        descricao = ' a '.join(pedido[:2]) + (f' ({pedido[2]})' if len(pedido) > 2 else '')
+        print(f"{descricao}: {caminho or 'nenhum dado encontrado'}")
+    return 0
+
+
+def comando_backups(args):
+    from estoque import restauracao
+
+    if args.compactar:
+        geracoes, pedacos, liberados = retencao.compactar()
+        print(f"Compactação: {geracoes} gerações e {pedacos} pedaços apagados, "
+              f"{liberados / 1024:.1f} KB liberados.")
+
+    geracoes = restauracao.listar()
+    if not geracoes:
+        print("Nenhum backup encontrado.")
+    for geracao in geracoes:
+        registros = geracao['registros']
+        print(f"{geracao['nome']}  {geracao['data']}  "
+              f"{registros.get('estoque', 0)} produtos, "
+              f"{registros.get('estoque_entradas', 0)} entradas, "
+              f"{registros.get('estoque_saidas', 0)} saídas")
+    return 0
+
+
+def comando_restaurar(args):
+    from estoque import restauracao
+
+    try:
+        for linha in restauracao.diferencas(args.geracao):
+            print(linha)
+    except (OSError, ValueError) as e:
+        print(f"Erro: {e}")
+        return 1
+    if args.simular:
+        return 0
+    if not args.confirmar:
+        resposta = input("\nSubstituir os dados atuais por este backup? (s/n): ")
+        if resposta.strip().lower() != 's':
+            print("Restauração cancelada.")
+            return 1
+
+    # O estado atual vira uma geração, para a restauração poder ser desfeita
+    backup.salvar_backup()
+    try:
+        restauracao.restaurar(args.geracao)
+    except (OSError, ValueError) as e:
+        print(f"Erro ao restaurar: {e}")
+        print("Os dados atuais não foram alterados.")
+        return 1
+    print(f"Backup {args.geracao} restaurado.")
+    return 0
+
+
+def comando_verificar(args):
+    from estoque import verificacao
+
+    relatorio = verificacao.verificar(dados=not args.sem_dados, backups=not args.sem_backups)
+    if relatorio['pendencias']:
+        print("\nPendente (será feito ao abrir o programa):")
+        for pendencia in relatorio['pendencias']:
+            print(f"  {pendencia}")
+
+    total = sum(relatorio['por_tipo'].values())
+    if not total:
+        print("Nenhum problema encontrado.")
+        return 0
+
+    print(f"\n{total} problema(s) encontrado(s):")
+    for problema in relatorio['problemas']:
+        print(f"  {problema}")
+    if total > len(relatorio['problemas']):
+        print(f"  ... e mais {total - len(relatorio['problemas'])}. Por tipo:")
+        for tipo, quantidade in relatorio['por_tipo'].most_common():
+            print(f"  {quantidade:>8}  {tipo}")
+    return 1
+
+
+def main(argv=None):
+    args = ler_argumentos(argv)
+    if args.comando == 'verificar':
+        # Não carrega os dados: a verificação só lê os arquivos, sem alterá-los
+        return comando_verificar(args)
+    fim_importacoes = time.perf_counter()
+    try:
+        banco.carregar_dados()
+    except ValueError as e:
+        # Por exemplo um histórico antigo corrompido, que não é convertido
+        print(f"Erro ao carregar os dados: {e}")
+        return 1
+    if MOSTRAR_TEMPOS:
+        mostrar_tempos_inicializacao(fim_importacoes, time.perf_counter())
 
-def main():
-    banco.carregar_dados()
+    if args.comando == 'importar':
+        return comando_importar(args)
+    if args.comando == 'expedir':
+        return comando_expedir(args)
+    if args.comando == 'relatorio':
+        return comando_relatorio(args)
+    if args.comando == 'backups':
+        return comando_backups(args)
+    if args.comando == 'restaurar':
+        return comando_restaurar(args)
 
+    # Aplica a retenção dos backups enquanto o menu é usado
+    retencao.iniciar()
     while True:
+        # Relê o que outros terminais gravaram desde a última ação
+        banco.sincronizar()
+        mostrar_avisos()
         exibir_menu()
 
         try:
@@ -46,7 +303,7 @@ def main():
                 8: operacoes.excluir_produto,
                 9: operacoes.executar_relatorio,
                 10: operacoes.abrir_pasta_relatorios,
-                11: lambda: (print("Encerrando sistema..."), backup.salvar_backup(), exit())
+                11: encerrar
             }
 
             if escolha in acoes:
@@ -59,4 +316,7 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    # Relatórios em lote usam processos; necessário no executável do Windows
+    import multiprocessing
+    multiprocessing.freeze_support()
+    sys.exit(main())
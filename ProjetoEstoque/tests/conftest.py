@@ -0,0 +1,64 @@
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from estoque import banco, banco_sqlite  # noqa: E402
+
+
+@pytest.fixture
+def pasta(request, tmp_path, monkeypatch):
+    """
+    Uma pasta de dados vazia (backup/ dentro de tmp_path) e o banco carregado
+    dela. O backend é 'json', ou o parâmetro indireto do teste.
+    """
+    backend = getattr(request, 'param', 'json')
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('ESTOQUE_BACKEND', backend)
+    monkeypatch.setattr(banco, 'BACKEND', backend)
+    banco_sqlite.desconectar()
+    banco._historicos_migrados.clear()
+    banco.carregar_dados()
+    yield tmp_path
+    banco_sqlite.desconectar()
+
+
+@pytest.fixture
+def outro_terminal(pasta):
+    """
+    Roda um trecho de código em outro processo, com a mesma pasta de dados e
+    o banco já carregado (como um segundo terminal). Devolve o que ele imprimiu.
+    """
+    def rodar(codigo, timeout=30):
+        script = (f"import sys\nsys.path.insert(0, {RAIZ!r})\n"
+                  f"from estoque import banco\nbanco.carregar_dados()\n"
+                  + textwrap.dedent(codigo))
+        resultado = subprocess.run([sys.executable, '-c', script], capture_output=True,
+                                   text=True, timeout=timeout)
+        assert resultado.returncode == 0, resultado.stderr
+        return resultado.stdout
+    return rodar
+
+
+@pytest.fixture
+def arquivos(pasta):
+    """
+    Função que lê o conteúdo de cada arquivo de backup/, para comparar antes e
+    depois. O -shm do SQLite fica de fora: ele muda também numa leitura.
+    """
+    def ler():
+        conteudos = {}
+        for diretorio, _subpastas, nomes in os.walk(os.path.join(pasta, 'backup')):
+            for nome in nomes:
+                if nome.endswith('-shm'):
+                    continue
+                caminho = os.path.join(diretorio, nome)
+                with open(caminho, 'rb') as file:
+                    conteudos[os.path.relpath(caminho, pasta)] = file.read()
+        return conteudos
+    return ler
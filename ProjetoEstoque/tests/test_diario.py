@@ -0,0 +1,133 @@
+# Diário (backup/diario.jsonl) e checkpoint no modo JSON: recuperação depois
+# de uma queda em cada ponto da gravação.
+
+import hashlib
+import json
+import os
+
+import pytest
+
+from estoque import banco
+
+
+def _reiniciar():
+    """Como abrir o programa de novo: tudo é relido do disco."""
+    banco.carregar_dados()
+
+
+def _gravacoes():
+    with open(banco.ARQUIVO_DIARIO, 'rb') as file:
+        return [json.loads(linha) for linha in file]
+
+
+def _ler(colecao):
+    with open(os.path.join(banco.PASTA, f'{colecao}.json'), 'rb') as file:
+        return json.load(file)
+
+
+def _preparar():
+    """Um produto já no checkpoint e uma alteração dele só no diário."""
+    with banco.transacao():
+        banco.inserir('estoque', {'nome': 'Parafuso', 'quantidade': 5})
+    banco.consolidar_diario()
+    with banco.transacao():
+        banco.atualizar('estoque', banco.produtos[1], {'quantidade': 2})
+        banco.inserir('descarte', {'nome': 'Parafuso', 'quantidade': 3, 'data': '01/02/2026'})
+
+
+def test_linha_incompleta_no_fim_do_diario(pasta):
+    _preparar()
+    sequencia = _gravacoes()[-1]['s']
+    # Queda no meio da gravação seguinte
+    with open(banco.ARQUIVO_DIARIO, 'ab') as file:
+        file.write(b'{"s":%d,"alteracoes":[{"op":"remover","c":"est' % (sequencia + 1))
+
+    _reiniciar()
+    assert banco.produtos[1]['quantidade'] == 2
+    assert len(banco.descarte) == 1
+
+    # A próxima gravação corta o resto antes de anexar
+    with banco.transacao():
+        banco.atualizar('estoque', banco.produtos[1], {'quantidade': 1})
+    assert [gravacao['s'] for gravacao in _gravacoes()] == [sequencia, sequencia + 1]
+
+    _reiniciar()
+    assert banco.produtos[1]['quantidade'] == 1
+    assert len(banco.descarte) == 1
+
+
+def test_queda_entre_o_checkpoint_e_a_troca_dos_arquivos(pasta, monkeypatch):
+    _preparar()
+    escrever = banco._escrever_atomico
+
+    def queda(caminho, conteudo):
+        if caminho == os.path.join(banco.PASTA, 'estoque.json'):
+            raise OSError("queda")
+        escrever(caminho, conteudo)
+
+    with monkeypatch.context() as trocas, pytest.raises(OSError):
+        trocas.setattr(banco, '_escrever_atomico', queda)
+        banco.consolidar_diario()
+
+    # O checkpoint já fala do arquivo novo, mas no disco está o antigo
+    with open(os.path.join(banco.PASTA, 'estoque.json'), 'rb') as file:
+        sha1 = hashlib.sha1(file.read()).hexdigest()
+    assert banco._ler_checkpoint()['estoque']['sha1'] != sha1
+    assert _ler('estoque')[0]['quantidade'] == 5
+
+    # Vale a sequência anterior do checkpoint: o diário é reaplicado
+    _reiniciar()
+    assert banco.produtos[1]['quantidade'] == 2
+    assert len(banco.descarte) == 1
+
+
+def test_queda_antes_de_apagar_o_diario(pasta, monkeypatch):
+    _preparar()
+    repetir = banco._repetir
+
+    def queda(funcao, *args):
+        if funcao is os.remove and args == (banco.ARQUIVO_DIARIO,):
+            raise OSError("queda")
+        return repetir(funcao, *args)
+
+    with monkeypatch.context() as trocas, pytest.raises(OSError):
+        trocas.setattr(banco, '_repetir', queda)
+        banco.consolidar_diario()
+    assert os.path.exists(banco.ARQUIVO_DIARIO)
+
+    # Os arquivos já têm o diário: ele não é aplicado de novo (o descarte
+    # seria inserido duas vezes)
+    _reiniciar()
+    assert banco.produtos[1]['quantidade'] == 2
+    assert len(banco.descarte) == 1
+
+
+def test_consolidacao_no_limite_sem_carregar_as_colecoes_sob_demanda(pasta, monkeypatch):
+    _preparar()
+    monkeypatch.setattr(banco, 'LIMITE_DIARIO', 4)
+    _reiniciar()
+    # O descarte gravado só no diário fica guardado até o primeiro acesso
+    assert not any(colecao in vars(banco) for colecao in banco.SOB_DEMANDA)
+
+    for quantidade in (4, 3):
+        with banco.transacao():
+            banco.atualizar('estoque', banco.produtos[1], {'quantidade': quantidade})
+        assert os.path.exists(banco.ARQUIVO_DIARIO)
+    with banco.transacao():
+        banco.atualizar('estoque', banco.produtos[1], {'quantidade': 1})
+
+    # Quatro gravações no diário (a de _preparar e estas três): ele foi
+    # consolidado, com o descarte adiado
+    assert not os.path.exists(banco.ARQUIVO_DIARIO)
+    assert _ler('estoque')[0]['quantidade'] == 1
+    assert [registro['quantidade'] for registro in _ler('descarte')] == [3]
+    assert 'entradas' not in vars(banco) and 'saidas' not in vars(banco)
+
+    checkpoint = banco._ler_checkpoint()
+    for colecao in ('estoque', 'descarte'):
+        with open(os.path.join(banco.PASTA, f'{colecao}.json'), 'rb') as file:
+            assert checkpoint[colecao]['sha1'] == hashlib.sha1(file.read()).hexdigest()
+
+    _reiniciar()
+    assert banco.produtos[1]['quantidade'] == 1
+    assert len(banco.descarte) == 1
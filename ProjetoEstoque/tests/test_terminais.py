@@ -0,0 +1,208 @@
+# Dois terminais com a mesma pasta backup/: este processo e outro_terminal
+# (outro processo, com o seu próprio estado do banco).
+
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from estoque import banco
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+pytestmark = pytest.mark.parametrize('pasta', ['json', 'sqlite'], indirect=True)
+
+
+def _inserir(**produto):
+    with banco.transacao():
+        banco.inserir('estoque', produto)
+    return produto['id']
+
+
+def _saidas(outro_terminal):
+    return json.loads(outro_terminal(
+        "import json\nprint(json.dumps(list(banco.iterar_historico('estoque_saidas'))))"))
+
+
+@pytest.mark.parametrize('inicial, tirado_la, tirado_aqui, final', [
+    (10, 3, 2, 5),
+    (2.5, 1.3, 0.2, 1.0),
+])
+def test_saidas_simultaneas_contam_as_duas(pasta, outro_terminal,
+                                           inicial, tirado_la, tirado_aqui, final):
+    id_produto = _inserir(nome='Parafuso', quantidade=inicial)
+    outro_terminal(f"""
+        with banco.transacao():
+            p = banco.produtos[{id_produto}]
+            banco.atualizar('estoque', p, {{'quantidade': p['quantidade'] - {tirado_la}}})
+    """)
+
+    # Este terminal ainda vê a quantidade inicial
+    with banco.transacao():
+        p = banco.produtos[id_produto]
+        banco.atualizar('estoque', p, {'quantidade': p['quantidade'] - tirado_aqui})
+
+    assert banco.produtos[id_produto]['quantidade'] == final
+    assert json.loads(outro_terminal(
+        f"print(banco.produtos[{id_produto}]['quantidade'])")) == final
+
+
+def test_saida_que_deixaria_quantidade_negativa_e_recusada(pasta, outro_terminal):
+    id_produto = _inserir(nome='Parafuso', quantidade=5)
+    outro_terminal(f"""
+        with banco.transacao():
+            p = banco.produtos[{id_produto}]
+            banco.atualizar('estoque', p, {{'quantidade': 1}})
+            banco.anexar_historico('estoque_saidas', {{'produto_id': {id_produto}, 'quantidade': 4}})
+    """)
+
+    with pytest.raises(ValueError, match="quantidade ficaria"):
+        with banco.transacao():
+            p = banco.produtos[id_produto]
+            banco.atualizar('estoque', p, {'quantidade': p['quantidade'] - 3})
+            banco.anexar_historico('estoque_saidas', {'produto_id': id_produto, 'quantidade': 3})
+
+    # Os dados foram relidos e nada deste terminal foi gravado
+    assert banco.produtos[id_produto]['quantidade'] == 1
+    assert not banco._pendentes and not banco._historico_pendente
+    assert [s['quantidade'] for s in _saidas(outro_terminal)] == [4]
+
+
+def test_insercao_e_remocao_simultaneas(pasta, outro_terminal):
+    a = _inserir(nome='A', quantidade=1)
+    b = _inserir(nome='B', quantidade=1)
+    outro_terminal(f"""
+        with banco.transacao():
+            banco.inserir('estoque', {{'nome': 'C', 'quantidade': 1}})
+            banco.remover('estoque', banco.produtos[{a}])
+    """)
+
+    with banco.transacao():
+        novo = {'nome': 'D', 'quantidade': 2}
+        banco.inserir('estoque', novo)
+        banco.anexar_historico('estoque_entradas', dict(novo))
+        banco.remover('estoque', banco.produtos[b])
+
+    # D não pode ficar com o id que C já recebeu no outro terminal
+    nomes = {id_produto: p['nome'] for id_produto, p in banco.produtos.items()}
+    assert sorted(nomes.values()) == ['C', 'D']
+    id_d = next(id_produto for id_produto, nome in nomes.items() if nome == 'D')
+    assert id_d > max(a, b) + 1
+    assert json.loads(outro_terminal(
+        "import json\nprint(json.dumps({p['nome']: i for i, p in banco.produtos.items()}))"
+    )) == {'C': id_d - 1, 'D': id_d}
+    # A entrada registrada acompanha o id novo
+    entradas = json.loads(outro_terminal(
+        "import json\nprint(json.dumps(list(banco.iterar_historico('estoque_entradas'))))"))
+    assert [e['id'] for e in entradas] == [id_d]
+
+    # O id de um produto removido não volta a ser usado
+    assert _inserir(nome='E', quantidade=1) == id_d + 1
+
+
+def test_remocao_de_produto_que_recebeu_entrada_em_outro_terminal(pasta, outro_terminal):
+    id_produto = _inserir(nome='Parafuso', quantidade=2)
+    outro_terminal(f"""
+        with banco.transacao():
+            p = banco.produtos[{id_produto}]
+            banco.atualizar('estoque', p, {{'quantidade': p['quantidade'] + 3}})
+    """)
+
+    # Como registrar_saida: tira tudo que vê e remove o produto zerado
+    with banco.transacao():
+        p = banco.produtos[id_produto]
+        banco.atualizar('estoque', p, {'quantidade': p['quantidade'] - 2})
+        banco.remover('estoque', p)
+
+    assert banco.produtos[id_produto]['quantidade'] == 3
+
+
+def test_campo_nao_somado_fica_com_o_valor_gravado_por_ultimo(pasta, outro_terminal):
+    id_produto = _inserir(nome='Parafuso', quantidade=10, valor=1.0)
+    outro_terminal(f"""
+        with banco.transacao():
+            p = banco.produtos[{id_produto}]
+            banco.atualizar('estoque', p, {{'valor': 2.0, 'quantidade': p['quantidade'] - 1}})
+    """)
+
+    with banco.transacao():
+        banco.atualizar('estoque', banco.produtos[id_produto], {'valor': 3.0})
+
+    # O valor daqui substitui o do outro terminal; a quantidade dele fica
+    produto = banco.produtos[id_produto]
+    assert (produto['valor'], produto['quantidade'], produto['nome']) == (3.0, 9, 'Parafuso')
+
+
+def test_alterar_produto_removido_em_outro_terminal(pasta, outro_terminal):
+    a = _inserir(nome='A', quantidade=5)
+    b = _inserir(nome='B', quantidade=5)
+    remover = "with banco.transacao():\n    banco.remover('estoque', banco.produtos[{}])"
+
+    # Só um campo não somado: a alteração é descartada sem erro
+    outro_terminal(remover.format(a))
+    with banco.transacao():
+        banco.atualizar('estoque', banco.produtos[a], {'valor': 3.0})
+    assert a not in banco.produtos
+
+    outro_terminal(remover.format(b))
+    with pytest.raises(ValueError, match="foi removido em outro terminal"):
+        with banco.transacao():
+            banco.atualizar('estoque', banco.produtos[b], {'quantidade': 4})
+    assert not banco.produtos and not banco._pendentes
+
+
+def test_trava_e_liberada_depois_de_um_erro(pasta, outro_terminal):
+    with pytest.raises(RuntimeError):
+        with banco.trava():
+            raise RuntimeError("falha no meio da gravação")
+    # Com a trava presa o outro terminal esperaria até o timeout
+    outro_terminal("with banco.trava():\n    pass", timeout=10)
+
+    # Também depois de uma gravação recusada por conflito
+    id_produto = _inserir(nome='Parafuso', quantidade=1)
+    outro_terminal(f"""
+        with banco.transacao():
+            banco.remover('estoque', banco.produtos[{id_produto}])
+    """)
+    with pytest.raises(ValueError):
+        with banco.transacao():
+            banco.atualizar('estoque', banco.produtos[id_produto], {'quantidade': 0})
+    outro_terminal("with banco.transacao():\n"
+                   "    banco.inserir('estoque', {'nome': 'X', 'quantidade': 1})", timeout=10)
+
+
+def test_trava_exclui_outro_processo_ate_ser_liberada(pasta):
+    script = (f"import sys, time\nsys.path.insert(0, {RAIZ!r})\n"
+              f"from estoque import banco\n"
+              f"with banco.trava():\n    print(time.time())\n")
+    with banco.trava():
+        processo = subprocess.Popen([sys.executable, '-c', script],
+                                    stdout=subprocess.PIPE, text=True)
+        time.sleep(1)
+        liberada = time.time()
+    saida, _ = processo.communicate(timeout=10)
+    assert float(saida) >= liberada
+
+
+def test_trava_reentrante_e_exclusiva_entre_threads(pasta):
+    eventos = []
+
+    def outra_thread():
+        with banco.trava():
+            eventos.append('outra thread')
+
+    with banco.trava():
+        # Quem já tem a trava pode pedi-la de novo
+        with banco.trava():
+            thread = threading.Thread(target=outra_thread)
+            thread.start()
+            thread.join(0.2)
+        # Ainda presa pelo bloco de fora
+        thread.join(0.2)
+        assert eventos == []
+    thread.join(5)
+    assert eventos == ['outra thread']
@@ -0,0 +1,77 @@
+# Erro no meio de uma operação decorada com salvar_dados_seguro: o desfazer
+# da transação volta a memória ao estado do início e nada é gravado.
+
+import copy
+
+import pytest
+
+from estoque import banco, indice_busca, operacoes
+
+pytestmark = pytest.mark.parametrize('pasta', ['json', 'sqlite'], indirect=True)
+
+
+def _estado():
+    return {
+        'produtos': copy.deepcopy(list(banco.produtos.items())),
+        'sujas': set(banco._sujas),
+        'originais': copy.deepcopy(banco._originais),
+        'proximo_id': banco._proximo_id,
+        'busca': [p['id'] for p in indice_busca.buscar('nome', 'Parafuso')],
+    }
+
+
+def _preparar():
+    with banco.transacao():
+        banco.inserir('estoque', {'nome': 'Parafuso', 'modelo': 'M6', 'classificacao': 'CONS',
+                                  'quantidade': 5, 'valor': 2.0})
+        banco.inserir('estoque', {'nome': 'Porca', 'modelo': 'M6', 'classificacao': 'CONS',
+                                  'quantidade': 3, 'valor': 1.0})
+
+
+def _falhar(*args, **kwargs):
+    raise OSError("disco cheio")
+
+
+def test_saida_com_erro_no_segundo_passo_e_desfeita(pasta, arquivos, monkeypatch):
+    _preparar()
+    antes, disco = _estado(), arquivos()
+
+    respostas = iter(['1', 'Parafuso', '1', '5', '01/02/2026', '', ''])
+    monkeypatch.setattr('builtins.input', lambda *args: next(respostas))
+    monkeypatch.setattr(operacoes, 'limpar_tela', lambda: None)
+    # A quantidade já foi alterada quando o histórico falha
+    monkeypatch.setattr(banco, 'anexar_historico', _falhar)
+    assert operacoes.registrar_saida() is None
+
+    assert _estado() == antes
+    assert not banco._pendentes and not banco._historico_pendente
+    assert arquivos() == disco
+
+    banco.carregar_dados()
+    assert copy.deepcopy(list(banco.produtos.items())) == antes['produtos']
+
+
+def test_insercao_alteracao_e_remocao_desfeitas(pasta, arquivos):
+    _preparar()
+    antes, disco = _estado(), arquivos()
+
+    @operacoes.salvar_dados_seguro
+    def operacao():
+        banco.inserir('estoque', {'nome': 'Parafuso', 'modelo': 'M8', 'classificacao': 'CONS',
+                                  'quantidade': 1, 'valor': 3.0})
+        banco.atualizar('estoque', banco.produtos[1], {'quantidade': 4, 'observacoes': 'x'})
+        banco.remover('estoque', banco.produtos[2])
+        banco.inserir('descarte', {'nome': 'Porca', 'quantidade': 1, 'data': '01/02/2026'})
+        raise RuntimeError("falha no meio")
+
+    assert operacao() is None
+
+    # O id reservado pelo produto desfeito volta a ser o próximo
+    assert _estado() == antes
+    assert not banco._pendentes and not banco._historico_pendente
+    assert banco.descarte == []
+    assert arquivos() == disco
+
+    with banco.transacao():
+        banco.inserir('estoque', {'nome': 'Arruela', 'quantidade': 1})
+    assert max(banco.produtos) == antes['proximo_id']